@@ -0,0 +1,80 @@
+"""
+Micro-batching: items submitted from many threads are collected into batches that one
+dispatcher thread runs together. Used by the server for requests and by background
+removal for model runs.
+"""
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+DEFAULT_MAX_BATCH = 8
+DEFAULT_BATCH_WAIT = 0.005
+
+
+class Batcher:
+    """
+    Runs queued items in micro-batches on a dispatcher thread.
+
+    :param process_batch: Called with a list of items; returns one (result, error) pair per item.
+    :param max_queue: The most items that can wait; submit() raises queue.Full beyond it. 0 is no limit.
+    :param max_batch: The most items in a batch.
+    :param max_wait: How long to wait for more items after the first one of a batch, in seconds.
+    """
+
+    def __init__(self, process_batch, max_queue=0, max_batch=DEFAULT_MAX_BATCH, max_wait=DEFAULT_BATCH_WAIT):
+        self._process_batch = process_batch
+        self._queue = queue.Queue(maxsize=max_queue)
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.batch_sizes = deque(maxlen=10000)
+        self._thread = threading.Thread(target=self._run, name='batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, item):
+        """
+        Queues an item.
+
+        :return: A Future with the item's result.
+        :raises queue.Full: If the queue is full; the caller should reject the work.
+        """
+        future = Future()
+        self._queue.put_nowait((item, future))
+        return future
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def close(self):
+        """Runs the items already queued, then stops the dispatcher."""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        closing = False
+        while not closing:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = [first]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    closing = True
+                    break
+                batch.append(item)
+            self.batch_sizes.append(len(batch))
+            try:
+                outcomes = self._process_batch([item for item, _ in batch])
+            except Exception as e:
+                outcomes = [(None, e)] * len(batch)
+            for (_, future), (result, error) in zip(batch, outcomes):
+                if error is None:
+                    future.set_result(result)
+                else:
+                    future.set_exception(error)
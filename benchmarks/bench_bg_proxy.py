@@ -0,0 +1,125 @@
+"""
+Benchmark of proxy-resolution background removal (--bg-proxy) against the full-resolution path.
+
+Scales each test image up to the given sizes (longest side, in pixels) and removes its
+background both ways with the real rembg model, timing the whole remove_background()
+call. The quality of the proxy path is measured against the mask of the full-resolution
+path: the mean absolute difference of the alpha values (0-255), the same within a few
+pixels of the outline, and the intersection over union of the masks thresholded at 128.
+
+Needs the rembg model; when it cannot be loaded (e.g. without network access for the
+first download) the benchmark says so and exits without results.
+
+Usage:
+    python benchmarks/bench_bg_proxy.py [--sizes 1024 2048 4096] [--proxy 1024] [--model u2net]
+                                        [--images tests/test_images] [--output bg_proxy.json]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from remove_background import (DEFAULT_MODEL, DEFAULT_PROXY_SIZE, SessionPool, make_proxy, remove,
+                               remove_background, upsample_mask)
+
+TEST_IMAGES = os.path.join(os.path.dirname(__file__), '..', 'tests', 'test_images')
+
+# Pixels this close to the outline of the full-resolution mask count as edge pixels
+EDGE_WIDTH = 3
+
+
+def compare_masks(mask, reference):
+    """
+    Compares a mask with a reference mask of the same size.
+
+    :param mask: The 'L' mask to rate.
+    :param reference: The 'L' reference mask.
+    :return: A dict with the mean absolute difference overall ('mae') and near the
+        outline of the reference ('edge_mae'), and the intersection over union ('iou').
+    """
+    from scipy import ndimage
+
+    values = np.asarray(mask, dtype=np.int16)
+    expected = np.asarray(reference, dtype=np.int16)
+    difference = np.abs(values - expected)
+    inside = expected >= 128
+    edge = ndimage.binary_dilation(inside, iterations=EDGE_WIDTH) & ~ndimage.binary_erosion(inside, iterations=EDGE_WIDTH)
+    union = np.count_nonzero(inside | (values >= 128))
+    return {
+        'mae': float(difference.mean()),
+        'edge_mae': float(difference[edge].mean()) if edge.any() else 0.0,
+        'iou': np.count_nonzero(inside & (values >= 128)) / union if union else 1.0,
+    }
+
+
+def run_image(image, session, model_name, proxy_size):
+    """
+    Removes the background of one image with and without the proxy.
+
+    :param image: The full-resolution RGB image.
+    :param session: The rembg session.
+    :param model_name: The model's name.
+    :param proxy_size: The longest side of the proxy.
+    :return: The result record.
+    """
+    start = time.perf_counter()
+    remove_background(image, model_name=model_name, session=session)
+    full_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    remove_background(image, model_name=model_name, session=session, proxy_size=proxy_size)
+    proxy_seconds = time.perf_counter() - start
+
+    reference = remove(image, session=session, only_mask=True)
+    proxy = make_proxy(image, proxy_size)
+    mask = upsample_mask(remove(proxy, session=session, only_mask=True), proxy, image)
+    return {'size': list(image.size), 'full_seconds': full_seconds, 'proxy_seconds': proxy_seconds,
+            **compare_masks(mask, reference)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark proxy-resolution background removal.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1024, 2048, 4096],
+                        help='Longest sides the test images are scaled to (default: 1024 2048 4096).')
+    parser.add_argument('--proxy', type=int, default=DEFAULT_PROXY_SIZE,
+                        help=f'Longest side of the proxy (default: {DEFAULT_PROXY_SIZE}).')
+    parser.add_argument('--model', default=DEFAULT_MODEL, help=f'rembg model (default: {DEFAULT_MODEL}).')
+    parser.add_argument('--images', default=TEST_IMAGES, help='Directory of test images.')
+    parser.add_argument('--output', help='Write the results to this JSON file.')
+    args = parser.parse_args()
+
+    pool = SessionPool()
+    try:
+        session = pool.get(args.model)
+    except Exception as e:
+        print(f"Could not load the {args.model} model, skipping the benchmark: {e}")
+        return
+
+    results = []
+    for name in sorted(os.listdir(args.images)):
+        with Image.open(os.path.join(args.images, name)) as original:
+            original = original.convert('RGB')
+        for longest in args.sizes:
+            scale = longest / max(original.size)
+            image = original.resize((round(original.width * scale), round(original.height * scale)),
+                                    Image.Resampling.LANCZOS)
+            record = {'image': name, **run_image(image, session, args.model, args.proxy)}
+            results.append(record)
+            print(f"{name} {image.width}x{image.height}: full {record['full_seconds']:.2f}s, "
+                  f"proxy {record['proxy_seconds']:.2f}s | MAE {record['mae']:.2f}, "
+                  f"edge MAE {record['edge_mae']:.1f}, IoU {record['iou']:.4f}")
+    pool.close()
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'proxy': args.proxy, 'model': args.model, 'results': results}, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
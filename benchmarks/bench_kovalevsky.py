@@ -0,0 +1,96 @@
+"""
+Before/after benchmark for the Kovalevsky edge detector.
+
+Times the original per-pixel loop implementation against the vectorized
+``image_filters.edge_detection(..., 'kovalevsky')`` and checks that both
+produce identical edge maps.
+
+Usage:
+    python benchmarks/bench_kovalevsky.py [--size 512 384] [--threshold 50] [--repeat 3]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from image_filters import edge_detection
+
+
+def kovalevsky_loop(image, threshold=50):
+    """The original nested-loop implementation, kept as the reference."""
+    img_array = np.array(image.convert('RGB'), dtype=np.int16)
+    height, width, _ = img_array.shape
+    if height < 6 or width < 6:
+        return Image.new('L', (width, height), 0)
+    edge_map = np.zeros((height, width), dtype=np.uint8)
+    for y in range(height):
+        for x in range(width - 5):
+            pixels = img_array[y, x:x + 6]
+            diffs = np.abs(pixels[1:] - pixels[:-1]).sum(axis=1)
+            center_diff = diffs[2]
+            if (center_diff > threshold and center_diff > diffs[0] and center_diff > diffs[1] and
+                    center_diff > diffs[3] and center_diff > diffs[4]):
+                edge_map[y, x + 3] = 255
+    for x in range(width):
+        for y in range(height - 5):
+            pixels = img_array[y:y + 6, x]
+            diffs = np.abs(pixels[1:] - pixels[:-1]).sum(axis=1)
+            center_diff = diffs[2]
+            if (center_diff > threshold and center_diff > diffs[0] and center_diff > diffs[1] and
+                    center_diff > diffs[3] and center_diff > diffs[4]):
+                edge_map[y + 3, x] = 255
+    return Image.fromarray(edge_map, mode='L')
+
+
+def make_test_image(width, height, seed=0):
+    """Builds a blocky random image so the detector finds a realistic number of edges."""
+    rng = np.random.default_rng(seed)
+    blocks = rng.integers(0, 256, (height // 8 + 1, width // 8 + 1, 3), dtype=np.uint8)
+    array = np.repeat(np.repeat(blocks, 8, axis=0), 8, axis=1)[:height, :width]
+    noise = rng.integers(-10, 11, array.shape)
+    return Image.fromarray(np.clip(array + noise, 0, 255).astype(np.uint8), 'RGB')
+
+
+def best_time(func, repeat):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the Kovalevsky edge detector.')
+    parser.add_argument('--size', type=int, nargs=2, default=[512, 384], metavar=('WIDTH', 'HEIGHT'))
+    parser.add_argument('--threshold', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--skip-loop', action='store_true',
+                        help='Only time the vectorized version (useful for very large sizes).')
+    args = parser.parse_args()
+
+    image = make_test_image(*args.size)
+    print(f"Image: {args.size[0]}x{args.size[1]} RGB, threshold {args.threshold}")
+
+    after, vectorized = best_time(lambda: edge_detection(image, 'kovalevsky', args.threshold), args.repeat)
+    print(f"  vectorized: {after * 1000:10.1f} ms")
+    if args.skip_loop:
+        return
+
+    before, reference = best_time(lambda: kovalevsky_loop(image, args.threshold), 1)
+    print(f"  loop:       {before * 1000:10.1f} ms")
+    print(f"  speedup:    {before / after:10.1f}x")
+    identical = np.array_equal(np.array(reference), np.array(vectorized))
+    print(f"  identical output: {identical}")
+    if not identical:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
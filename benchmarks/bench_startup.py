@@ -0,0 +1,110 @@
+"""
+Startup benchmark for typical command lines.
+
+Runs main.py in a fresh interpreter for each command line and times the whole run, so
+the cost of importing the program and its libraries is included. It also lists which
+heavy libraries (rembg/onnxruntime, scikit-image, scipy) each command line imported:
+they should only be loaded when an operation in the chain needs them.
+
+Usage:
+    python benchmarks/bench_startup.py [--repeat 5] [--output startup.json]
+    python benchmarks/bench_startup.py --compare startup_baseline.json [--tolerance 0.15]
+
+The results use the same format as bench_suite.py, so --compare works the same way.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from PIL import Image
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+from bench_suite import RESULTS_FORMAT_VERSION, _load_results, _print_record, _record, compare, environment
+
+MAIN = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'main.py'))
+
+COMMAND_LINES = {
+    'help': ['--help'],
+    'flip': ['--flip', 'horizontal', '-j', '1'],
+    'scale_adjust': ['--scale', '0.5x', '--brightness', '10', '--contrast', '10', '-j', '1'],
+    'edge_kovalevsky': ['--edge-detection', 'kovalevsky', '-j', '1'],
+    'edge_sobel': ['--edge-detection', 'sobel', '-j', '1'],
+}
+
+HEAVY_MODULES = ('rembg', 'onnxruntime', 'skimage', 'scipy')
+
+
+def run_command_line(args, work_dir, importtime=False):
+    """
+    Runs main.py once in work_dir on a small image in its Base Images directory.
+
+    :param args: The command-line arguments.
+    :param work_dir: The directory to run in.
+    :param importtime: Run with -X importtime and return the heavy modules that were imported.
+    :return: The wall time in seconds, or the sorted list of heavy modules if importtime is set.
+    """
+    os.makedirs(os.path.join(work_dir, 'Base Images'), exist_ok=True)
+    Image.new('RGB', (64, 48), (120, 60, 30)).save(os.path.join(work_dir, 'Base Images', 'sample.png'))
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + [MAIN] + args
+    start = time.perf_counter()
+    completed = subprocess.run(command, cwd=work_dir, capture_output=True, text=True, check=True)
+    seconds = time.perf_counter() - start
+    if not importtime:
+        return seconds
+    imported = {line.split('|')[-1].strip().split('.')[0]
+                for line in completed.stderr.splitlines() if line.startswith('import time:')}
+    return sorted(imported & set(HEAVY_MODULES))
+
+
+def run_suite(repeat):
+    """
+    Times every command line in COMMAND_LINES.
+
+    :param repeat: How many times each command line is run.
+    :return: The list of result records.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for name, args in COMMAND_LINES.items():
+            timings = [run_command_line(args, work_dir) for _ in range(repeat)]
+            record = _record(name, 'startup', '-', (0, 0), timings)
+            record['heavy_modules'] = run_command_line(args, work_dir, importtime=True)
+            results.append(record)
+            _print_record(record)
+            print(f"    imports: {', '.join(record['heavy_modules']) or 'no heavy libraries'}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the startup time of typical command lines.')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='Write the results to this JSON file.')
+    parser.add_argument('--compare', metavar='BASELINE', help='Compare against a saved results file.')
+    parser.add_argument('--tolerance', type=float, default=0.15,
+                        help='Slowdown (as a fraction) that counts as a regression with --compare (default: 0.15).')
+    parser.add_argument('--min-delta-ms', type=float, default=10.0,
+                        help='Slowdowns below this many milliseconds are ignored as noise (default: 10).')
+    args = parser.parse_args()
+
+    print(f"Timing command lines (best of {args.repeat}):")
+    current = {'version': RESULTS_FORMAT_VERSION, 'environment': environment(), 'results': run_suite(args.repeat)}
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(current, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.compare:
+        regressions = compare(_load_results(args.compare), current, args.tolerance, args.min_delta_ms / 1000)
+        if regressions:
+            print(f"\n{len(regressions)} command line(s) slower than the baseline by more than {args.tolerance:.0%}.")
+            sys.exit(1)
+        print(f"\nNo slowdowns beyond {args.tolerance:.0%}.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,313 @@
+"""
+Benchmark suite for the image operations and common processing chains.
+
+Times every operation (flip_image, scale_image, the image_filters functions and
+remove_background) on synthetic images of several sizes and modes, plus a few chains
+run end to end through ``process_images_and_save``. Results are printed as a table and
+can be written to a JSON file; a saved result file can be used as a baseline to flag
+slowdowns.
+
+Usage:
+    python benchmarks/bench_suite.py [--sizes small medium] [--modes RGB RGBA] [--only scale]
+                                     [--repeat 3] [--output results.json]
+    python benchmarks/bench_suite.py --compare baseline.json [--output new.json] [--tolerance 0.15]
+                                     [--min-delta-ms 1]
+    python benchmarks/bench_suite.py --compare baseline.json --results new.json
+
+With --compare, the exit status is 1 if any benchmark is slower than the baseline by more
+than the tolerance, so the suite can gate performance work.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import numpy as np
+import PIL
+from PIL import Image
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from flip_image import flip_image
+from image_filters import (
+    adjust_brightness,
+    adjust_contrast,
+    adjust_saturation,
+    edge_detection,
+    grayscale,
+    invert_colors,
+)
+from pointwise import apply_pointwise
+from processing import process_images_and_save
+from scale_image import scale_image
+from strips import edge_map_in_strips, resize_in_strips
+
+RESULTS_FORMAT_VERSION = 1
+
+SIZES = {
+    'small': (640, 480),
+    'medium': (2048, 1536),
+    'large': (4000, 3000),
+    'xlarge': (8192, 6144),  # 50 MP
+}
+MODES = ('L', 'RGB', 'RGBA', 'P')
+
+OPERATIONS = {
+    'flip_horizontal': lambda image: flip_image(image, 'horizontal'),
+    'flip_vertical': lambda image: flip_image(image, 'vertical'),
+    'flip_both': lambda image: flip_image(image, 'both'),
+    'scale_0.5x_bilinear': lambda image: scale_image(image, scale_factor=0.5),
+    'scale_0.5x_lanczos': lambda image: scale_image(image, scale_factor=0.5, resample_filter='lanczos'),
+    'scale_2x_bicubic': lambda image: scale_image(image, scale_factor=2, resample_filter='bicubic'),
+    'invert': invert_colors,
+    'grayscale': grayscale,
+    'brightness': lambda image: adjust_brightness(image, 30),
+    'contrast': lambda image: adjust_contrast(image, 30),
+    'saturation': lambda image: adjust_saturation(image, 30),
+    'fused_pointwise': lambda image: apply_pointwise(image, [
+        {'dest': 'brightness', 'values': [20]}, {'dest': 'contrast', 'values': [20]},
+        {'dest': 'saturation', 'values': [-30]}]),
+    'edge_sobel': lambda image: edge_detection(image, 'sobel'),
+    'edge_canny': lambda image: edge_detection(image, 'canny'),
+    'edge_kovalevsky': lambda image: edge_detection(image, 'kovalevsky', 50),
+    # Intra-image parallelism (--threads)
+    'scale_0.5x_lanczos_4threads': lambda image: resize_in_strips(
+        image, (image.width // 2, image.height // 2), 'lanczos', threads=4),
+    'edge_canny_4threads': lambda image: edge_map_in_strips(image, 'canny', threads=4),
+}
+
+CHAINS = {
+    'chain_thumbnail': [{'dest': 'scale', 'values': ['0.25x']}, {'dest': 'saturation', 'values': [10]}],
+    'chain_adjust': [{'dest': 'brightness', 'values': [10]}, {'dest': 'contrast', 'values': [15]},
+                     {'dest': 'saturation', 'values': [-20]}, {'dest': 'flip', 'values': ['horizontal']}],
+    'chain_edges': [{'dest': 'grayscale', 'values': []}, {'dest': 'edge_detection', 'values': ['sobel']}],
+}
+
+# Background removal runs a neural network; it is only timed on the smallest size.
+BACKGROUND_REMOVAL_SIZES = ('small',)
+
+
+def make_image(size, mode, seed=0):
+    """
+    Builds a synthetic image: smooth gradients with blocky detail and a little noise, so
+    compression, edge detection and background removal see realistic content.
+
+    :param size: The size as a tuple (width, height).
+    :param mode: One of MODES.
+    :param seed: The random seed.
+    :return: The image.
+    """
+    width, height = size
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    blocks = rng.integers(0, 256, (height // 32 + 1, width // 32 + 1, 3), dtype=np.int16)
+    detail = np.repeat(np.repeat(blocks, 32, axis=0), 32, axis=1)[:height, :width]
+    gradient = np.stack([x * 255 // max(width - 1, 1), y * 255 // max(height - 1, 1),
+                         (x + y) * 255 // max(width + height - 2, 1)], axis=-1)
+    noise = rng.integers(-8, 9, (height, width, 3), dtype=np.int16)
+    array = np.clip((gradient + detail) // 2 + noise, 0, 255).astype(np.uint8)
+    image = Image.fromarray(array)
+    if mode == 'RGBA':
+        alpha = Image.fromarray((np.hypot(x - width / 2, y - height / 2) < min(size) / 2.5).astype(np.uint8) * 255)
+        image.putalpha(alpha)
+    elif mode == 'P':
+        image = image.quantize(256)
+    elif mode != 'RGB':
+        image = image.convert(mode)
+    return image
+
+
+def time_call(func, repeat):
+    """Runs func repeat times and returns the individual wall times in seconds."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def _record(name, size_name, mode, size, timings):
+    return {
+        'name': name, 'size': size_name, 'mode': mode, 'pixels': size[0] * size[1],
+        'repeat': len(timings), 'min_s': min(timings), 'median_s': statistics.median(timings),
+    }
+
+
+def _benchmark_key(record):
+    return f"{record['name']}/{record['size']}/{record['mode']}"
+
+
+def _background_removal():
+    """Returns a function that times remove_background, or None if rembg or its model is not available."""
+    try:
+        from remove_background import remove_background, session_pool
+        session_pool.warm_up()
+    except Exception as e:
+        print(f"Skipping remove_background: {e}")
+        return None
+    return remove_background
+
+
+def run_suite(size_names, modes, repeat, only=None):
+    """
+    Runs the benchmarks.
+
+    :param size_names: Keys of SIZES.
+    :param modes: Image modes from MODES.
+    :param repeat: How many times each benchmark is run.
+    :param only: If given, only benchmarks whose name contains one of these substrings run.
+    :return: The list of result records.
+    """
+    def selected(name):
+        return not only or any(part in name for part in only)
+
+    results = []
+    operations = {name: func for name, func in OPERATIONS.items() if selected(name)}
+    chains = {name: chain for name, chain in CHAINS.items() if selected(name)}
+    remove_background = _background_removal() if selected('remove_background') else None
+
+    for size_name in size_names:
+        size = SIZES[size_name]
+        for mode in modes:
+            image = make_image(size, mode)
+            for name, func in operations.items():
+                results.append(_record(name, size_name, mode, size, time_call(lambda: func(image), repeat)))
+                _print_record(results[-1])
+            if remove_background is not None and size_name in BACKGROUND_REMOVAL_SIZES and mode != 'P':
+                timings = time_call(lambda: remove_background(image), repeat)
+                results.append(_record('remove_background', size_name, mode, size, timings))
+                _print_record(results[-1])
+            if chains:
+                results.extend(_run_chains(chains, image, size_name, mode, repeat))
+    return results
+
+
+def _run_chains(chains, image, size_name, mode, repeat):
+    """Times chains end to end (planning, processing and PNG encoding) through process_images_and_save."""
+    results = []
+    work_dir = tempfile.mkdtemp()
+    original_cwd = os.getcwd()
+    os.chdir(work_dir)
+    try:
+        path = 'input.png'
+        image.save(path, compress_level=1)
+        args = SimpleNamespace(jobs=1, resample='bilinear', threshold=50)
+        for name, chain in chains.items():
+            def run():
+                with contextlib.redirect_stdout(io.StringIO()):
+                    process_images_and_save([('input.png', path)], chain, args)
+            results.append(_record(name, size_name, mode, image.size, time_call(run, repeat)))
+            _print_record(results[-1])
+    finally:
+        os.chdir(original_cwd)
+        shutil.rmtree(work_dir)
+    return results
+
+
+def _print_record(record):
+    print(f"  {_benchmark_key(record):<42} {record['min_s'] * 1000:10.2f} ms "
+          f"(median {record['median_s'] * 1000:.2f} ms)")
+
+
+def environment():
+    """Describes the machine and library versions, stored with the results."""
+    return {
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'pillow': PIL.__version__,
+        'numpy': np.__version__,
+    }
+
+
+def compare(baseline, current, tolerance, min_delta=0.001):
+    """
+    Compares two result sets by their best (minimum) times.
+
+    :param baseline: The baseline results (as written by --output).
+    :param current: The new results.
+    :param tolerance: The allowed slowdown as a fraction, e.g. 0.15 for 15 percent.
+    :param min_delta: Slowdowns smaller than this many seconds are timer noise and never count.
+    :return: The list of keys of the benchmarks that are slower than allowed.
+    """
+    baseline_times = {_benchmark_key(record): record['min_s'] for record in baseline['results']}
+    regressions = []
+    print(f"\n{'benchmark':<42} {'baseline':>12} {'current':>12} {'change':>9}")
+    for record in current['results']:
+        key = _benchmark_key(record)
+        if key not in baseline_times:
+            continue
+        before, after = baseline_times[key], record['min_s']
+        change = after / before - 1 if before > 0 else 0.0
+        flag = ''
+        if change > tolerance and after - before > min_delta:
+            regressions.append(key)
+            flag = '  SLOWER'
+        elif change < -tolerance:
+            flag = '  faster'
+        print(f"{key:<42} {before * 1000:10.2f}ms {after * 1000:10.2f}ms {change:+8.1%}{flag}")
+    missing = set(baseline_times) - {_benchmark_key(record) for record in current['results']}
+    if missing:
+        print(f"{len(missing)} baseline benchmark(s) are not in the current results.")
+    return regressions
+
+
+def _load_results(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        results = json.load(f)
+    if results.get('version') != RESULTS_FORMAT_VERSION:
+        raise SystemExit(f"{path}: unsupported results format version {results.get('version')}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the image operations and processing chains.')
+    parser.add_argument('--sizes', nargs='+', choices=list(SIZES), default=['small', 'medium'])
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+    parser.add_argument('--only', nargs='+', metavar='NAME',
+                        help='Only run benchmarks whose name contains one of these strings.')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='Write the results to this JSON file.')
+    parser.add_argument('--compare', metavar='BASELINE', help='Compare against a saved results file.')
+    parser.add_argument('--results', help='With --compare: compare this saved results file instead of running.')
+    parser.add_argument('--tolerance', type=float, default=0.15,
+                        help='Slowdown (as a fraction) that counts as a regression with --compare (default: 0.15).')
+    parser.add_argument('--min-delta-ms', type=float, default=1.0,
+                        help='Slowdowns below this many milliseconds are ignored as noise (default: 1).')
+    args = parser.parse_args()
+
+    if args.results:
+        current = _load_results(args.results)
+    else:
+        print(f"Running benchmarks (best of {args.repeat}):")
+        current = {
+            'version': RESULTS_FORMAT_VERSION,
+            'environment': environment(),
+            'results': run_suite(args.sizes, args.modes, args.repeat, args.only),
+        }
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(current, f, indent=2)
+            print(f"Results written to {args.output}")
+
+    if args.compare:
+        regressions = compare(_load_results(args.compare), current, args.tolerance, args.min_delta_ms / 1000)
+        if regressions:
+            print(f"\n{len(regressions)} benchmark(s) slower than the baseline by more than {args.tolerance:.0%}.")
+            sys.exit(1)
+        print(f"\nNo slowdowns beyond {args.tolerance:.0%}.")
+
+
+if __name__ == '__main__':
+    main()
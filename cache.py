@@ -0,0 +1,291 @@
+"""
+Persistent, content-addressed caches.
+
+``ContentCache`` is a directory of files ("blobs") addressed by a hex key, with a JSON index
+that records each blob's size and last use. When the total size goes over the cap, the
+least recently used blobs are evicted. ``OutputCache`` builds on it to skip images whose
+output is already up to date, and ``MaskCache`` to reuse background-removal masks.
+"""
+import hashlib
+import io
+import json
+import os
+import shutil
+import threading
+import time
+
+from PIL import Image
+
+DEFAULT_CACHE_DIR = '.image_cache'
+DEFAULT_CACHE_SIZE_MB = 1024
+CACHE_FORMAT_VERSION = 1
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    """
+    Hashes a file's contents without reading it into memory at once.
+
+    :param path: The file to hash.
+    :param chunk_size: The number of bytes to read at a time.
+    :return: The SHA-256 hex digest.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ContentCache:
+    """
+    A size-capped store of blobs addressed by hex keys, with least-recently-used eviction.
+
+    The index is kept in memory and written back by ``save()``; blobs are written
+    immediately. All methods are thread-safe.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._index_path = os.path.join(directory, 'index.json')
+        self._lock = threading.Lock()
+        self._entries = self._load_index()
+
+    def _load_index(self):
+        try:
+            with open(self._index_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if index.get('version') != CACHE_FORMAT_VERSION:
+            return {}
+        # Drop entries whose blob has gone missing
+        return {key: entry for key, entry in index.get('entries', {}).items()
+                if os.path.exists(self._blob_path(key))}
+
+    def _blob_path(self, key):
+        return os.path.join(self.directory, 'blobs', key[:2], key)
+
+    def get(self, key):
+        """
+        Looks up a blob and marks it as recently used.
+
+        :param key: The hex key.
+        :return: The path of the blob, or None if it is not cached.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            entry['last_used'] = time.time()
+            return self._blob_path(key)
+
+    def metadata(self, key):
+        """Returns a copy of the metadata stored with a blob, or None if it is not cached."""
+        with self._lock:
+            entry = self._entries.get(key)
+            return dict(entry.get('meta', {})) if entry is not None else None
+
+    def update_metadata(self, key, **meta):
+        """Adds or replaces metadata fields of a cached blob."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.setdefault('meta', {}).update(meta)
+
+    def put(self, key, source_path=None, data=None, **meta):
+        """
+        Stores a blob, from a file or from bytes, and evicts old blobs if over the cap.
+
+        :param key: The hex key.
+        :param source_path: A file to copy into the cache.
+        :param data: Bytes to store (used when source_path is not given).
+        :param meta: Metadata to store with the blob.
+        :return: The path of the blob.
+        """
+        blob_path = self._blob_path(key)
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        temp_path = f"{blob_path}.tmp.{os.getpid()}.{threading.get_ident()}"
+        try:
+            if source_path is not None:
+                shutil.copyfile(source_path, temp_path)
+            else:
+                with open(temp_path, 'wb') as f:
+                    f.write(data)
+            os.replace(temp_path, blob_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        with self._lock:
+            self._entries[key] = {'size': os.path.getsize(blob_path), 'last_used': time.time(), 'meta': meta}
+            self._evict()
+        return blob_path
+
+    def _evict(self):
+        total = sum(entry['size'] for entry in self._entries.values())
+        if total <= self.max_bytes:
+            return
+        for key, entry in sorted(self._entries.items(), key=lambda item: item[1]['last_used']):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(self._blob_path(key))
+            except OSError:
+                pass
+            total -= entry['size']
+            del self._entries[key]
+
+    def save(self):
+        """Writes the index to disk."""
+        with self._lock:
+            index = {'version': CACHE_FORMAT_VERSION, 'entries': self._entries}
+            os.makedirs(self.directory, exist_ok=True)
+            temp_path = f"{self._index_path}.tmp.{os.getpid()}"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(index, f)
+            os.replace(temp_path, self._index_path)
+
+    def purge(self):
+        """Deletes every blob and the index."""
+        with self._lock:
+            shutil.rmtree(os.path.join(self.directory, 'blobs'), ignore_errors=True)
+            if os.path.exists(self._index_path):
+                os.remove(self._index_path)
+            self._entries = {}
+
+    def _count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    def stats(self):
+        """Returns the number of entries, the bytes they use and the size cap."""
+        with self._lock:
+            return {
+                'directory': self.directory,
+                'entries': len(self._entries),
+                'bytes': sum(entry['size'] for entry in self._entries.values()),
+                'max_bytes': self.max_bytes,
+            }
+
+
+class OutputCache(ContentCache):
+    """
+    Cache of processed outputs, keyed by the input file's contents plus everything that
+    affects the output (the normalized operation chain and the relevant settings).
+
+    For every key it remembers where the output was written and that file's size and
+    modification time, so an output that is still in place is recognised as up to date
+    without reading it. If the output file is gone or was changed, it is restored from
+    the cached copy.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_SIZE_MB * 1024 * 1024):
+        super().__init__(os.path.join(directory, 'outputs'), max_bytes)
+        self.counts = {'up_to_date': 0, 'restored': 0, 'processed': 0}
+
+    @staticmethod
+    def make_key(input_path, ordered_operations, settings, input_digest=None):
+        """
+        Builds the cache key for an input file.
+
+        :param input_path: The input image file.
+        :param ordered_operations: The operations as requested.
+        :param settings: A dict of every other setting that affects the output.
+        :param input_digest: hash_file(input_path) if already computed, so building the keys
+            of several output formats reads the input only once.
+        :return: The hex key.
+        """
+        chain = [[operation['dest'], [str(value).lower() for value in operation.get('values', [])]]
+                 for operation in ordered_operations]
+        description = json.dumps({'chain': chain, 'settings': settings}, sort_keys=True, default=str)
+        if input_digest is None:
+            input_digest = hash_file(input_path)
+        digest = hashlib.sha256(input_digest.encode('ascii'))
+        digest.update(description.encode('utf-8'))
+        return digest.hexdigest()
+
+    def lookup(self, key, output_path):
+        """
+        Checks whether an up-to-date output exists, restoring it from the cache if needed.
+
+        :param key: The key from make_key.
+        :param output_path: Where the output should be.
+        :return: 'up_to_date', 'restored', or None on a cache miss.
+        """
+        blob_path = self.get(key)
+        if blob_path is None:
+            return None
+        recorded = (self.metadata(key) or {}).get('outputs', {}).get(output_path)
+        if recorded is not None and os.path.exists(output_path):
+            stat = os.stat(output_path)
+            if [stat.st_size, stat.st_mtime_ns] == recorded:
+                self._count('up_to_date')
+                return 'up_to_date'
+        os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+        temp_path = f"{output_path}.tmp.{os.getpid()}.{threading.get_ident()}"
+        shutil.copyfile(blob_path, temp_path)
+        os.replace(temp_path, output_path)
+        self._record_output(key, output_path)
+        self._count('restored')
+        return 'restored'
+
+    def store(self, key, output_path):
+        """Caches a freshly written output file."""
+        self.put(key, source_path=output_path)
+        self._record_output(key, output_path)
+        self._count('processed')
+
+    def _record_output(self, key, output_path):
+        stat = os.stat(output_path)
+        outputs = (self.metadata(key) or {}).get('outputs', {})
+        outputs[output_path] = [stat.st_size, stat.st_mtime_ns]
+        self.update_metadata(key, outputs=outputs)
+
+
+class MaskCache(ContentCache):
+    """
+    Cache of background-removal masks, keyed by the pixels of the image the model was run on
+    and the model name. The masks are stored as grayscale PNGs.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_SIZE_MB * 1024 * 1024):
+        super().__init__(os.path.join(directory, 'masks'), max_bytes)
+        self.counts = {'hits': 0, 'misses': 0}
+
+    @staticmethod
+    def make_key(image, model_name):
+        """
+        Builds the cache key for an image.
+
+        :param image: The image the model is run on.
+        :param model_name: The rembg model name.
+        :return: The hex key.
+        """
+        digest = hashlib.sha256(f"{model_name}:{image.mode}:{image.width}x{image.height}:".encode('utf-8'))
+        digest.update(image.tobytes())
+        return digest.hexdigest()
+
+    def load(self, key):
+        """
+        Looks up a mask.
+
+        :param key: The key from make_key.
+        :return: The mask as an 'L' image, or None on a cache miss.
+        """
+        blob_path = self.get(key)
+        if blob_path is not None:
+            try:
+                with Image.open(blob_path) as mask:
+                    mask.load()
+                self._count('hits')
+                return mask
+            except OSError:
+                pass
+        self._count('misses')
+        return None
+
+    def store(self, key, mask):
+        """Caches a mask."""
+        buffer = io.BytesIO()
+        mask.save(buffer, 'PNG')
+        self.put(key, data=buffer.getvalue())
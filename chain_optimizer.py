@@ -0,0 +1,181 @@
+"""
+Planning pass that rewrites an operation chain into a cheaper equivalent one.
+
+Two rewrites are applied:
+
+* Flips are cancelled and merged. Flips commute exactly with the point-wise operations, so a
+  flip can be combined with an earlier one across them: two equal flips cancel, and a
+  horizontal plus a vertical flip become a single 'both' flip (a 180 degree rotation).
+* A size-reducing scale is moved ahead of operations it can be swapped with, so they work on
+  fewer pixels: flips (except with nearest-neighbour resampling, which picks different pixels
+  on ties) and invert/grayscale on 8-bit 'L' and 'RGB' images. Other modes are not swapped:
+  Pillow resizes RGBA with premultiplied alpha, which both of them discard, and invert and
+  grayscale first convert 16-bit, 32-bit, palette and CMYK images to 8 bits, which clips and
+  rounds differently before and after scaling. These swaps are exact in real arithmetic;
+  in 8-bit output they can differ by a few levels of rounding and filter-overshoot clipping.
+
+Use ``--no-optimize`` when the literal order must be kept.
+"""
+from pointwise import POINTWISE_OPERATIONS
+from scale_image import compute_scaled_size, parse_scale_values
+
+# Flips as (horizontal, vertical) pairs; composing two flips is an element-wise XOR.
+_FLIP_AXES = {
+    'horizontal': (True, False),
+    'vertical': (False, True),
+    'both': (True, True),
+}
+_FLIP_NAMES = {axes: name for name, axes in _FLIP_AXES.items()}
+# The only modes invert and grayscale can be swapped with a downscale on
+_SWAP_MODES = ('L', 'RGB')
+
+
+def describe_operation(operation):
+    """
+    Formats an operation the way it is written on the command line, e.g. '--scale 0.5x'.
+
+    :param operation: The operation dict.
+    :return: The description.
+    """
+    if operation['dest'] == 'pointwise':
+        return ' '.join(describe_operation(step) for step in operation['values'])
+    if operation['dest'] == 'resize':
+        width, height = operation['values']
+        return f"--scale {width}px {height}px"
+    description = '--' + operation['dest'].replace('_', '-')
+    values = ' '.join(map(str, operation.get('values', [])))
+    return f"{description} {values}" if values else description
+
+
+def optimize_operations(ordered_operations, cli_args, image_mode=None, image_size=None):
+    """
+    Rewrites an operation chain into a cheaper equivalent one.
+
+    :param ordered_operations: The operations as requested, in order.
+    :param cli_args: The parsed command-line arguments (resample).
+    :param image_mode: The mode of the input image, if known. Without it, invert and grayscale are not swapped.
+    :param image_size: The size of the input image, if known. Needed to tell whether a fit-to-box scale shrinks.
+    :return: A tuple (operations, notes) with the rewritten chain and a description of each rewrite.
+    """
+    notes = []
+    operations = _merge_flips(list(ordered_operations), notes)
+    resample = getattr(cli_args, 'resample', 'bilinear')
+    operations = _hoist_downscales(operations, resample, image_mode, image_size, notes)
+    # Moving a scale out from between two flips can make them mergeable.
+    operations = _merge_flips(operations, notes)
+    return operations, notes
+
+
+def _flip_axes(operation):
+    if operation['dest'] != 'flip':
+        return None
+    values = operation.get('values', [])
+    return _FLIP_AXES.get(values[0]) if values else None
+
+
+def _merge_flips(operations, notes):
+    result = []
+    for operation in operations:
+        axes = _flip_axes(operation)
+        if axes is not None:
+            index = len(result) - 1
+            while index >= 0 and result[index]['dest'] in POINTWISE_OPERATIONS:
+                index -= 1
+            previous_axes = _flip_axes(result[index]) if index >= 0 else None
+            if previous_axes is not None:
+                previous = result.pop(index)
+                combined = (axes[0] != previous_axes[0], axes[1] != previous_axes[1])
+                pair = f"{describe_operation(previous)} and {describe_operation(operation)}"
+                if combined == (False, False):
+                    notes.append(f"{pair} cancel out")
+                    continue
+                merged = {'dest': 'flip', 'values': [_FLIP_NAMES[combined]]}
+                result.insert(index, merged)
+                notes.append(f"{pair} merged into {describe_operation(merged)}")
+                continue
+        result.append(operation)
+    return result
+
+
+def _chain_states(operations, image_mode, image_size):
+    """
+    Follows the image through the chain.
+
+    :return: For every operation, a tuple (swappable_mode, size) describing its input:
+        whether it is known to be in one of _SWAP_MODES, and its size. The size is None
+        once it can no longer be predicted.
+    """
+    swappable_mode = image_mode in _SWAP_MODES
+    size = image_size
+    states = []
+    for operation in operations:
+        states.append((swappable_mode, size))
+        dest = operation['dest']
+        if dest == 'remove_background':
+            swappable_mode, size = False, None
+        elif dest in ('invert', 'grayscale', 'edge_detection'):
+            # These always output 8-bit 'L' or 'RGB'
+            swappable_mode = True
+        elif dest == 'pointwise' and any(step['dest'] in ('invert', 'grayscale') for step in operation['values']):
+            swappable_mode = True
+        elif dest == 'scale':
+            size = _scaled_size(operation, size)
+    return states
+
+
+def _scale_parameters(operation):
+    try:
+        return parse_scale_values(operation.get('values', []))
+    except ValueError:
+        return None
+
+
+def _scaled_size(operation, size):
+    parameters = _scale_parameters(operation)
+    if parameters is None:
+        # An invalid scale leaves the image as it is
+        return size
+    if size is None:
+        return None
+    return compute_scaled_size(size, *parameters)
+
+
+def _is_downscale(operation, size):
+    parameters = _scale_parameters(operation)
+    if parameters is None:
+        return False
+    scale_factor, new_size = parameters
+    if scale_factor is not None:
+        return scale_factor < 1
+    if size is None:
+        return False
+    new_width, new_height = compute_scaled_size(size, scale_factor, new_size)
+    return new_width * new_height < size[0] * size[1]
+
+
+def _can_swap_with_scale(operation, swappable_mode, resample):
+    dest = operation['dest']
+    if dest == 'flip':
+        return resample.lower() != 'nearest'
+    if dest in ('invert', 'grayscale'):
+        return swappable_mode
+    return False
+
+
+def _hoist_downscales(operations, resample, image_mode, image_size, notes):
+    operations = list(operations)
+    for index in range(len(operations)):
+        operation = operations[index]
+        if operation['dest'] != 'scale':
+            continue
+        states = _chain_states(operations, image_mode, image_size)
+        if not _is_downscale(operation, states[index][1]):
+            continue
+        target = index
+        while target > 0 and _can_swap_with_scale(operations[target - 1], states[target - 1][0], resample):
+            target -= 1
+        if target < index:
+            passed = ' '.join(describe_operation(op) for op in operations[target:index])
+            operations.insert(target, operations.pop(index))
+            notes.append(f"{describe_operation(operation)} moved ahead of {passed}")
+    return operations
@@ -0,0 +1,215 @@
+"""
+Output encoders.
+
+Every output format has three compression presets: 'fast' spends as little time as
+possible in the encoder, 'default' uses the encoder's usual settings and 'compact' spends
+more time to make smaller files. For the lossy formats the quality is set separately.
+
+TIFF (except with 'compact') and NPY outputs are uncompressed and written through a memory
+map: the output file is allocated at its full size and filled band by band, so saving a
+large image does not make an encoded copy of it in memory. Both can be memory-mapped again
+when they are read back (see image_io.map_image).
+"""
+import io
+import os
+import threading
+import time
+
+import numpy as np
+
+OUTPUT_FORMATS = {
+    # name: (Pillow format, file extension)
+    'png': ('PNG', '.png'),
+    'webp': ('WEBP', '.webp'),
+    'webp-lossy': ('WEBP', '.webp'),
+    'jpeg': ('JPEG', '.jpg'),
+    'tiff': ('TIFF', '.tif'),
+    # Not a Pillow format: written with NumPy
+    'npy': ('NPY', '.npy'),
+}
+DEFAULT_FORMAT = 'png'
+COMPRESSION_PRESETS = ('fast', 'default', 'compact')
+DEFAULT_QUALITY = {'webp-lossy': 80, 'jpeg': 90}
+
+_JPEG_MODES = ('1', 'L', 'RGB', 'CMYK')
+_CONTENT_TYPES = {'PNG': 'image/png', 'WEBP': 'image/webp', 'JPEG': 'image/jpeg', 'TIFF': 'image/tiff',
+                  'NPY': 'application/octet-stream'}
+# The modes the memory-mapped formats store, as uint8 arrays of 1, 3 or 4 bands
+_MAPPED_MODES = ('L', 'RGB', 'RGBA')
+# The height of the bands a memory-mapped output is filled in
+_WRITE_BAND_ROWS = 512
+
+
+def output_extension(output_format):
+    """Returns the file extension of an output format, e.g. '.png'."""
+    return OUTPUT_FORMATS[output_format][1]
+
+
+def content_type(output_format):
+    """Returns the MIME type of an output format, e.g. 'image/png'."""
+    return _CONTENT_TYPES[OUTPUT_FORMATS[output_format][0]]
+
+
+def encoder_options(output_format, compression='default', quality=None):
+    """
+    Returns the Pillow save() options for an output format and compression preset.
+
+    :param output_format: One of OUTPUT_FORMATS.
+    :param compression: One of COMPRESSION_PRESETS.
+    :param quality: The quality (1-100) of the lossy formats. Defaults to DEFAULT_QUALITY.
+    :return: A dict of keyword arguments for Image.save().
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format: {output_format}")
+    if compression not in COMPRESSION_PRESETS:
+        raise ValueError(f"Unknown compression preset: {compression}")
+    if output_format == 'png':
+        return {'fast': {'compress_level': 1},
+                'default': {'compress_level': 6},
+                'compact': {'compress_level': 9, 'optimize': True}}[compression]
+    if output_format == 'webp':
+        # For lossless WebP the quality is the effort spent on compression
+        return {'fast': {'lossless': True, 'quality': 0, 'method': 0},
+                'default': {'lossless': True, 'quality': 80, 'method': 4},
+                'compact': {'lossless': True, 'quality': 100, 'method': 6}}[compression]
+    if output_format == 'tiff':
+        # Uncompressed TIFFs are written through a memory map
+        return {'fast': {}, 'default': {}, 'compact': {'compression': 'tiff_adobe_deflate'}}[compression]
+    if output_format == 'npy':
+        return {}
+    quality = DEFAULT_QUALITY[output_format] if quality is None else quality
+    if output_format == 'webp-lossy':
+        return {'quality': quality, 'method': {'fast': 0, 'default': 4, 'compact': 6}[compression]}
+    return {'quality': quality, **{'fast': {},
+                                   'default': {'optimize': True},
+                                   'compact': {'optimize': True, 'progressive': True}}[compression]}
+
+
+def prepare_image(image, output_format):
+    """
+    Converts an image to a mode the output format can store.
+
+    :param image: The image to save.
+    :param output_format: One of OUTPUT_FORMATS.
+    :return: The image, converted if needed.
+    :raises ValueError: If the format is JPEG and the image has transparent pixels.
+    """
+    if output_format in ('tiff', 'npy'):
+        # Only 8-bit L, RGB and RGBA can be memory-mapped when the file is read back
+        if image.mode in _MAPPED_MODES:
+            return image
+        if image.has_transparency_data:
+            return image.convert('RGBA')
+        return image.convert('L' if image.mode in ('1', 'I', 'I;16', 'F') else 'RGB')
+    if output_format != 'jpeg':
+        # The PNG and WebP encoders take every mode the filters produce
+        return image
+    if image.has_transparency_data:
+        alpha = image.convert('RGBA').getchannel('A')
+        if alpha.getextrema()[0] < 255:
+            raise ValueError("JPEG cannot store transparency; use png or webp for images with alpha.")
+        return image.convert('RGB')
+    if image.mode not in _JPEG_MODES:
+        return image.convert('RGB')
+    return image
+
+
+def write_image(image, path, output_format=DEFAULT_FORMAT, compression='default', quality=None):
+    """
+    Encodes an image to a file. The file is written under a temporary name and renamed
+    into place, so an interrupted run never leaves a truncated output behind.
+
+    :param image: The image to save.
+    :param path: The output file.
+    :param output_format: One of OUTPUT_FORMATS.
+    :param compression: One of COMPRESSION_PRESETS.
+    :param quality: The quality of the lossy formats.
+    :return: A dict with the 'path', the 'format', the 'bytes' written and the encode time in 'seconds'.
+    """
+    options = encoder_options(output_format, compression, quality)
+    image = prepare_image(image, output_format)
+    directory, filename = os.path.split(path)
+    temp_path = os.path.join(directory, f".tmp.{threading.get_ident()}.{filename}")
+    try:
+        start = time.perf_counter()
+        if output_format in ('tiff', 'npy') and not options:
+            _write_mapped(image, temp_path, output_format)
+        else:
+            image.save(temp_path, OUTPUT_FORMATS[output_format][0], **options)
+        seconds = time.perf_counter() - start
+        os.replace(temp_path, path)
+    finally:
+        # Ensure the temp file is removed if it exists
+        if os.path.exists(temp_path):
+            try:
+                os.remove(temp_path)
+            except OSError as e:
+                print(f"Error removing temp file {temp_path}: {e}")
+    return {'path': path, 'format': output_format, 'bytes': os.path.getsize(path), 'seconds': seconds}
+
+
+def encode_image(image, output_format=DEFAULT_FORMAT, compression='default', quality=None):
+    """
+    Encodes an image in memory, with the same settings as write_image.
+
+    :param image: The image to encode.
+    :param output_format: One of OUTPUT_FORMATS.
+    :param compression: One of COMPRESSION_PRESETS.
+    :param quality: The quality of the lossy formats.
+    :return: The encoded bytes.
+    """
+    options = encoder_options(output_format, compression, quality)
+    image = prepare_image(image, output_format)
+    buffer = io.BytesIO()
+    tifffile = _tifffile() if output_format == 'tiff' and not options else None
+    if output_format == 'npy':
+        np.save(buffer, np.asarray(image))
+    elif tifffile is not None:
+        # The same file as the memory-mapped writer makes
+        tifffile.imwrite(buffer, np.asarray(image), **_tiff_layout(tifffile, image.mode))
+    else:
+        image.save(buffer, OUTPUT_FORMATS[output_format][0], **options)
+    return buffer.getvalue()
+
+
+def _tifffile():
+    try:
+        import tifffile
+    except ImportError:
+        return None
+    return tifffile
+
+
+def _tiff_layout(tifffile, mode):
+    """The tifffile.imwrite() options of an uncompressed, memory-mappable TIFF of an L, RGB or RGBA image."""
+    layout = {'photometric': 'minisblack' if mode == 'L' else 'rgb',
+              # Aligns the pixel data for memory-mapping, as tifffile.memmap() does
+              'align': tifffile.TIFF.ALLOCATIONGRANULARITY}
+    if mode == 'RGBA':
+        layout['extrasamples'] = ('unassalpha',)
+    return layout
+
+
+def _write_mapped(image, path, output_format):
+    """
+    Writes an L, RGB or RGBA image as an uncompressed TIFF or NPY file: the file is
+    allocated at its full size, memory-mapped and filled one band of rows at a time.
+    """
+    shape = (image.height, image.width) if image.mode == 'L' else (image.height, image.width, len(image.mode))
+    if output_format == 'npy':
+        output = np.lib.format.open_memmap(path, mode='w+', dtype=np.uint8, shape=shape)
+    else:
+        tifffile = _tifffile()
+        if tifffile is None:
+            # Without tifffile Pillow writes an uncompressed TIFF, from a copy in memory
+            image.save(path, 'TIFF')
+            return
+        output = tifffile.memmap(path, shape=shape, dtype=np.uint8, **_tiff_layout(tifffile, image.mode))
+    try:
+        for top in range(0, image.height, _WRITE_BAND_ROWS):
+            bottom = min(image.height, top + _WRITE_BAND_ROWS)
+            output[top:bottom] = np.asarray(image.crop((0, top, image.width, bottom)))
+        output.flush()
+    finally:
+        # Unmaps the file, so it can be renamed into place
+        del output
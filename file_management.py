@@ -1,6 +1,15 @@
+import fnmatch
+import json
 import os
 import shutil
 
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tiff', '.tif', '.webp')
+# What input discovery accepts: images plus NumPy arrays (see image_io.map_image). .npy
+# files are not moved by move_images_to_subdirectory, since they are often unrelated data.
+INPUT_EXTENSIONS = IMAGE_EXTENSIONS + ('.npy',)
+MANIFEST_FORMAT_VERSION = 1
+DEFAULT_MANIFEST_PATH = '.scan_manifest.json'
+
 
 # Example usages:
 # move_images_to_subdirectory()  # Uses the default "images" subdirectory
@@ -21,22 +30,152 @@ def move_images_to_subdirectory(subdirectory_name):
         if not os.path.exists(subdirectory_name):
             os.makedirs(subdirectory_name)  # Create with intermediate directories if needed
 
-        # 2. Get a list of all files in the current directory
-        files = os.listdir(".")  # "." represents the current directory
-
-        # 3. Iterate through the files and move image files
-        for filename in files:
-            # Check if it's a file (and not a directory) - Important!
-            if os.path.isfile(filename):
-                # 4. Check if the file is an image (using common extensions)
-                #   You can customize this list for other image types
-                if filename.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tiff', '.tif', '.webp')):
-                    source_path = filename
-                    destination_path = os.path.join(subdirectory_name, filename)  # Join for correct path
-                    shutil.move(source_path, destination_path)  # Move the file
-                    print(f"Moved: {filename} to {subdirectory_name}")  # Informative message
-                # else: # Optional: if you want to see which files were SKIPPED
-                #    print(f"Skipped (not an image): {filename}")
+        # 2. Scan the current directory; scandir knows the entry types without a stat per file
+        with os.scandir(".") as entries:  # "." represents the current directory
+            images = [entry.name for entry in entries
+                      if entry.name.lower().endswith(IMAGE_EXTENSIONS) and entry.is_file()]
+
+        # 3. Move the image files
+        for filename in images:
+            destination_path = os.path.join(subdirectory_name, filename)  # Join for correct path
+            try:
+                # A rename within the file system; shutil.move copies across file systems
+                os.replace(filename, destination_path)
+            except OSError:
+                shutil.move(filename, destination_path)
+            print(f"Moved: {filename} to {subdirectory_name}")  # Informative message
 
     except Exception as e:  # Handle potential errors
         print(f"An error occurred: {e}")
+
+
+def _matches(relative_path, patterns):
+    """True if a path matches one of the patterns: patterns with a '/' are matched against
+    the path relative to the root, the others against the file or directory name."""
+    name = relative_path.rsplit('/', 1)[-1]
+    return any(fnmatch.fnmatch(relative_path if '/' in pattern else name, pattern) for pattern in patterns)
+
+
+class ScanManifest:
+    """
+    The listing of every directory of a tree as of the last scan, keyed by the directory's
+    modification time, so a rescan only lists the directories whose contents changed.
+
+    A directory's modification time changes when entries are added, removed or renamed in
+    it, not when a file in it is rewritten; changed file contents are caught by the output
+    cache (see cache.OutputCache), not here.
+
+    :param path: The JSON file the manifest is kept in.
+    :param root: The root directory of the tree. A manifest of another root is ignored.
+    """
+
+    def __init__(self, path=DEFAULT_MANIFEST_PATH, root='.'):
+        self.path = path
+        self.root = os.path.abspath(root)
+        self.directories = {}
+        self.counts = {'listed': 0, 'reused': 0}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return
+        if manifest.get('version') == MANIFEST_FORMAT_VERSION and manifest.get('root') == self.root:
+            self.directories = manifest['directories']
+
+    def listing(self, directory, relative_directory):
+        """
+        Returns the names of the files and of the subdirectories of a directory, from the
+        manifest if the directory has not changed since, otherwise by listing it.
+
+        :param directory: The directory's path.
+        :param relative_directory: Its path relative to the root, the key in the manifest.
+        :return: A tuple (files, subdirectories) of sorted lists of names.
+        """
+        mtime_ns = os.stat(directory).st_mtime_ns
+        entry = self.directories.get(relative_directory)
+        if entry is not None and entry['mtime_ns'] == mtime_ns:
+            self.counts['reused'] += 1
+            return entry['files'], entry['directories']
+        files, directories = _list_directory(directory)
+        self.directories[relative_directory] = {'mtime_ns': mtime_ns, 'files': files, 'directories': directories}
+        self.counts['listed'] += 1
+        return files, directories
+
+    def save(self, seen=None):
+        """
+        Writes the manifest.
+
+        :param seen: The relative paths of the directories of the last complete scan; the
+            entries of other directories (since removed or excluded) are dropped.
+        """
+        if seen is not None:
+            self.directories = {key: value for key, value in self.directories.items() if key in seen}
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': MANIFEST_FORMAT_VERSION, 'root': self.root, 'directories': self.directories}, f)
+        os.replace(temp_path, self.path)
+
+
+def _list_directory(directory):
+    files, directories = [], []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            # Symbolic links to directories are not followed, so the walk cannot loop
+            if entry.is_dir(follow_symlinks=False):
+                directories.append(entry.name)
+            elif entry.is_file():
+                files.append(entry.name)
+    return sorted(files), sorted(directories)
+
+
+def walk_images(root, include=None, exclude=None, extensions=INPUT_EXTENSIONS, manifest=None):
+    """
+    Finds the image files under a directory, recursively, and yields them as they are found,
+    so processing starts before a large tree has been scanned completely.
+
+    Patterns are shell-style (fnmatch). A pattern containing a '/' is matched against the
+    path relative to the root, e.g. 'raw/*'; any other pattern against the file or directory
+    name, e.g. '*.tmp'. Directories matching an exclude pattern are not entered.
+
+    :param root: The directory to scan.
+    :param include: If given, only files matching one of these patterns are yielded.
+    :param exclude: Files and directories matching one of these patterns are skipped.
+    :param extensions: The file extensions to yield, in lower case.
+    :param manifest: A ScanManifest; unchanged directories are then not listed again. It is
+        saved when the walk completes.
+    :return: A generator of (relative_path, path) pairs in sorted order, where relative_path
+        uses '/' separators, e.g. 'trips/2024/beach.jpg'.
+    """
+    extensions = tuple(extension.lower() for extension in extensions)
+    seen = set()
+    # Depth-first with an explicit stack, so deep trees do not hit the recursion limit
+    stack = ['']
+    while stack:
+        relative_directory = stack.pop()
+        directory = os.path.join(root, relative_directory) if relative_directory else root
+        try:
+            if manifest is not None:
+                files, directories = manifest.listing(directory, relative_directory)
+            else:
+                files, directories = _list_directory(directory)
+        except OSError as e:
+            print(f"Skipping {directory}: {e}")
+            continue
+        seen.add(relative_directory)
+        prefix = relative_directory + '/' if relative_directory else ''
+        directory_prefix = os.path.join(directory, '')
+        for name in files:
+            if not name.lower().endswith(extensions):
+                continue
+            relative_path = prefix + name
+            if include and not _matches(relative_path, include):
+                continue
+            if exclude and _matches(relative_path, exclude):
+                continue
+            yield relative_path, directory_prefix + name
+        subdirectories = [prefix + name for name in directories]
+        if exclude:
+            subdirectories = [path for path in subdirectories if not _matches(path, exclude)]
+        stack.extend(reversed(subdirectories))
+    if manifest is not None:
+        manifest.save(seen)
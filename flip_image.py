@@ -14,6 +14,7 @@ def flip_image(image_input: ImageFile, direction: str):
     elif direction == 'vertical':
         return image_input.transpose(Image.FLIP_TOP_BOTTOM)
     elif direction == 'both':
-        return image_input.transpose(Image.FLIP_LEFT_RIGHT).transpose(Image.FLIP_TOP_BOTTOM)
+        # Flipping both ways is a 180 degree rotation, done in a single pass
+        return image_input.transpose(Image.ROTATE_180)
     else:
         raise ValueError(f"Invalid flip direction: {direction}. Available directions: 'horizontal', 'vertical', 'both'")
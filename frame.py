@@ -0,0 +1,131 @@
+"""
+Frames: images passed between operations as a PIL image, a NumPy array, or both.
+
+Most operations work on PIL images; the edge detectors work on NumPy arrays. A ``Frame``
+holds whichever representation the last operation produced and converts to the other one
+only when an operation asks for it, so a run of array operations never goes through PIL.
+
+An 'L' or 'RGBA' array becomes a PIL image without copying: the image shares the array's
+buffer ('RGB' arrays are copied, because Pillow stores RGB pixels in four bytes). Getting
+an array from a PIL image copies the pixels once. Frames are never modified after they are
+made, so sharing a buffer between the two representations is safe.
+
+For the same reason a frame caches the planes that operations derive from it: the
+luminance, the alpha band and the mean grey level are computed at most once per frame,
+however many operations read them (e.g. the three detectors of ``--edge-detection all``).
+An operation that changes the pixels returns a new frame, which starts with an empty cache,
+so nothing cached can go stale.
+
+A frame also keeps count of the pixel buffers it allocates (see allocated_bytes), which is
+how --profile measures the image memory each step allocates.
+"""
+import numpy as np
+from PIL import Image
+
+from profiling import buffer_bytes
+
+
+class Frame:
+    """An image in the pipeline. Create it from a PIL image, or from a uint8 array of shape
+    (height, width), (height, width, 3) or (height, width, 4) for 'L', 'RGB' or 'RGBA'."""
+
+    def __init__(self, image=None, array=None):
+        if (image is None) == (array is None):
+            raise ValueError("A frame needs either an image or an array.")
+        self._image = image
+        self._arrays = {}
+        self._derived = {}
+        if array is not None:
+            self._mode = 'L' if array.ndim == 2 else {3: 'RGB', 4: 'RGBA'}[array.shape[2]]
+            self._size = (array.shape[1], array.shape[0])
+            self._arrays[self._mode] = array
+            self._allocated = array.nbytes
+        else:
+            self._mode = image.mode
+            self._size = image.size
+            self._allocated = buffer_bytes(image.mode, image.size)
+
+    @property
+    def mode(self):
+        return self._mode
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def has_image(self):
+        """True if the PIL image already exists, i.e. image() does not convert."""
+        return self._image is not None
+
+    def image(self):
+        """Returns the frame as a PIL image, making it from the array on first use."""
+        if self._image is None:
+            self._image = Image.fromarray(self._arrays[self._mode])
+            if not self._image.readonly:
+                # Copied rather than shared with the array
+                self._allocated += buffer_bytes(self._mode, self._size)
+        return self._image
+
+    def array(self, mode=None):
+        """
+        Returns the frame as a NumPy array, which must not be modified.
+
+        :param mode: The mode the array should have, e.g. 'L' for a grayscale array. The
+            conversion is done by Pillow, so it matches Image.convert exactly.
+        :return: An array of shape (height, width) or (height, width, bands).
+        """
+        mode = mode or self._mode
+        array = self._arrays.get(mode)
+        if array is None:
+            image = self.image()
+            if image.mode != mode:
+                image = image.convert(mode)
+                self._allocated += buffer_bytes(mode, self._size)
+            array = np.asarray(image)
+            self._allocated += array.nbytes
+            self._arrays[mode] = array
+        return array
+
+    def allocated_bytes(self):
+        """
+        Returns the bytes of the pixel buffers of the frame: the image or array it was
+        made from, plus every conversion made since (see image and array).
+        """
+        return self._allocated
+
+    def derived(self, name, compute):
+        """
+        Returns data derived from the frame, computing it on first use.
+
+        :param name: The name the data is cached under.
+        :param compute: A function that computes the data from the frame.
+        :return: The cached data, which must not be modified.
+        """
+        if name not in self._derived:
+            self._derived[name] = compute(self)
+        return self._derived[name]
+
+    def luminance(self):
+        """Returns the 'L' array of the frame, as Image.convert('L') computes it."""
+        return self.array('L')
+
+    def alpha(self):
+        """Returns the alpha band of an 'RGBA' frame as a (height, width) array, or None without alpha."""
+        if self._mode != 'RGBA':
+            return None
+        return self.derived('alpha', lambda frame: frame.array('RGBA')[..., 3])
+
+    def grey_mean(self):
+        """Returns the mean grey level of the frame rounded to an integer, as ImageEnhance.Contrast computes it."""
+        return self.derived('grey_mean', _grey_mean)
+
+
+def _grey_mean(frame):
+    histogram = np.bincount(frame.luminance().ravel(), minlength=256)
+    return int(int((histogram * np.arange(256)).sum()) / (frame.size[0] * frame.size[1]) + 0.5)
+
+
+def as_frame(image):
+    """Returns a Frame for a PIL image, or the frame itself if it already is one."""
+    return image if isinstance(image, Frame) else Frame(image)
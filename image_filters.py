@@ -1,5 +1,16 @@
+import numpy as np
 from PIL import Image, ImageOps, ImageEnhance
 
+from frame import Frame, as_frame
+
+_LEVELS = np.arange(256)
+
+EDGE_METHODS = ('sobel', 'canny', 'kovalevsky')
+
+# None of these functions modify the image they are given. They allocate one new image for
+# their result where they can: RGB input is not converted to a copy of itself first, and
+# RGBA input is processed with its alpha band in place rather than split off and merged back.
+
 
 def invert_colors(image: Image.Image) -> Image.Image:
     """
@@ -7,12 +18,9 @@ def invert_colors(image: Image.Image) -> Image.Image:
     :param image: The input image.
     :return: The image with inverted colors.
     """
-    return ImageOps.invert(image.convert('RGB'))
-
-
-from skimage import feature, filters
-from skimage.util import img_as_ubyte
-import numpy as np
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    return ImageOps.invert(image)
 
 
 def grayscale(image: Image.Image) -> Image.Image:
@@ -26,89 +34,138 @@ def grayscale(image: Image.Image) -> Image.Image:
 
 def edge_detection(image: Image.Image, method: str, threshold: int = 50) -> Image.Image:
     """
-    Applies edge detection to an image using one of three methods.
+    Applies edge detection to an image using one of three methods, or all of them.
     :param image: The input image.
-    :param method: The edge detection method ('sobel', 'canny', 'kovalevsky').
+    :param method: The edge detection method ('sobel', 'canny', 'kovalevsky'), or 'all'
+        for an RGB image with the Sobel, Canny and Kovalevsky edges in its three bands.
     :param threshold: The sensitivity threshold for the Kovalevsky method.
     :return: The image with edges detected.
     """
+    return Image.fromarray(edge_map(image, method, threshold))
 
-    try:
-        from skimage import feature, filters
-        from skimage.util import img_as_ubyte
-        import numpy as np
-    except ImportError:
-        raise ImportError("scikit-image and numpy are required for edge detection.")
 
-    if method not in ['sobel', 'canny', 'kovalevsky']:
-        raise ValueError("Method must be 'sobel', 'canny', or 'kovalevsky'")
+def edge_map(image, method: str, threshold: int = 50) -> np.ndarray:
+    """
+    Applies edge detection and returns the edges as an array, for callers that keep
+    working on arrays (see frame.Frame).
+    :param image: The input image, or a frame.Frame. A frame that already holds a grayscale
+        array is not converted.
+    :param method: The edge detection method ('sobel', 'canny', 'kovalevsky'), or 'all'.
+    :param threshold: The sensitivity threshold for the Kovalevsky method.
+    :return: A uint8 array of shape (height, width) with the edges; for 'all', of shape
+        (height, width, 3) with the Sobel, Canny and Kovalevsky edges in that order.
+    """
+
+    if method not in EDGE_METHODS + ('all',):
+        raise ValueError("Method must be 'sobel', 'canny', 'kovalevsky' or 'all'")
+
+    if method == 'all':
+        return edge_maps(image, threshold)
+
+    # scikit-image is slow to import, so it is only loaded by the methods that use it
+    if method in ('sobel', 'canny'):
+        try:
+            from skimage import feature, filters
+        except ImportError:
+            raise ImportError("scikit-image is required for Sobel and Canny edge detection.")
+
+    frame = as_frame(image)
 
     if method == 'sobel':
-        # Convert to grayscale and then to numpy array
-        grayscale_img = image.convert('L')
-        img_array = np.array(grayscale_img)
+        # Get the image as a grayscale numpy array
+        img_array = frame.luminance()
         # Apply Sobel filter
         edge_map = filters.sobel(img_array)
-        # Convert the result back to an image
-        edge_map_uint8 = np.clip(edge_map * 255, 0, 255).astype(np.uint8)
-        edge_image = Image.fromarray(edge_map_uint8, mode='L')
-        return edge_image
+        # Convert the result to 8 bits
+        return np.clip(edge_map * 255, 0, 255).astype(np.uint8)
 
     elif method == 'canny':
-        # Convert to grayscale and then to numpy array
-        grayscale_img = image.convert('L')
-        img_array = np.array(grayscale_img)
+        # Get the image as a grayscale numpy array
+        img_array = frame.luminance()
         # Apply Canny filter
         edge_map = feature.canny(img_array)
         # Convert the boolean array to a uint8 array (0s and 255s)
-        edge_map_uint8 = (edge_map * 255).astype(np.uint8)
-        # Convert the result back to an image
-        edge_image = Image.fromarray(edge_map_uint8)
-        return edge_image
+        return (edge_map * 255).astype(np.uint8)
 
     elif method == 'kovalevsky':
-        # Convert the image to a NumPy array for efficient processing
-        img_array = np.array(image.convert('RGB'), dtype=np.int16)
-        height, width, _ = img_array.shape
+        # Convert the image to a NumPy array for efficient processing. Grayscale stays one
+        # channel; _channel_diff_sum scales its differences by three, which equals the sum
+        # over the three identical channels of an RGB copy without allocating them.
+        img_array = frame.array('L' if frame.mode == 'L' else 'RGB').astype(np.int16)
+        height, width = img_array.shape[:2]
 
         # Guard against images smaller than the required 6-pixel window
         if height < 6 or width < 6:
-            return Image.new('L', (width, height), 0)
+            return np.zeros((height, width), dtype=np.uint8)
 
-        # Create a new black image to draw the edges onto
         edge_map = np.zeros((height, width), dtype=np.uint8)
 
         # --- Horizontal Scan ---
-        if width >= 6:
-            for y in range(height):
-                for x in range(width - 5):
-                    pixels = img_array[y, x:x + 6]
-                    diffs = np.abs(pixels[1:] - pixels[:-1]).sum(axis=1)
-                    center_diff = diffs[2]
-                    if (center_diff > threshold and
-                            center_diff > diffs[0] and
-                            center_diff > diffs[1] and
-                            center_diff > diffs[3] and
-                            center_diff > diffs[4]):
-                        edge_map[y, x + 3] = 255
+        # diffs[y, j] is the summed RGB difference between pixels j and j+1.
+        diffs = _channel_diff_sum(img_array, axis=1)
+        edge_map[:, 3:width - 2][_kovalevsky_maxima(diffs, threshold)] = 255
 
         # --- Vertical Scan ---
-        if height >= 6:
-            for x in range(width):
-                for y in range(height - 5):
-                    pixels = img_array[y:y + 6, x]
-                    diffs = np.abs(pixels[1:] - pixels[:-1]).sum(axis=1)
-                    center_diff = diffs[2]
-                    if (center_diff > threshold and
-                            center_diff > diffs[0] and
-                            center_diff > diffs[1] and
-                            center_diff > diffs[3] and
-                            center_diff > diffs[4]):
-                        edge_map[y + 3, x] = 255
-
-        # Convert the NumPy array back to an image
-        edge_image = Image.fromarray(edge_map, mode='L')
-        return edge_image
+        diffs = _channel_diff_sum(img_array, axis=0)
+        edge_map[3:height - 2, :][_kovalevsky_maxima(diffs.T, threshold).T] = 255
+
+        return edge_map
+
+
+def edge_maps(image, threshold: int = 50) -> np.ndarray:
+    """
+    Applies all three edge detection methods to one frame, so the grayscale array that
+    Sobel and Canny read (and Kovalevsky too, on grayscale input) is converted only once.
+    :param image: The input image, or a frame.Frame.
+    :param threshold: The sensitivity threshold for the Kovalevsky method.
+    :return: A uint8 array of shape (height, width, 3) with the Sobel, Canny and Kovalevsky edges.
+    """
+    frame = as_frame(image)
+    return np.dstack([edge_map(frame, method, threshold) for method in EDGE_METHODS])
+
+
+def _channel_diff_sum(img_array, axis):
+    """
+    Sums the absolute differences between neighbouring pixels over all channels.
+    :param img_array: An int16 array of shape (height, width, channels), or (height, width)
+        for grayscale, which counts as three identical channels.
+    :param axis: 1 for horizontal neighbours, 0 for vertical neighbours.
+    :return: An int16 array one element shorter than the input along ``axis``.
+    """
+    head = [slice(None)] * 2
+    tail = [slice(None)] * 2
+    head[axis] = slice(1, None)
+    tail[axis] = slice(None, -1)
+    if img_array.ndim == 2:
+        diffs = np.abs(img_array[tuple(head)] - img_array[tuple(tail)])
+        diffs *= 3
+        return diffs
+    diffs = None
+    # Accumulate channel by channel to avoid a full (height, width, channels) temporary
+    for channel in range(img_array.shape[2]):
+        plane = img_array[..., channel]
+        channel_diff = np.abs(plane[tuple(head)] - plane[tuple(tail)])
+        if diffs is None:
+            diffs = channel_diff
+        else:
+            diffs += channel_diff
+    return diffs
+
+
+def _kovalevsky_maxima(diffs, threshold):
+    """
+    Finds the positions where a difference is a strict local maximum within the
+    6-pixel Kovalevsky window (two neighbours on either side) and above the threshold.
+    :param diffs: Neighbour differences along the last axis.
+    :param threshold: The sensitivity threshold.
+    :return: A boolean mask for window centres 2 .. n-3 along the last axis.
+    """
+    n = diffs.shape[-1]
+    center = diffs[..., 2:n - 2]
+    mask = center > threshold
+    for offset in (-2, -1, 1, 2):
+        mask &= center > diffs[..., 2 + offset:n - 2 + offset]
+    return mask
 
 
 def adjust_brightness(image: Image.Image, brightness: int) -> Image.Image:
@@ -126,25 +183,18 @@ def adjust_brightness(image: Image.Image, brightness: int) -> Image.Image:
         return image
     factor = 1.0 + (brightness / 100.0)
 
-    if image.mode == 'RGBA':
-        r, g, b, a = image.split()
-        rgb = Image.merge('RGB', (r, g, b))
-        enhanced = ImageEnhance.Brightness(rgb).enhance(factor)
-        r2, g2, b2 = enhanced.split()
-        return Image.merge('RGBA', (r2, g2, b2, a))
-
-    # 'L' is supported for brightness; convert other modes to 'RGB'
-    if image.mode not in ('RGB', 'L'):
+    # 'L' and 'RGBA' are supported for brightness; convert other modes to 'RGB'
+    if image.mode not in ('RGB', 'RGBA', 'L'):
         image = image.convert('RGB')
-    return ImageEnhance.Brightness(image).enhance(factor)
+    return _apply_colour_table(image, blend_lut(0, factor))
 
 
 def adjust_contrast(image: Image.Image, contrast: int) -> Image.Image:
     """
     Adjusts the contrast of an image.
-    :param image: The input image.
+    :param image: The input image, or a frame.Frame whose cached mean grey level is used.
     :param contrast: An integer from -100 to 100.
-    :return: The image with adjusted contrast.
+    :return: The image with adjusted contrast; the input itself if the contrast is 0.
     """
     if not isinstance(contrast, int):
         raise TypeError("Contrast must be an integer.")
@@ -154,25 +204,21 @@ def adjust_contrast(image: Image.Image, contrast: int) -> Image.Image:
         return image
     factor = 1.0 + (contrast / 100.0)
 
-    if image.mode == 'RGBA':
-        r, g, b, a = image.split()
-        rgb = Image.merge('RGB', (r, g, b))
-        enhanced = ImageEnhance.Contrast(rgb).enhance(factor)
-        r2, g2, b2 = enhanced.split()
-        return Image.merge('RGBA', (r2, g2, b2, a))
-
-    # 'L' is supported for contrast; convert other modes to 'RGB'
-    if image.mode not in ('RGB', 'L'):
+    frame = as_frame(image)
+    image = frame.image()
+    # 'L' and 'RGBA' are supported for contrast; convert other modes to 'RGB'
+    if image.mode not in ('RGB', 'RGBA', 'L'):
         image = image.convert('RGB')
-    return ImageEnhance.Contrast(image).enhance(factor)
+        frame = Frame(image)
+    return _apply_colour_table(image, blend_lut(frame.grey_mean(), factor))
 
 
 def adjust_saturation(image: Image.Image, saturation: int) -> Image.Image:
     """
     Adjusts the saturation of an image.
-    :param image: The input image.
+    :param image: The input image, or a frame.Frame whose cached luminance and alpha are used.
     :param saturation: An integer from -100 to 100.
-    :return: The image with adjusted saturation.
+    :return: The image with adjusted saturation; the input itself if nothing changes.
     """
     if not isinstance(saturation, int):
         raise TypeError("Saturation must be an integer.")
@@ -182,13 +228,16 @@ def adjust_saturation(image: Image.Image, saturation: int) -> Image.Image:
         return image
     factor = 1.0 + (saturation / 100.0)
 
+    if isinstance(image, Frame):
+        if image.mode in ('RGB', 'RGBA'):
+            return _saturate(image, factor)
+        if image.mode == 'L':
+            return image
+        image = image.image()
 
+    # On RGBA the degenerate image carries the same alpha, so blending leaves alpha as is
     if image.mode == 'RGBA':
-        r, g, b, a = image.split()
-        rgb = Image.merge('RGB', (r, g, b))
-        enhanced = ImageEnhance.Color(rgb).enhance(factor)
-        r2, g2, b2 = enhanced.split()
-        return Image.merge('RGBA', (r2, g2, b2, a))
+        return ImageEnhance.Color(image).enhance(factor)
 
     # No-op for grayscale to preserve mode and avoid unintended conversion
     if image.mode == 'L':
@@ -198,3 +247,32 @@ def adjust_saturation(image: Image.Image, saturation: int) -> Image.Image:
     if image.mode != 'RGB':
         image = image.convert('RGB')
     return ImageEnhance.Color(image).enhance(factor)
+
+
+def _saturate(frame, factor):
+    """ImageEnhance.Color(frame.image()).enhance(factor), with the degenerate image made from the frame's cached planes."""
+    grey = Image.fromarray(frame.luminance())
+    alpha = frame.alpha()
+    bands = (grey, grey, grey) if alpha is None else (grey, grey, grey, Image.fromarray(alpha))
+    return Image.blend(Image.merge(frame.mode, bands), frame.image(), factor)
+
+
+def blend_lut(degenerate, factor):
+    """
+    Lookup table equivalent of Image.blend(constant image, image, factor), using the same
+    single-precision arithmetic and truncation as Pillow.
+    :param degenerate: The level of the constant image.
+    :param factor: The blend factor.
+    :return: A uint8 array of 256 output levels.
+    """
+    degenerate = np.float32(degenerate)
+    blended = degenerate + np.float32(factor) * (_LEVELS.astype(np.float32) - degenerate)
+    return np.clip(blended, 0, 255).astype(np.uint8)
+
+
+def _apply_colour_table(image, table):
+    """Maps the colour bands of an 'L', 'RGB' or 'RGBA' image through a table in one pass; alpha is kept."""
+    table = table.tolist()
+    if image.mode == 'L':
+        return image.point(table)
+    return image.point(table * 3 + (_LEVELS.tolist() if image.mode == 'RGBA' else []))
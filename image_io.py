@@ -0,0 +1,144 @@
+"""
+Opening and decoding input images.
+
+Most formats are decoded by Pillow. NumPy .npy files and uncompressed TIFFs with 8-bit
+L, RGB or RGBA pixels are memory-mapped instead (see map_image): the operating system reads
+their pages only when an operation touches them, and the pages are backed by the file, so
+the input never needs a copy in memory.
+"""
+import os
+
+import numpy as np
+from PIL import Image
+
+from frame import Frame
+
+MAPPED_EXTENSIONS = ('.npy', '.tif', '.tiff')
+
+
+def load_image(filepath, reduce_to=None):
+    """
+    Opens and decodes an image file.
+
+    The file handle is released as soon as the pixel data is loaded, so the returned
+    image does not keep the file open.
+
+    :param filepath: The path of the image file.
+    :param reduce_to: See decode_image.
+    :return: The loaded image.
+    """
+    return decode_image(open_image(filepath), reduce_to)
+
+
+def open_image(filepath):
+    """
+    Opens an image file without decoding it. The size and mode are available right away.
+
+    :param filepath: The path or binary file object of the image file.
+    :return: The image; pass it to decode_image to load the pixel data. Files that can be
+        memory-mapped (see map_image) are returned as a frame.Frame over the map instead,
+        which needs no decoding.
+    """
+    if is_image_path(filepath) and str(filepath).lower().endswith(MAPPED_EXTENSIONS):
+        frame = map_image(filepath)
+        if frame is not None:
+            return frame
+    return Image.open(filepath)
+
+
+def map_image(filepath):
+    """
+    Memory-maps the pixels of a NumPy .npy file or of an uncompressed TIFF.
+
+    :param filepath: The path of the file.
+    :return: A frame.Frame over the read-only map, or None if the file cannot be mapped
+        (a compressed TIFF, or pixels that are not 8-bit L, RGB or RGBA).
+    :raises ValueError: If an .npy file does not hold an image.
+    """
+    if str(filepath).lower().endswith('.npy'):
+        array = np.load(filepath, mmap_mode='r')
+        if array.ndim == 3 and array.shape[2] == 1:
+            array = array[..., 0]
+        if array.dtype != np.uint8 or not (array.ndim == 2 or (array.ndim == 3 and array.shape[2] in (3, 4))):
+            raise ValueError(f"{filepath}: expected a uint8 array of shape (height, width) or "
+                             f"(height, width, 3 or 4), got {array.dtype} {array.shape}")
+        return Frame(array=array)
+    try:
+        import tifffile
+    except ImportError:
+        return None
+    try:
+        with tifffile.TiffFile(filepath) as tiff:
+            page = tiff.pages[0]
+            if not page.is_memmappable or tiff_page_mode(page) is None:
+                return None
+        return Frame(array=tifffile.memmap(filepath, page=0, mode='r'))
+    except Exception:
+        # Not a TIFF tifffile can read; Pillow reports the problem, if there is one
+        return None
+
+
+def tiff_page_mode(page):
+    """Returns the Pillow mode of a tifffile page with 8-bit L, RGB or RGBA pixels, or None for other layouts."""
+    if page.dtype != np.uint8 or page.planarconfig != 1 or page.imagedepth != 1:
+        return None
+    samples = page.samplesperpixel
+    if page.photometric == 1 and samples == 1:
+        return 'L'
+    if page.photometric == 2 and samples == 3:
+        return 'RGB'
+    if page.photometric == 2 and samples == 4 and tuple(page.extrasamples) == (2,):
+        return 'RGBA'
+    return None
+
+
+def decode_image(image, reduce_to=None):
+    """
+    Decodes an image returned by open_image and releases its file.
+
+    :param image: The opened image.
+    :param reduce_to: A (width, height) the image is going to be shrunk to. JPEG and JPEG
+        2000 files are then decoded at a reduced resolution that is still at least this size
+        (JPEG DCT scaling by up to 1/8, JPEG 2000 resolution levels), which is much faster
+        and uses less memory. Other formats are decoded at full size.
+    :return: The loaded image. Its size tells whether the decode was reduced.
+    """
+    if isinstance(image, Frame):
+        # A memory-mapped file, read at full size
+        return image.image()
+    try:
+        if reduce_to is not None:
+            _reduce_on_load(image, reduce_to)
+        image.load()
+    except Exception:
+        image.close()
+        raise
+    if getattr(image, 'n_frames', 1) > 1:
+        # Multi-frame files keep their file open for seeking; keep the current frame only.
+        frame = image.copy()
+        image.close()
+        return frame
+    return image
+
+
+def _reduce_on_load(image, size):
+    width, height = size
+    if image.format == 'JPEG':
+        # Picks the largest DCT scale that still gives at least the requested size
+        image.draft(image.mode, (width, height))
+    elif image.format == 'JPEG2000':
+        factor = 0
+        while (image.width >> (factor + 1) >= width and image.height >> (factor + 1) >= height
+               and factor < 5):
+            factor += 1
+        image.reduce = factor
+
+
+def is_image_path(item):
+    """Returns True if the item is a file path rather than an already loaded image."""
+    return isinstance(item, (str, os.PathLike))
+
+
+def is_image_source(item):
+    """Returns True if the item is a file path or a binary file object to open, rather than an already loaded image."""
+    return is_image_path(item) or hasattr(item, 'read')
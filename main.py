@@ -1,13 +1,26 @@
 import argparse
 import glob
+import itertools
 import os
 import sys
 from pathlib import Path
 
-from PIL import Image
-
-from file_management import move_images_to_subdirectory
+from cache import DEFAULT_CACHE_DIR, DEFAULT_CACHE_SIZE_MB, MaskCache, OutputCache
+from encoders import COMPRESSION_PRESETS, DEFAULT_FORMAT, OUTPUT_FORMATS, output_extension
+from file_management import (
+    DEFAULT_MANIFEST_PATH,
+    INPUT_EXTENSIONS,
+    ScanManifest,
+    move_images_to_subdirectory,
+    walk_images,
+)
+from profiling import DEFAULT_PROFILE_PATH
+from remove_background import DEFAULT_BG_BATCH, DEFAULT_BG_BATCH_WAIT, DEFAULT_MODEL, DEFAULT_PROXY_SIZE
+from server import DEFAULT_BATCH_WAIT, DEFAULT_HOST, DEFAULT_MAX_BATCH, DEFAULT_MAX_QUEUE, DEFAULT_PORT, serve
+from strips import DEFAULT_THREADS
+from tiling import DEFAULT_TILE_ROWS, MIN_TILE_ROWS
 from processing import process_images_and_save
+from watch import DEFAULT_POLL_INTERVAL, DEFAULT_SETTLE_SECONDS, watch_folder
 
 
 class StoreInOrder(argparse.Action):
@@ -23,22 +36,80 @@ class StoreInOrder(argparse.Action):
         namespace.ordered_operations.append({'dest': self.dest, 'values': norm_values})
 
 
-# --- Main Execution ---
+def manage_cache(args):
+    directory = args.cache or DEFAULT_CACHE_DIR
+    max_bytes = args.cache_size * 1024 * 1024
+    for label, cache in (('Output', OutputCache(directory, max_bytes)), ('Mask', MaskCache(directory, max_bytes))):
+        if args.cache_purge:
+            cache.purge()
+            print(f"{label} cache purged: {cache.directory}")
+            continue
+        stats = cache.stats()
+        print(f"{label} cache: {stats['directory']}")
+        print(f"  Entries: {stats['entries']}")
+        print(f"  Size:    {stats['bytes'] / (1024 * 1024):.1f} MB of {stats['max_bytes'] / (1024 * 1024):.0f} MB")
 
-def main():
-    # If --menu is used or no arguments are provided, start the menu.
-    if '--menu' in sys.argv or len(sys.argv) == 1:
-        # Import dynamically to prevent circular dependency issues with tests
-        from menu import interactive_menu
-        interactive_menu()
+
+def process_tree(args):
+    root = args.file if args.file and args.file != '*' else 'Base Images'
+    if not os.path.isdir(root):
+        print(f"Not a directory: {root}")
         return
+    extensions = [extension if extension.startswith('.') else '.' + extension for extension in args.extensions]
+    manifest = ScanManifest(args.manifest, root) if args.manifest else None
+    # The tree is scanned as the pipeline consumes the images, so processing starts right away
+    images_data = walk_images(root, args.include, args.exclude, extensions, manifest)
+    first = next(images_data, None)
+    if first is None:
+        print(f"No images found in {root}")
+    else:
+        process_images_and_save(itertools.chain([first], images_data), args.ordered_operations, args)
+    if manifest is not None:
+        counts = manifest.counts
+        print(f"Listed {counts['listed']} changed directories, reused the listing of {counts['reused']} unchanged ones.")
+
 
+def build_parser():
+    """Returns the command-line parser. The server mode parses the chain of each request with it too."""
     parser = argparse.ArgumentParser(description="A versatile command-line image manipulation tool.")
     parser.add_argument('file', type=str, nargs='?', default=None,
                         help='The image file or pattern to process (e.g., "input.jpg", "images/*.png").')
+    parser.add_argument('-r', '--recursive', action='store_true',
+                        help='Treat the file argument as a directory (default: "Base Images") and process every image '
+                             'below it. The outputs mirror its subdirectories under Output; the inputs are not moved.')
+    parser.add_argument('--include', action='append', metavar='PATTERN',
+                        help="With --recursive: only process files matching PATTERN (e.g. '*.jpg' or 'raw/*'). "
+                             'Can be given several times.')
+    parser.add_argument('--exclude', action='append', metavar='PATTERN',
+                        help="With --recursive: skip files and directories matching PATTERN (e.g. 'thumbs'). "
+                             'Can be given several times.')
+    parser.add_argument('--extensions', nargs='+', default=list(INPUT_EXTENSIONS), metavar='EXT',
+                        help='With --recursive: the file extensions to process (default: all supported image types).')
+    parser.add_argument('--manifest', nargs='?', const=DEFAULT_MANIFEST_PATH, default=None, metavar='FILE',
+                        help='With --recursive: keep the directory listings in FILE (default: '
+                             f'{DEFAULT_MANIFEST_PATH}) so a rescan only lists the directories that changed.')
     parser.add_argument('--menu', action='store_true', help='Start the application in interactive menu mode.')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Number of images to process in parallel (default: 1). Progress messages of '
+                             'images processed at the same time are interleaved.')
+    parser.add_argument('--threads', type=int, default=DEFAULT_THREADS,
+                        help='Number of threads that split up each edge detection and scaling of a single image '
+                             f'(default: {DEFAULT_THREADS}). Independent of --jobs; useful for a few large images.')
     parser.add_argument('-bg', '--remove-background', dest='remove_background', action=StoreInOrder, nargs=0,
                         help='Remove image background.')
+    parser.add_argument('--bg-model', dest='bg_model', type=str, default=DEFAULT_MODEL,
+                        help=f'rembg model used for background removal (default: {DEFAULT_MODEL}).')
+    parser.add_argument('--bg-batch', type=int, default=DEFAULT_BG_BATCH, metavar='N',
+                        help='Run the background removal model on up to N images at once. Batches are formed from '
+                             f'the images processed at the same time, so use it with --jobs (default: {DEFAULT_BG_BATCH}, '
+                             'no batching).')
+    parser.add_argument('--bg-batch-wait-ms', type=float, default=DEFAULT_BG_BATCH_WAIT * 1000, metavar='MS',
+                        help='With --bg-batch: how long a model run waits for more images to batch with '
+                             f'(default: {DEFAULT_BG_BATCH_WAIT * 1000:g}).')
+    parser.add_argument('--bg-proxy', type=int, nargs='?', const=DEFAULT_PROXY_SIZE, default=None, metavar='SIZE',
+                        help='Compute the background mask of images larger than SIZE pixels on a side from a copy '
+                             'scaled down to SIZE, then scale the mask back up along the edges of the full image '
+                             f'(default SIZE: {DEFAULT_PROXY_SIZE}). Off unless given.')
     parser.add_argument('-s', '--scale', dest='scale', action=StoreInOrder, nargs='+',
                         help="Scale image by factor (e.g., '1.5x') or to a specific size (e.g., '400px 300px').")
     parser.add_argument('--resample', type=str, default='bilinear',
@@ -51,8 +122,10 @@ def main():
                         choices=['horizontal', 'vertical', 'both'],
                         help='Flip image horizontally, vertically, or both.')
     parser.add_argument('--edge-detection', dest='edge_detection', action=StoreInOrder, type=str,
-                        choices=['sobel', 'canny', 'kovalevsky'],
-                        help='Apply edge detection using the specified method.')
+                        choices=['sobel', 'canny', 'kovalevsky', 'all'],
+                        help="Apply edge detection using the specified method. 'all' runs the three on one shared "
+                             'grayscale copy and writes an RGB image with the Sobel, Canny and Kovalevsky edges '
+                             'in its red, green and blue bands.')
     parser.add_argument('--threshold', type=int, default=50,
                         help='Threshold for the Kovalevsky edge detection method (0-255).')
     parser.add_argument('--brightness', dest='brightness', action=StoreInOrder, type=int,
@@ -61,31 +134,130 @@ def main():
                         help='Adjust contrast (-100 to 100).')
     parser.add_argument('--saturation', dest='saturation', action=StoreInOrder, type=int,
                         help='Adjust saturation (-100 to 100).')
+    parser.add_argument('--no-optimize', dest='optimize', action='store_false',
+                        help='Run the operations in the literal order given, without merging flips or moving scales.')
+    parser.add_argument('--no-fuse', dest='fuse', action='store_false',
+                        help='Run consecutive point-wise operations one by one instead of fusing them into one pass.')
+    parser.add_argument('--no-draft', dest='draft', action='store_false',
+                        help='Always decode at full resolution, even when the first operation shrinks the image.')
+    parser.add_argument('--no-overlap', dest='overlap', action='store_false',
+                        help='With one job, load, process and save the images strictly one after the other '
+                             'instead of overlapping loading and saving with processing (for debugging).')
+    parser.add_argument('--tiled', nargs='?', type=int, const=DEFAULT_TILE_ROWS, default=None, metavar='ROWS',
+                        help='Process large images in bands of ROWS rows to bound memory use '
+                             f'(default: {DEFAULT_TILE_ROWS}).')
+    parser.add_argument('--format', dest='formats', nargs='+', choices=list(OUTPUT_FORMATS), default=[DEFAULT_FORMAT],
+                        metavar='FORMAT',
+                        help=f'Output format(s): {", ".join(OUTPUT_FORMATS)} (default: {DEFAULT_FORMAT}). '
+                             'Several formats are written from one processed image. jpeg skips images with transparency.')
+    parser.add_argument('--compression', choices=COMPRESSION_PRESETS, default='default',
+                        help='Encoder preset: fast (quickest), default or compact (smallest files).')
+    parser.add_argument('--quality', type=int,
+                        help='Quality of the lossy formats webp-lossy and jpeg (1 to 100; defaults: 80 and 90).')
+    parser.add_argument('--profile', nargs='?', const=DEFAULT_PROFILE_PATH, default=None, metavar='FILE',
+                        help='Record the time and memory of every step of every image, write them to FILE '
+                             f'(default: {DEFAULT_PROFILE_PATH}) and a Chrome trace next to it, and print the slowest steps.')
+    parser.add_argument('--cache', nargs='?', const=DEFAULT_CACHE_DIR, default=None, metavar='DIR',
+                        help=f'Skip images whose output is up to date and reuse background-removal masks, '
+                             f'using a cache in DIR (default: {DEFAULT_CACHE_DIR}).')
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_SIZE_MB, metavar='MB',
+                        help=f'Size cap of the output cache and of the mask cache in MB (default: {DEFAULT_CACHE_SIZE_MB}).')
+    parser.add_argument('--watch', metavar='DIR',
+                        help='Keep running and process every image dropped into DIR as it arrives, with the '
+                             'libraries and background-removal models kept loaded. Processed files are moved '
+                             'to DIR/Base Images.')
+    parser.add_argument('--poll-interval', type=float, default=DEFAULT_POLL_INTERVAL, metavar='SECONDS',
+                        help=f'With --watch: time between two scans of DIR (default: {DEFAULT_POLL_INTERVAL}).')
+    parser.add_argument('--settle', type=float, default=DEFAULT_SETTLE_SECONDS, metavar='SECONDS',
+                        help='With --watch: how long a file must stay unchanged before it is processed, so '
+                             f'files still being copied are skipped (default: {DEFAULT_SETTLE_SECONDS}).')
+    parser.add_argument('--serve', nargs='?', type=int, const=DEFAULT_PORT, default=None, metavar='PORT',
+                        help=f'Run an HTTP server on PORT (default: {DEFAULT_PORT}) that processes images POSTed to '
+                             '/process; the operations given here are the default chain.')
+    parser.add_argument('--host', default=DEFAULT_HOST,
+                        help=f'With --serve: the address to listen on (default: {DEFAULT_HOST}).')
+    parser.add_argument('--max-queue', type=int, default=DEFAULT_MAX_QUEUE, metavar='N',
+                        help='With --serve: the most requests that can wait; more are answered with 503 '
+                             f'(default: {DEFAULT_MAX_QUEUE}).')
+    parser.add_argument('--max-batch', type=int, default=DEFAULT_MAX_BATCH, metavar='N',
+                        help=f'With --serve: the most requests run as one batch (default: {DEFAULT_MAX_BATCH}).')
+    parser.add_argument('--batch-wait-ms', type=float, default=DEFAULT_BATCH_WAIT * 1000, metavar='MS',
+                        help='With --serve: how long to wait for more requests to batch with the first one '
+                             f'(default: {DEFAULT_BATCH_WAIT * 1000:g}).')
+    parser.add_argument('--cache-info', action='store_true', help='Show the contents of the caches and exit.')
+    parser.add_argument('--cache-purge', action='store_true', help='Empty the caches and exit.')
+    return parser
+
+
+# --- Main Execution ---
+
+def main():
+    # If --menu is used or no arguments are provided, start the menu.
+    if '--menu' in sys.argv or len(sys.argv) == 1:
+        # Import dynamically to prevent circular dependency issues with tests
+        from menu import interactive_menu
+        interactive_menu()
+        return
 
+    parser = build_parser()
     args = parser.parse_args()
 
+    if args.jobs < 1:
+        parser.error('--jobs must be at least 1.')
+    if args.threads < 1:
+        parser.error('--threads must be at least 1.')
+    if args.tiled is not None and args.tiled < MIN_TILE_ROWS:
+        parser.error(f'--tiled must be at least {MIN_TILE_ROWS} rows.')
+    if args.poll_interval <= 0:
+        parser.error('--poll-interval must be greater than 0.')
+    if args.settle < 0:
+        parser.error('--settle must not be negative.')
+    if args.max_queue < 1 or args.max_batch < 1:
+        parser.error('--max-queue and --max-batch must be at least 1.')
+    if args.batch_wait_ms < 0:
+        parser.error('--batch-wait-ms must not be negative.')
+    if args.bg_batch < 1:
+        parser.error('--bg-batch must be at least 1.')
+    if args.bg_batch_wait_ms < 0:
+        parser.error('--bg-batch-wait-ms must not be negative.')
+    if args.bg_proxy is not None and args.bg_proxy < 1:
+        parser.error('--bg-proxy must be at least 1.')
+    if args.quality is not None and not 1 <= args.quality <= 100:
+        parser.error('--quality must be between 1 and 100.')
+    extensions = [output_extension(output_format) for output_format in args.formats]
+    if len(set(extensions)) < len(extensions):
+        parser.error('--format: each format must write a different file type (webp and webp-lossy both write .webp).')
+
+    if args.cache_info or args.cache_purge:
+        manage_cache(args)
+        return
+
+    if args.serve is not None:
+        serve(getattr(args, 'ordered_operations', []), args, args.host, args.serve, args.max_queue, args.max_batch,
+              args.batch_wait_ms / 1000)
+        return
+
     if not hasattr(args, 'ordered_operations'):
         print('No actions specified. To see available options, run with --help.')
         return
 
+    if args.watch:
+        watch_folder(args.watch, args.ordered_operations, args, args.poll_interval, args.settle)
+        return
+
+    if args.recursive:
+        process_tree(args)
+        return
+
     move_images_to_subdirectory('Base Images')
-    images_data = []
     image_path_pattern = args.file if args.file and args.file != '*' else 'Base Images/*'
 
-    try:
-        filepaths = glob.glob(image_path_pattern)
-        if not filepaths:
-            print(f"No files found matching pattern: {image_path_pattern}")
-            return
-        for filepath in filepaths:
-            if os.path.isfile(filepath):
-                with Image.open(filepath) as input_image:
-                    input_image.load()
-                    filename = Path(filepath).name
-                    images_data.append([filename, input_image.copy()])
-    except Exception as e:
-        print(f'Error while loading file(s): {e}')
+    filepaths = glob.glob(image_path_pattern)
+    if not filepaths:
+        print(f"No files found matching pattern: {image_path_pattern}")
         return
+    # Images are loaded lazily, one at a time, as the pipeline reaches them.
+    images_data = ((Path(filepath).name, filepath) for filepath in filepaths if os.path.isfile(filepath))
 
     process_images_and_save(images_data, args.ordered_operations, args)
 
@@ -1,7 +1,6 @@
 import os
 import inspect
 from types import SimpleNamespace
-from PIL import Image
 from processing import process_images_and_save
 
 
@@ -71,7 +70,7 @@ def prompt_for_scale_options(extra_args):
 
 def prompt_for_edge_detection_options(extra_args):
     print("\n--- Edge Detection Options ---")
-    methods = ['sobel', 'canny', 'kovalevsky']
+    methods = ['sobel', 'canny', 'kovalevsky', 'all']
     for i, method in enumerate(methods): print(f"  {i + 1}. {method.capitalize()}")
     while True:
         method_str = input(f"Select method (default: {methods[0]}): ").strip()
@@ -85,7 +84,7 @@ def prompt_for_edge_detection_options(extra_args):
                 print(f"Invalid number. Choose between 1 and {len(methods)}.")
         except ValueError:
             print("Invalid input. Please enter a number.")
-    if chosen_method == 'kovalevsky':
+    if chosen_method in ('kovalevsky', 'all'):
         print("\n--- Kovalevsky Threshold ---")
         default_threshold = 50
         threshold = _prompt_for_int_value("Enter threshold value (0-255)", default_threshold, 0, 255)
@@ -148,7 +147,7 @@ def remove_manipulation(operations, extra_args):
                 if removed_op['dest'] == 'scale' and not any(op['dest'] == 'scale' for op in operations):
                     extra_args.pop('resample', None)
                 if removed_op['dest'] == 'edge_detection' and not any(
-                        op['dest'] == 'edge_detection' and op['values'][0] == 'kovalevsky' for op in operations):
+                        op['dest'] == 'edge_detection' and op['values'][0] in ('kovalevsky', 'all') for op in operations):
                     extra_args.pop('threshold', None)
                 return operations
             else:
@@ -219,7 +218,7 @@ def select_manipulations():
                 if op[
                     'dest'] == 'scale' and 'resample' in extra_args: display_string += f" --resample {extra_args['resample']}"
                 if op['dest'] == 'edge_detection' and op['values'] and op['values'][
-                    0] == 'kovalevsky' and 'threshold' in extra_args: display_string += f" --threshold {extra_args['threshold']}"
+                    0] in ('kovalevsky', 'all') and 'threshold' in extra_args: display_string += f" --threshold {extra_args['threshold']}"
                 print(f"  {i + 1}. {display_string}")
         print("\nAvailable manipulations:")
         for i, manip in enumerate(AVAILABLE_MANIPULATIONS): print(f"  {i + 1}. {manip['name']}")
@@ -277,22 +276,16 @@ def interactive_menu():
             print("\nNo images to process. Exiting.")
             return
         operations, extra_args = select_manipulations()
+        jobs = 1
+        if len(selected_image_paths) > 1:
+            jobs = _prompt_for_int_value("Enter number of images to process in parallel", 1, 1, 256)
         mock_args = SimpleNamespace(
             resample=extra_args.get('resample', 'bilinear'),
-            threshold=extra_args.get('threshold', 50)
+            threshold=extra_args.get('threshold', 50),
+            jobs=jobs
         )
-        images_data = []
-        print("\nLoading selected images...")
-        try:
-            for filepath in selected_image_paths:
-                with Image.open(filepath) as input_image:
-                    input_image.load()
-                    filename = os.path.basename(filepath)
-                    images_data.append([filename, input_image.copy()])
-            print("Images loaded successfully.")
-        except Exception as e:
-            print(f"\nError: Could not load one or more images. Details: {e}")
-            return
+        # Images are loaded lazily, one at a time, as the pipeline reaches them.
+        images_data = [[os.path.basename(filepath), filepath] for filepath in selected_image_paths]
         process_images_and_save(images_data, operations, mock_args)
         print("\n--- Processing Complete ---")
     except KeyboardInterrupt:
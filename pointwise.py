@@ -0,0 +1,239 @@
+"""
+Fusion of consecutive point-wise operations.
+
+A run of per-pixel operations (invert, grayscale, brightness, contrast, saturation) is
+executed as a whole instead of one full-image pass per step. Steps that remap each channel
+independently are composed into one lookup table that is applied with a single ``point()``
+pass. Saturation, the only step that mixes channels, runs as one colour pass after the
+pending table. RGBA images are processed as a whole with alpha mapped through an identity
+table, instead of every step splitting off alpha and merging the bands back.
+
+The output matches running the steps one by one with the functions in ``image_filters``,
+with one documented exception: a contrast step that follows another per-channel remap on
+colour data uses a mean grey level computed from the channel histograms rather than measured
+on the intermediate image. The mean can be off by one level, which moves that step's output
+by at most one level, scaled by the gain of any later steps. In practice fused output stays
+within ``FUSION_TOLERANCE`` levels per channel of sequential execution; the tests check this
+on randomly generated chains.
+"""
+import numpy as np
+from PIL import Image, ImageEnhance
+
+from frame import as_frame
+from image_filters import adjust_brightness, adjust_contrast, adjust_saturation, blend_lut, grayscale, invert_colors
+
+POINTWISE_OPERATIONS = ('invert', 'grayscale', 'brightness', 'contrast', 'saturation')
+FUSED_DEST = 'pointwise'
+FUSION_TOLERANCE = 2
+
+_LEVELS = np.arange(256)
+# Pillow's integer RGB -> L weights (ITU-R 601-2 luma, scaled by 2**16)
+_LUMA_WEIGHTS = (19595, 38470, 7471)
+
+
+def fuse_pointwise_operations(ordered_operations):
+    """
+    Replaces every run of two or more consecutive point-wise operations with a single
+    fused operation.
+
+    :param ordered_operations: The operations to apply, in order.
+    :return: A new list of operations. A fused run is {'dest': 'pointwise', 'values': [operations]}.
+    """
+    fused = []
+    run = []
+    for operation in list(ordered_operations) + [None]:
+        if operation is not None and operation['dest'] in POINTWISE_OPERATIONS:
+            run.append(operation)
+            continue
+        if len(run) > 1:
+            fused.append({'dest': FUSED_DEST, 'values': run})
+        else:
+            fused.extend(run)
+        run = []
+        if operation is not None:
+            fused.append(operation)
+    return fused
+
+
+def apply_pointwise(image: Image.Image, operations) -> Image.Image:
+    """
+    Applies a run of point-wise operations in as few passes over the image as possible.
+
+    :param image: The input image, or a frame.Frame; a contrast step that reads the
+        unchanged input uses the frame's cached mean grey level.
+    :param operations: The point-wise operations to apply, in order.
+    :return: The processed image.
+    """
+    frame = as_frame(image)
+    image = frame.image()
+    if image.mode not in ('RGB', 'RGBA', 'L'):
+        return _apply_sequentially(image, operations)
+    keep_alpha = not any(operation['dest'] in ('invert', 'grayscale') for operation in operations)
+    run = _PointwiseRun(image, keep_alpha, frame)
+    for operation in operations:
+        dest = operation['dest']
+        values = operation.get('values', [])
+        if dest == 'invert':
+            run.invert()
+        elif dest == 'grayscale':
+            run.grayscale()
+        elif dest == 'brightness':
+            run.brightness(values[0])
+        elif dest == 'contrast':
+            run.contrast(values[0])
+        elif dest == 'saturation':
+            run.saturation(values[0])
+        else:
+            raise ValueError(f"Not a point-wise operation: {dest}")
+    return run.result()
+
+
+def _apply_sequentially(image, operations):
+    """Runs the operations one by one, for modes the fused path does not handle."""
+    for operation in operations:
+        dest = operation['dest']
+        values = operation.get('values', [])
+        if dest == 'invert':
+            image = invert_colors(image)
+        elif dest == 'grayscale':
+            image = grayscale(image)
+        elif dest == 'brightness':
+            image = adjust_brightness(image, values[0])
+        elif dest == 'contrast':
+            image = adjust_contrast(image, values[0])
+        elif dest == 'saturation':
+            image = adjust_saturation(image, values[0])
+        else:
+            raise ValueError(f"Not a point-wise operation: {dest}")
+    return image
+
+
+def _check_adjustment(name, value):
+    # Same validation as the image_filters adjust_* functions
+    if not isinstance(value, int):
+        raise TypeError(f"{name} must be an integer.")
+    if not -100 <= value <= 100:
+        raise ValueError(f"{name} must be between -100 and 100.")
+    return 1.0 + (value / 100.0)
+
+
+class _PointwiseRun:
+    """
+    Execution state of a fused run.
+
+    ``base`` holds the last materialized image (mode 'L', 'RGB' or 'RGBA'). ``lut`` is the
+    lookup table for its colour channels that is still to be applied, and
+    ``pending_saturation`` a saturation factor to apply after the lookup table. Alpha is
+    never remapped. ``expanded`` marks single-channel data that has to be returned as RGB
+    (inverting a grayscale image gives an RGB image). ``source`` is the frame the run
+    started from, as long as ``base`` still holds its pixels.
+    """
+
+    def __init__(self, image, keep_alpha, frame=None):
+        # Invert and grayscale drop alpha; if the run contains either, drop it up front.
+        if image.mode == 'RGBA' and not keep_alpha:
+            image = image.convert('RGB')
+        self.expanded = False
+        self._set_base(image)
+        # Dropping alpha leaves the colour, and so the grey level, unchanged
+        self.source = frame
+
+    # --- Operations ---
+
+    def invert(self):
+        self._flush_saturation()
+        self.lut = 255 - self.lut
+        if self.channels == 1:
+            self.expanded = True
+
+    def grayscale(self):
+        if self.channels == 1:
+            self.expanded = False
+            return
+        self._flush()
+        self._set_base(self.base.convert('L'))
+
+    def brightness(self, brightness):
+        factor = _check_adjustment('Brightness', brightness)
+        if brightness == 0:
+            return
+        self._flush_saturation()
+        self.lut = blend_lut(0, factor)[self.lut]
+
+    def contrast(self, contrast):
+        factor = _check_adjustment('Contrast', contrast)
+        if contrast == 0:
+            return
+        self._flush_saturation()
+        self.lut = blend_lut(self._mean_grey(), factor)[self.lut]
+
+    def saturation(self, saturation):
+        factor = _check_adjustment('Saturation', saturation)
+        # Saturation leaves grayscale data unchanged
+        if saturation == 0 or self.channels == 1:
+            return
+        self._flush_saturation()
+        self.pending_saturation = factor
+
+    def result(self):
+        self._flush()
+        if self.expanded:
+            return self.base.convert('RGB')
+        return self.base
+
+    # --- Internals ---
+
+    def _set_base(self, image):
+        self.base = image
+        self.channels = 1 if image.mode == 'L' else 3
+        self.lut = np.tile(_LEVELS.astype(np.uint8), (self.channels, 1))
+        self.pending_saturation = None
+        self._histogram = None
+        self.source = None
+
+    def _lut_is_identity(self):
+        return bool((self.lut == _LEVELS).all())
+
+    def _colour_histogram(self):
+        if self._histogram is None:
+            histogram = np.array(self.base.histogram(), dtype=np.int64).reshape(-1, 256)
+            self._histogram = histogram[:self.channels]
+        return self._histogram
+
+    def _mean_grey(self):
+        """The rounded mean of the grayscale image, as ImageEnhance.Contrast computes it."""
+        if self.source is not None and self._lut_is_identity():
+            return self.source.grey_mean()
+        histogram = self._colour_histogram()
+        count = int(histogram[0].sum())
+        if self.channels == 1:
+            # Exact: remap the histogram through the pending table.
+            remapped = np.zeros(256, dtype=np.int64)
+            np.add.at(remapped, self.lut[0], histogram[0])
+            mean = int((remapped * _LEVELS).sum()) / count
+        elif self._lut_is_identity():
+            grey_histogram = np.array(self.base.convert('L').histogram(), dtype=np.int64)
+            mean = int((grey_histogram * _LEVELS).sum()) / count
+        else:
+            # Estimate from the per-channel means of the remapped data.
+            channel_sums = [int((histogram[channel] * self.lut[channel]).sum()) for channel in range(3)]
+            mean = sum(weight * total for weight, total in zip(_LUMA_WEIGHTS, channel_sums)) / 65536 / count
+        return int(mean + 0.5)
+
+    def _flush_saturation(self):
+        if self.pending_saturation is not None:
+            self._flush()
+
+    def _flush(self):
+        """Materializes the pending lookup table and saturation into ``base``."""
+        image = self.base
+        if not self._lut_is_identity():
+            table = self.lut.ravel().tolist()
+            if image.mode == 'RGBA':
+                table += _LEVELS.tolist()
+            image = image.point(table)
+        if self.pending_saturation is not None:
+            # On RGBA the degenerate image carries the same alpha, so blending leaves alpha as is.
+            image = ImageEnhance.Color(image).enhance(self.pending_saturation)
+        if image is not self.base:
+            self._set_base(image)
@@ -1,20 +1,34 @@
+import copy
 import os
-from pathlib import Path
+import queue
+import threading
+from collections import deque
+from collections.abc import Sized
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 
 from PIL import Image
 
+from cache import DEFAULT_CACHE_SIZE_MB, MaskCache, OutputCache, hash_file
+from chain_optimizer import describe_operation, optimize_operations
+from encoders import DEFAULT_FORMAT, output_extension, write_image
 from file_management import move_images_to_subdirectory
+from frame import Frame, as_frame
+from image_io import decode_image, is_image_path, is_image_source, open_image
+from pointwise import FUSED_DEST, apply_pointwise, fuse_pointwise_operations
+from profiling import DEFAULT_PROFILE_PATH, Profiler, buffer_bytes, image_bytes
 from flip_image import flip_image
 from image_filters import (
     adjust_brightness,
     adjust_contrast,
     adjust_saturation,
-    edge_detection,
     grayscale,
     invert_colors,
 )
-from remove_background import remove_background
-from scale_image import scale_image
+from remove_background import DEFAULT_BG_BATCH_WAIT, DEFAULT_MODEL, BatchedSessions, remove_background, session_pool
+from strips import DEFAULT_THREADS, edge_map_in_strips, resize_in_strips
+from tiling import DEFAULT_TILE_ROWS, run_tiled, tileable_prefix
+from scale_image import compute_scaled_size, parse_scale_values
 
 # --- Operation Handlers ---
 
@@ -22,33 +36,34 @@ def handle_flip(image, image_name, values, args):
     print(f'Flipping "{image_name}" {values[0]}...')
     return flip_image(image, values[0])
 
+def _threads(args):
+    # Threads used within one image (see strips); separate from the batch's jobs
+    return max(1, getattr(args, 'threads', None) or DEFAULT_THREADS)
+
 def handle_scale(image, image_name, values, args):
-    scale_params = values
-    scale_factor = None
-    new_size = None
-    if len(scale_params) == 1 and scale_params[0].lower().endswith('x'):
-        try:
-            scale_factor = float(scale_params[0][:-1])
-        except ValueError:
-            print(f"Invalid scale factor: {scale_params[0]}")
-            return image
-    elif len(scale_params) == 2:
-        try:
-            width = int(scale_params[0].lower().replace('px', ''))
-            height = int(scale_params[1].lower().replace('px', ''))
-            new_size = (width, height)
-        except ValueError:
-            print(f"Invalid size format: {scale_params}")
-            return image
-    else:
-        print("Invalid format for --scale argument. Use '1.5x' or '400px 300px'.")
+    try:
+        scale_factor, new_size = parse_scale_values(values)
+    except ValueError as e:
+        print(e)
         return image
     print(f'Scaling "{image_name}"...')
-    return scale_image(image, scale_factor=scale_factor, new_size=new_size, resample_filter=args.resample)
+    return resize_in_strips(image, compute_scaled_size(image.size, scale_factor, new_size), args.resample,
+                            _threads(args))
+
+def handle_resize(image, image_name, values, args):
+    # Internal: the exact-size resize that finishes a reduced-resolution decode
+    print(f'Scaling "{image_name}"...')
+    return resize_in_strips(image, values, args.resample, _threads(args))
 
 def handle_remove_background(image, image_name, values, args):
     print(f'Removing background of "{image_name}"...')
-    return remove_background(image)
+    model_name = getattr(args, 'bg_model', DEFAULT_MODEL)
+    # With --bg-batch the model runs of the images processed at the same time are batched
+    bg_sessions = getattr(args, 'bg_sessions', None)
+    return remove_background(image, model_name=model_name,
+                             session=bg_sessions.get(model_name) if bg_sessions is not None else None,
+                             mask_cache=getattr(args, 'mask_cache', None),
+                             proxy_size=getattr(args, 'bg_proxy', None))
 
 def handle_invert(image, image_name, values, args):
     print(f'Inverting the colors of "{image_name}"...')
@@ -58,64 +73,604 @@ def handle_grayscale(image, image_name, values, args):
     print(f'Converting "{image_name}" to grayscale...')
     return grayscale(image)
 
-def handle_edge_detection(image, image_name, values, args):
+def handle_edge_detection(frame, image_name, values, args):
     method = values[0]
-    if method == 'kovalevsky':
+    if method in ('kovalevsky', 'all'):
         print(f'Applying {method} edge detection to "{image_name}" with threshold {args.threshold}...')
-        return edge_detection(image, 'kovalevsky', args.threshold)
+        return Frame(array=edge_map_in_strips(frame, method, args.threshold, threads=_threads(args)))
     else:
         print(f'Applying {method} edge detection to "{image_name}"...')
-        return edge_detection(image, method)
+        return Frame(array=edge_map_in_strips(frame, method, threads=_threads(args)))
+
+# The edge detectors work on arrays, so they take and return frames (see frame.Frame)
+handle_edge_detection.accepts_frame = True
 
 def handle_brightness(image, image_name, values, args):
     print(f'Adjusting brightness of "{image_name}" by {values[0]}...')
     return adjust_brightness(image, values[0])
 
-def handle_contrast(image, image_name, values, args):
+def handle_contrast(frame, image_name, values, args):
     print(f'Adjusting contrast of "{image_name}" by {values[0]}...')
-    return adjust_contrast(image, values[0])
+    return adjust_contrast(frame, values[0])
 
-def handle_saturation(image, image_name, values, args):
+def handle_saturation(frame, image_name, values, args):
     print(f'Adjusting saturation of "{image_name}" by {values[0]}...')
-    return adjust_saturation(image, values[0])
+    return adjust_saturation(frame, values[0])
+
+def handle_pointwise(frame, image_name, values, args):
+    steps = ', '.join(' '.join([op['dest']] + [str(v) for v in op.get('values', [])]) for op in values)
+    print(f'Applying {len(values)} fused point-wise operations to "{image_name}" ({steps})...')
+    return apply_pointwise(frame, values)
+
+# These read the planes the frame has cached (see frame.Frame.derived) instead of deriving them again
+handle_contrast.accepts_frame = handle_saturation.accepts_frame = handle_pointwise.accepts_frame = True
 
 # --- Core Processing Function ---
 
-def process_images_and_save(images_data, ordered_operations, cli_args):
-    operation_handlers = {
-        'flip': handle_flip, 'scale': handle_scale, 'remove_background': handle_remove_background,
-        'invert': handle_invert, 'grayscale': handle_grayscale, 'edge_detection': handle_edge_detection,
-        'brightness': handle_brightness, 'contrast': handle_contrast, 'saturation': handle_saturation,
-    }
-    if not images_data:
-        print("No images to process.")
+operation_handlers = {
+    'flip': handle_flip, 'scale': handle_scale, 'remove_background': handle_remove_background,
+    'invert': handle_invert, 'grayscale': handle_grayscale, 'edge_detection': handle_edge_detection,
+    'brightness': handle_brightness, 'contrast': handle_contrast, 'saturation': handle_saturation,
+    FUSED_DEST: handle_pointwise, 'resize': handle_resize,
+}
+
+
+# Settings besides the operation chain that change the output; they are part of the output cache key.
+OUTPUT_SETTINGS = ('resample', 'threshold', 'bg_model', 'bg_proxy', 'fuse', 'optimize', 'draft', 'compression',
+                   'quality')
+
+
+def plan_operations(ordered_operations, cli_args, image=None):
+    """
+    Turns the requested operations into the list that is actually executed.
+
+    Unless ``cli_args.optimize`` is False, the chain optimizer first cancels and merges
+    flips and moves size-reducing scales ahead of operations they can be swapped with.
+    Then, unless ``cli_args.fuse`` is False, runs of consecutive point-wise operations are
+    fused into one pass.
+
+    :param ordered_operations: The operations as requested, in order.
+    :param cli_args: The parsed command-line arguments.
+    :param image: The input image, if known. Its mode and size let the optimizer do more.
+    :return: A tuple (operations, notes) with the operations to execute and a description of each rewrite.
+    """
+    operations = list(ordered_operations)
+    notes = []
+    if getattr(cli_args, 'optimize', True):
+        operations, notes = optimize_operations(operations, cli_args,
+                                                image_mode=image.mode if image is not None else None,
+                                                image_size=image.size if image is not None else None)
+    if getattr(cli_args, 'fuse', True):
+        operations = fuse_pointwise_operations(operations)
+    return operations, notes
+
+
+def _leading_downscale(operations, size):
+    """Returns the size the first operation shrinks the image to, or None if it does not shrink it."""
+    if not operations or operations[0]['dest'] != 'scale':
+        return None
+    try:
+        target = compute_scaled_size(size, *parse_scale_values(operations[0].get('values', [])))
+    except ValueError:
+        return None
+    if target[0] < 1 or target[1] < 1 or target[0] > size[0] or target[1] > size[1] or target == size:
+        return None
+    return target
+
+
+def decode_for_plan(image, operations, cli_args):
+    """
+    Decodes an image opened with image_io.open_image for a planned chain.
+
+    When the chain starts by shrinking the image, the file is decoded at a reduced
+    resolution where the format supports it (see image_io.decode_image) and the scale is
+    replaced by an exact resize to the size it would have produced, so the result has the
+    same size as with a full decode. ``cli_args.draft = False`` always decodes at full size.
+
+    :param image: The opened, not yet decoded, image.
+    :param operations: The planned operations (see plan_operations).
+    :param cli_args: The parsed command-line arguments.
+    :return: A tuple (image, operations) with the decoded image and the operations to run on it.
+    """
+    full_size = image.size
+    target = _leading_downscale(operations, full_size) if getattr(cli_args, 'draft', True) else None
+    image = decode_image(image, reduce_to=target)
+    if target is not None and image.size != full_size:
+        operations = [{'dest': 'resize', 'values': list(target)}] + list(operations[1:])
+    return image, operations
+
+
+def apply_operations(image, image_name, ordered_operations, cli_args):
+    """
+    Runs an image through the chain of operations.
+
+    Handlers never modify the image they are given, so images passed in by the caller are
+    used without a defensive copy. Every intermediate image belongs to the pipeline and is
+    released as soon as the next step has produced its output.
+
+    :param image: The image to process. It is not modified.
+    :param image_name: The name used in progress messages.
+    :param ordered_operations: The operations to apply, in order.
+    :param cli_args: The parsed command-line arguments (resample, threshold, ...).
+    :return: The processed image.
+    """
+    return _run_owned([image], image_name, ordered_operations, cli_args)
+
+
+def _run_owned(frames, image_name, ordered_operations, cli_args):
+    """
+    apply_operations for a frame the pipeline owns. The frame is handed over in a one-item
+    list that is emptied, so that no caller variable keeps it alive after the first step.
+
+    Between steps the image is carried as a frame.Frame. Handlers with an ``accepts_frame``
+    attribute get the frame itself and may return a frame holding an array; the others get
+    a PIL image. So a PIL image is only made from an array when a step needs one.
+    """
+    frame = as_frame(frames.pop())
+    for operation in ordered_operations:
+        op_dest = operation['dest']
+        op_values = operation.get('values', [])
+        handler = operation_handlers.get(op_dest)
+        if handler:
+            with _span(cli_args, image_name, describe_operation(operation), 'operation') as span:
+                input_frame, input_allocated = frame, frame.allocated_bytes()
+                if getattr(handler, 'accepts_frame', False):
+                    frame = as_frame(handler(frame, image_name, op_values, cli_args))
+                else:
+                    image = frame.image()
+                    output = handler(image, image_name, op_values, cli_args)
+                    # A step that returns its input unchanged keeps the frame and its cached planes
+                    frame = frame if output is image else as_frame(output)
+                    image = output = None
+                # What the step converted its input to, and the frame it produced
+                span['allocated_bytes'] = input_frame.allocated_bytes() - input_allocated + (
+                    frame.allocated_bytes() if frame is not input_frame else 0)
+                span['output_bytes'] = image_bytes(frame)
+                input_frame = None
+    return frame.image()
+
+
+def _span(cli_args, image_name, name, category):
+    """A profiler span (see profiling.Profiler.span) when ``cli_args.profiler`` is set, else a no-op."""
+    profiler = getattr(cli_args, 'profiler', None)
+    if profiler is None:
+        return nullcontext({})
+    return profiler.span(image_name, name, category)
+
+
+def process_and_save_image(image_name, image_to_process, ordered_operations, cli_args, cache=None):
+    """
+    Processes a single image and saves it to the Output directory.
+
+    The processed image is encoded once per format in ``cli_args.formats`` (PNG by
+    default), with the ``cli_args.compression`` preset and ``cli_args.quality``.
+    Errors are caught and returned rather than raised so that one failing image
+    does not stop the rest of a batch.
+
+    :param image_name: The name of the image; the output files are named after it. A
+        relative path such as 'trips/beach.jpg' puts them in the same directories under Output.
+    :param image_to_process: A loaded image, or the path of an image file to load.
+    :param ordered_operations: The operations as requested, in order (see plan_operations).
+    :param cli_args: The parsed command-line arguments.
+    :param cache: An OutputCache. When given and the image is a file path, up-to-date
+        outputs are not written again, and the image is not processed at all if every
+        output is up to date.
+    :return: A dict with the image 'name', the 'output_path' of the first format (None on
+        failure), the 'outputs' written (see encoders.write_image), the formats 'skipped'
+        as (format, reason) pairs, the 'error' (None on success) and 'cached' ('up_to_date'
+        or 'restored' when served from the cache).
+    """
+    with _span(cli_args, image_name, image_name, 'image'):
+        return _process_and_save_image(image_name, image_to_process, ordered_operations, cli_args, cache)
+
+
+def process_image(image_name, image_to_process, ordered_operations, cli_args):
+    """
+    Processes a single image without saving it: plans the chain, decodes the image for the
+    plan (at reduced resolution or in bands, see decode_for_plan and tiling.run_tiled) and
+    runs the operations.
+
+    :param image_name: The name used in progress messages.
+    :param image_to_process: A loaded image, or the path or binary file object of an image to load.
+    :param ordered_operations: The operations as requested, in order (see plan_operations).
+    :param cli_args: The parsed command-line arguments.
+    :return: The processed image.
+    """
+    return run_chain(image_name, load_for_chain(image_name, image_to_process, ordered_operations, cli_args),
+                     cli_args)
+
+
+def load_for_chain(image_name, image_to_process, ordered_operations, cli_args):
+    """
+    The first half of process_image: opens the image, plans the chain and decodes the image
+    for the plan. In tiled mode the image is only opened; run_chain decodes it band by band.
+    Memory-mapped files (see image_io.map_image) are never decoded as a whole: the tileable
+    start of their chain always runs band by band, in bands of ``cli_args.tiled`` rows or
+    DEFAULT_TILE_ROWS, so only the output is ever held in memory in full.
+
+    :param image_name: The name used in progress messages.
+    :param image_to_process: A loaded image, or the path or binary file object of an image to load.
+    :param ordered_operations: The operations as requested, in order (see plan_operations).
+    :param cli_args: The parsed command-line arguments.
+    :return: A dict for run_chain with the 'image', the planned 'operations', whether the
+        pipeline 'owns' the image and the band height if it is processed 'tiled' (else None).
+    """
+    opened_from_source = is_image_source(image_to_process)
+    if opened_from_source:
+        # Only the header is read here; the planned chain decides how to decode
+        image_to_process = open_image(image_to_process)
+    mapped = opened_from_source and isinstance(image_to_process, Frame)
+    try:
+        operations, notes = plan_operations(ordered_operations, cli_args, image_to_process)
+    except Exception:
+        if opened_from_source and not mapped:
+            image_to_process.close()
+        raise
+    tile_rows = getattr(cli_args, 'tiled', None) or (DEFAULT_TILE_ROWS if mapped else None)
+    tiled = tile_rows if tile_rows and tileable_prefix(operations) > 0 else None
+    if opened_from_source and not tiled and not mapped:
+        # In tiled mode run_tiled decodes the image, band by band where it can
+        with _span(cli_args, image_name, 'decode', 'decode') as span:
+            image_to_process, operations = decode_for_plan(image_to_process, operations, cli_args)
+            span['output_bytes'] = image_bytes(image_to_process)
+            span['allocated_bytes'] = buffer_bytes(image_to_process.mode, image_to_process.size)
+        if operations and operations[0]['dest'] == 'resize':
+            print(f'Decoded "{image_name}" at reduced resolution {image_to_process.width}x{image_to_process.height}...')
+    if notes:
+        plan = ' '.join(describe_operation(operation) for operation in operations)
+        print(f'Optimized plan for "{image_name}": {plan} ({"; ".join(notes)})')
+    return {'image': image_to_process, 'operations': operations, 'owned': opened_from_source, 'tiled': tiled}
+
+
+def run_chain(image_name, loaded, cli_args):
+    """
+    The second half of process_image: runs the planned operations on an image prepared by
+    load_for_chain. The image is taken out of the dict, so the dict does not keep it alive.
+
+    :param image_name: The name used in progress messages.
+    :param loaded: The dict returned by load_for_chain.
+    :param cli_args: The parsed command-line arguments.
+    :return: The processed image.
+    """
+    operations = loaded['operations']
+    owned = loaded['owned']
+    if loaded['tiled']:
+        tile_rows = loaded['tiled']
+        steps = ' '.join(describe_operation(operation) for operation in operations[:tileable_prefix(operations)])
+        print(f'Processing "{image_name}" in bands of {tile_rows} rows ({steps})...')
+        with _span(cli_args, image_name, f'tiled {steps}', 'operation') as span:
+            image, operations = run_tiled(loaded.pop('image'), operations, cli_args, tile_rows)
+            span['output_bytes'] = image_bytes(image)
+            span['allocated_bytes'] = buffer_bytes(image.mode, image.size)
+        loaded['image'], image, owned = image, None, True
+    if owned:
+        # The decoded frame belongs to the pipeline: hand it over so it is freed after the first step
+        return _run_owned([loaded.pop('image')], image_name, operations, cli_args)
+    return apply_operations(loaded.pop('image'), image_name, operations, cli_args)
+
+
+# An image goes through three stages: load (cache lookup, open and decode), process (the
+# operations) and save (encode and write). Sequentially they run one after the other; the
+# overlapped pipeline (see process_images_and_save) runs each stage on its own thread. The
+# state of an image between the stages is kept in a job dict.
+
+def _new_job(image_name, image_to_process):
+    result = {'name': image_name, 'output_path': None, 'outputs': [], 'skipped': [], 'error': None,
+              'cached': None}
+    return {'name': image_name, 'source': image_to_process, 'result': result, 'finished': False}
+
+
+def _run_stage(job, stage, *args):
+    """Runs a stage unless the job is finished; an exception finishes the job with an error."""
+    if job['finished']:
         return
-    print(f"\nProcessing {len(images_data)} image(s)...")
-    for image_name, image_to_process in images_data:
-        temp_path = None  # Initialize temp_path to None
+    try:
+        stage(job, *args)
+    except Exception as e:
+        job['result']['error'] = e
+        job['finished'] = True
+        # Release what the later stages would have used
+        job.pop('loaded', None)
+        job.pop('output_image', None)
+
+
+def _load_stage(job, ordered_operations, cli_args, cache):
+    result = job['result']
+    image_to_process = job.pop('source')
+    formats = list(getattr(cli_args, 'formats', None) or [DEFAULT_FORMAT])
+    # A name with directories, e.g. 'trips/beach.jpg' from file_management.walk_images, is
+    # written to the same directories under Output
+    stem = os.path.splitext(job['name'])[0]
+    job['output_paths'] = output_paths = {output_format: os.path.join('Output', stem + output_extension(output_format))
+                                          for output_format in formats}
+    job['requested_formats'] = list(formats)
+    job['done'] = set()
+    job['cache_keys'] = {}
+    if cache is not None and is_image_path(image_to_process):
+        settings = {name: getattr(cli_args, name, None) for name in OUTPUT_SETTINGS}
+        statuses = []
+        input_digest = hash_file(image_to_process)
+        for output_format in list(formats):
+            key = cache.make_key(image_to_process, ordered_operations, dict(settings, format=output_format),
+                                 input_digest)
+            status = cache.lookup(key, output_paths[output_format])
+            if status:
+                statuses.append(status)
+                job['done'].add(output_format)
+                formats.remove(output_format)
+            else:
+                job['cache_keys'][output_format] = key
+        if not formats:
+            result['output_path'] = output_paths[job['requested_formats'][0]]
+            result['cached'] = 'restored' if 'restored' in statuses else 'up_to_date'
+            job['finished'] = True
+            return
+    job['formats'] = formats
+    job['loaded'] = load_for_chain(job['name'], image_to_process, ordered_operations, cli_args)
+
+
+def _process_stage(job, cli_args):
+    job['output_image'] = run_chain(job['name'], job.pop('loaded'), cli_args)
+
+
+def _save_stage(job, cli_args, cache):
+    result = job['result']
+    output_image = job.pop('output_image')
+    compression = getattr(cli_args, 'compression', None) or 'default'
+    quality = getattr(cli_args, 'quality', None)
+    output_paths = job['output_paths']
+    for directory in {os.path.dirname(path) for path in output_paths.values()}:
+        os.makedirs(directory, exist_ok=True)
+    errors = []
+    for output_format in job['formats']:
         try:
-            output_image = image_to_process.copy()
-            for operation in ordered_operations:
-                op_dest = operation['dest']
-                op_values = operation.get('values', [])
-                handler = operation_handlers.get(op_dest)
-                if handler:
-                    output_image = handler(output_image, image_name, op_values, cli_args)
-            if not os.path.exists('Output/'):
-                os.makedirs('Output/')
-            output_filename = Path(image_name).stem + '.png'
-            output_path = os.path.join('Output', output_filename)
-            temp_path = os.path.join('Output', f".tmp.{output_filename}")
-            output_image.save(temp_path, 'PNG')
-            os.replace(temp_path, output_path)
-            print(f"Image saved successfully: {output_path}")
-        except Exception as e:
-            print(f"An error occurred while processing {image_name}: {e}")
+            with _span(cli_args, job['name'], f'encode {output_format}', 'encode') as span:
+                output = write_image(output_image, output_paths[output_format], output_format, compression, quality)
+                span['output_bytes'] = output['bytes']
+        except ValueError as e:
+            # E.g. JPEG for an image with transparency; the other formats are still written
+            errors.append(e)
+            result['skipped'].append((output_format, str(e)))
             continue
-        finally:
-            # Ensure the temp file is removed if it exists
-            if temp_path and os.path.exists(temp_path):
-                try:
-                    os.remove(temp_path)
-                except OSError as e:
-                    print(f"Error removing temp file {temp_path}: {e}")
\ No newline at end of file
+        result['outputs'].append(output)
+        job['done'].add(output_format)
+        if output_format in job['cache_keys']:
+            cache.store(job['cache_keys'][output_format], output['path'])
+    if not result['outputs'] and errors:
+        raise errors[0]
+    result['output_path'] = next(output_paths[output_format] for output_format in job['requested_formats']
+                                 if output_format in job['done'])
+
+
+def _process_and_save_image(image_name, image_to_process, ordered_operations, cli_args, cache):
+    job = _new_job(image_name, image_to_process)
+    _run_stage(job, _load_stage, ordered_operations, cli_args, cache)
+    _run_stage(job, _process_stage, cli_args)
+    _run_stage(job, _save_stage, cli_args, cache)
+    return job['result']
+
+
+def _format_size(size):
+    if size < 1024 * 1024:
+        return f"{size / 1024:.1f} KB"
+    return f"{size / (1024 * 1024):.1f} MB"
+
+
+def report_result(result):
+    """Prints the outcome of process_and_save_image for one image."""
+    if result.get('cached') == 'up_to_date':
+        print(f"Up to date, skipped: {result['output_path']}")
+    elif result.get('cached') == 'restored':
+        print(f"Restored from cache: {result['output_path']}")
+    elif result['error'] is None:
+        for output in result['outputs']:
+            print(f"Image saved successfully: {output['path']} "
+                  f"({_format_size(output['bytes'])}, encoded in {output['seconds'] * 1000:.1f} ms)")
+        for output_format, reason in result['skipped']:
+            print(f"Skipped {output_format} output of {result['name']}: {reason}")
+    else:
+        print(f"An error occurred while processing {result['name']}: {result['error']}")
+
+
+def process_images_and_save(images_data, ordered_operations, cli_args):
+    """
+    Processes a batch of images and saves the results.
+
+    With ``cli_args.profile`` set to a file path, a timing and memory profile of the run
+    is written there (see profiling.Profiler). With ``cli_args.cache`` set to a directory,
+    images whose output is up to date are skipped and background-removal masks are reused (see cache.OutputCache and
+    cache.MaskCache). The batch is streamed: when an entry holds a file path, the image
+    is only loaded when its turn comes and is released once it has been saved, so memory
+    use does not grow with the number of images. With ``cli_args.jobs`` greater than 1 the images are
+    spread over a pool of worker threads, with at most two images per worker queued
+    at a time. With one job, loading the next image and saving the previous one overlap
+    with processing the current one (see _process_overlapped), unless ``cli_args.overlap``
+    is False. The results are reported in input order either way.
+
+    :param images_data: An iterable of (image_name, image_or_path) pairs, e.g. a generator.
+    :param ordered_operations: The operations to apply to every image, in order.
+    :param cli_args: The parsed command-line arguments.
+    :return: One result dict per image (see process_and_save_image), in input order.
+    """
+    if isinstance(images_data, Sized):
+        if not images_data:
+            print("No images to process.")
+            return []
+        print(f"\nProcessing {len(images_data)} image(s)...")
+    else:
+        print("\nProcessing images...")
+    jobs = max(1, getattr(cli_args, 'jobs', 1) or 1)
+    if isinstance(images_data, Sized):
+        jobs = min(jobs, len(images_data))
+
+    single = isinstance(images_data, Sized) and len(images_data) == 1
+    overlapped = jobs == 1 and getattr(cli_args, 'overlap', True) and not single
+    cli_args, cache = open_run(cli_args, concurrent=jobs > 1 or overlapped)
+    try:
+        results = []
+        if overlapped:
+            results = _process_overlapped(images_data, ordered_operations, cli_args, cache)
+        elif jobs == 1:
+            for image_name, image_to_process in images_data:
+                result = process_and_save_image(image_name, image_to_process, ordered_operations, cli_args, cache)
+                report_result(result)
+                results.append(result)
+        else:
+            # Pillow, NumPy and onnxruntime release the GIL for the heavy lifting, so worker
+            # threads run in parallel while sharing loaded state such as the rembg sessions.
+            with ThreadPoolExecutor(max_workers=jobs) as executor:
+                pending = deque()
+                for image_name, image_to_process in images_data:
+                    pending.append(executor.submit(process_and_save_image, image_name, image_to_process,
+                                                   ordered_operations, cli_args, cache))
+                    if len(pending) >= 2 * jobs:
+                        results.append(pending.popleft().result())
+                        report_result(results[-1])
+                while pending:
+                    results.append(pending.popleft().result())
+                    report_result(results[-1])
+        if not results:
+            print("No images to process.")
+        outputs = [output for result in results for output in result['outputs']]
+        if len(outputs) > 1:
+            print(f"Wrote {len(outputs)} file(s), {_format_size(sum(output['bytes'] for output in outputs))} "
+                  f"in total, encode time {sum(output['seconds'] for output in outputs):.2f} s.")
+    finally:
+        close_run(cli_args, cache)
+    return results
+
+
+_END = object()
+
+
+def _process_overlapped(images_data, ordered_operations, cli_args, cache):
+    """
+    Runs the stages of the images on three threads connected by queues of one image each:
+    a loader reads and decodes the next image and a saver encodes and writes the previous
+    one while the calling thread runs the operations on the current one. Reading and writing
+    wait on the disk and decoding, encoding and most operations release the GIL, so the
+    stages run at the same time. At most five images are in memory: one per stage and one
+    waiting in each queue.
+
+    :return: The results, in input order.
+    """
+    loaded = queue.Queue(maxsize=1)
+    processed = queue.Queue(maxsize=1)
+    results = []
+
+    def load():
+        try:
+            for image_name, image_to_process in images_data:
+                job = _new_job(image_name, image_to_process)
+                image_to_process = None
+                with _span(cli_args, image_name, image_name, 'image'):
+                    _run_stage(job, _load_stage, ordered_operations, cli_args, cache)
+                loaded.put(job)
+        except BaseException as e:
+            # E.g. from the images_data generator; raised again by the calling thread
+            loaded.put(e)
+            return
+        loaded.put(_END)
+
+    def save():
+        while True:
+            job = processed.get()
+            if job is _END:
+                return
+            with _span(cli_args, job['name'], job['name'], 'image'):
+                _run_stage(job, _save_stage, cli_args, cache)
+            report_result(job['result'])
+            results.append(job['result'])
+
+    loader = threading.Thread(target=load, name='loader', daemon=True)
+    saver = threading.Thread(target=save, name='saver', daemon=True)
+    loader.start()
+    saver.start()
+    error = None
+    while True:
+        job = loaded.get()
+        if job is _END:
+            break
+        if isinstance(job, BaseException):
+            error = job
+            break
+        with _span(cli_args, job['name'], job['name'], 'image'):
+            _run_stage(job, _process_stage, cli_args)
+        processed.put(job)
+        job = None
+    processed.put(_END)
+    saver.join()
+    loader.join()
+    if error is not None:
+        raise error
+    return results
+
+
+def open_run(cli_args, concurrent=True):
+    """
+    Sets up what a run of process_and_save_image calls shares: the caches and the profiler
+    requested by ``cli_args.cache`` and ``cli_args.profile``, and the batched background
+    removal sessions requested by ``cli_args.bg_batch``. The run holds the shared session
+    pool until close_run.
+
+    :param cli_args: The parsed command-line arguments. They are not modified.
+    :param concurrent: False if the run processes one step at a time on one thread, so the
+        profiler can measure the memory peak of every step on its own.
+    :return: A tuple (cli_args, cache): a copy of the arguments carrying the mask cache, the
+        profiler and the batched sessions for the handlers, and the OutputCache (None
+        without --cache).
+    """
+    # The handlers find the mask cache, the profiler and the sessions on the arguments
+    cli_args = copy.copy(cli_args)
+    cli_args.mask_cache = cli_args.profiler = cli_args.bg_sessions = None
+    cache = None
+    session_pool.acquire()
+    if getattr(cli_args, 'cache', None):
+        cache_size = (getattr(cli_args, 'cache_size', None) or DEFAULT_CACHE_SIZE_MB) * 1024 * 1024
+        cache = OutputCache(cli_args.cache, cache_size)
+        cli_args.mask_cache = MaskCache(cli_args.cache, cache_size)
+    if getattr(cli_args, 'profile', None):
+        cli_args.profiler = Profiler(concurrent)
+    if (getattr(cli_args, 'bg_batch', None) or 1) > 1:
+        bg_batch_wait = getattr(cli_args, 'bg_batch_wait_ms', None)
+        cli_args.bg_sessions = BatchedSessions(
+            cli_args.bg_batch, DEFAULT_BG_BATCH_WAIT if bg_batch_wait is None else bg_batch_wait / 1000)
+    return cli_args, cache
+
+
+def close_run(cli_args, cache):
+    """
+    Saves the caches, writes the profile, reports the background removal throughput and
+    releases the session pool of a run started with open_run. The models stay loaded while
+    other runs are still open.
+
+    :param cli_args: The arguments returned by open_run.
+    :param cache: The OutputCache returned by open_run, or None.
+    """
+    if cache is not None:
+        cache.save()
+        counts = cache.counts
+        print(f"Output cache: {counts['up_to_date']} up to date, {counts['restored']} restored, "
+              f"{counts['processed']} processed.")
+    mask_cache = cli_args.mask_cache
+    if mask_cache is not None:
+        mask_cache.save()
+        counts = mask_cache.counts
+        if counts['hits'] or counts['misses']:
+            print(f"Mask cache: {counts['hits']} hit(s), {counts['misses']} miss(es).")
+    bg_sessions = cli_args.bg_sessions
+    if bg_sessions is not None:
+        bg_sessions.close()
+        counts = bg_sessions.counts
+        if counts['images']:
+            print(f"Background removal: {counts['images']} image(s) in {counts['runs']} model run(s) "
+                  f"(average batch {counts['images'] / counts['runs']:.1f}), "
+                  f"{counts['images'] / max(counts['seconds'], 1e-9):.2f} images/s of inference.")
+    session_pool.release()
+    profiler = cli_args.profiler
+    if profiler is not None:
+        profiler.stop()
+        profiler.print_summary()
+        profile_path = cli_args.profile if isinstance(cli_args.profile, str) else DEFAULT_PROFILE_PATH
+        trace_file = profiler.write(profile_path)
+        print(f"Profile written to {profile_path} and {trace_file}")
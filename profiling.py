@@ -0,0 +1,221 @@
+"""
+Timing and memory profile of a processing run.
+
+A ``Profiler`` records a span for every step of every image: decoding, each operation and
+each encode. A span has its wall time, its CPU time (see below) and the peak memory traced by ``tracemalloc`` while it ran (Python objects and NumPy arrays, which
+includes the arrays of the edge detectors and background removal). Pillow allocates image
+memory outside tracemalloc's view, so operation spans also record the bytes of the image
+buffers the step allocated, counted where the pipeline hands frames from step to step (see
+frame.Frame.allocated_bytes): the conversions the step made of its input frame (e.g. a
+grayscale array) and the frame it produced. Temporary images inside a Pillow call are not
+seen. The size of the image the step produced is recorded as well.
+
+tracemalloc only has one peak for the whole process, so a span can only measure its own
+peak when no other span runs at the same time. When spans can overlap (several jobs, or
+loading and saving on their own threads), ``Profiler(concurrent=True)`` records
+``approx_process_peak_traced_bytes`` instead: the process-wide peak since the last moment
+no span was running, above the memory traced when the span started. It includes whatever
+ran alongside the span and is an approximation.
+
+For the same reason, a span's ``cpu_s`` is the CPU time of the whole process while it ran,
+which includes the --threads strip workers and the internal threads of Pillow and
+onnxruntime, only when spans cannot overlap. Concurrent spans record ``thread_cpu_s``, the
+CPU time of the thread that ran the span, which leaves out the work of those threads.
+
+The profile is written as JSON and as a Chrome trace-event file, which can be opened in
+chrome://tracing or https://ui.perfetto.dev.
+"""
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+
+from PIL import Image
+
+PROFILE_FORMAT_VERSION = 1
+DEFAULT_PROFILE_PATH = 'profile.json'
+
+
+def trace_path(profile_path):
+    """Returns the path of the Chrome trace written next to a profile, e.g. profile.trace.json."""
+    path = Path(profile_path)
+    return str(path.with_name(path.stem + '.trace.json'))
+
+
+def image_bytes(image):
+    """Returns the size of the pixel data of an image (or of a frame.Frame) in bytes."""
+    bits = {'1': 1, 'I;16': 16, 'I': 32, 'F': 32}.get(image.mode, 8)
+    width, height = image.size
+    return width * height * Image.getmodebands(image.mode) * bits // 8
+
+
+def buffer_bytes(mode, size):
+    """Returns the bytes Pillow allocates for an image buffer; it stores three-band pixels in four bytes."""
+    if mode in ('1', 'L', 'P'):
+        pixel_bytes = 1
+    elif mode.startswith('I;16'):
+        pixel_bytes = 2
+    else:
+        pixel_bytes = 4
+    return size[0] * size[1] * pixel_bytes
+
+
+
+class Profiler:
+    """
+    Collects the spans of a run.
+
+    :param concurrent: True if spans may run on several threads at the same time. Their
+        memory peaks are then approximate and process-wide, and their CPU times only cover
+        the calling thread (see the module docstring).
+    """
+
+    def __init__(self, concurrent=False):
+        self.concurrent = concurrent
+        self.peak_field = 'approx_process_peak_traced_bytes' if concurrent else 'peak_traced_bytes'
+        self.cpu_field = 'thread_cpu_s' if concurrent else 'cpu_s'
+        self._cpu_time = time.thread_time if concurrent else time.process_time
+        self.spans = []
+        self._lock = threading.Lock()
+        # With concurrent spans, the number of spans running in any thread
+        self._running = 0
+        self._start = time.perf_counter()
+        # Per thread, the traced-memory peaks of the open spans, innermost last
+        self._open_spans = threading.local()
+        self._started_tracing = not tracemalloc.is_tracing()
+        if self._started_tracing:
+            tracemalloc.start()
+
+    @contextmanager
+    def span(self, image_name, name, category):
+        """
+        Records the code run in the with-block as one span.
+
+        :param image_name: The image being processed.
+        :param name: The step, e.g. '--scale 0.5x' or 'decode'.
+        :param category: 'image', 'decode', 'operation' or 'encode'.
+        :return: A dict the caller can add fields to, e.g. 'output_bytes' or 'allocated_bytes'.
+        """
+        extra = {}
+        open_peaks = self._open_spans.__dict__.setdefault('peaks', [])
+        if self.concurrent:
+            with self._lock:
+                # Resetting the peak while another span runs would lose that span's peak
+                if self._running == 0:
+                    tracemalloc.reset_peak()
+                self._running += 1
+        else:
+            if open_peaks:
+                # Resetting the peak below would lose the enclosing span's peak so far
+                open_peaks[-1] = max(open_peaks[-1], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        memory_before = tracemalloc.get_traced_memory()[0]
+        open_peaks.append(memory_before)
+        cpu_start = self._cpu_time()
+        start = time.perf_counter()
+        try:
+            yield extra
+        finally:
+            wall = time.perf_counter() - start
+            cpu = self._cpu_time() - cpu_start
+            absolute_peak = max(open_peaks.pop(), tracemalloc.get_traced_memory()[1])
+            if open_peaks:
+                open_peaks[-1] = max(open_peaks[-1], absolute_peak)
+            peak = max(0, absolute_peak - memory_before)
+            if self.concurrent:
+                with self._lock:
+                    self._running -= 1
+            span = {
+                'image': image_name, 'name': name, 'category': category,
+                'start_s': start - self._start, 'wall_s': wall, self.cpu_field: cpu, self.peak_field: peak,
+                'allocated_bytes': 0, 'thread': threading.get_ident(),
+            }
+            span.update(extra)
+            with self._lock:
+                self.spans.append(span)
+
+    def stop(self):
+        """Stops memory tracing if this profiler started it."""
+        if self._started_tracing and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def write(self, path=DEFAULT_PROFILE_PATH):
+        """
+        Writes the profile as JSON, and as a Chrome trace next to it (see trace_path).
+
+        :param path: The JSON file to write.
+        :return: The path of the trace file.
+        """
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span['start_s'])
+        profile = {'version': PROFILE_FORMAT_VERSION, 'peak_scope': 'process' if self.concurrent else 'span',
+                   'cpu_scope': 'thread' if self.concurrent else 'process', 'spans': spans,
+                   'totals': self._totals(spans)}
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(profile, f, indent=2)
+
+        threads = {thread: index for index, thread in enumerate(dict.fromkeys(span['thread'] for span in spans))}
+        pid = os.getpid()
+        events = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': index, 'args': {'name': f'worker {index}'}}
+                  for index in threads.values()]
+        for span in spans:
+            events.append({
+                'name': span['name'] if span['category'] != 'image' else span['image'],
+                'cat': span['category'], 'ph': 'X', 'pid': pid, 'tid': threads[span['thread']],
+                'ts': round(span['start_s'] * 1e6), 'dur': round(span['wall_s'] * 1e6),
+                'args': {key: value for key, value in span.items()
+                         if key not in ('name', 'category', 'start_s', 'wall_s', 'thread')},
+            })
+        trace_file = trace_path(path)
+        with open(trace_file, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+        return trace_file
+
+    def _totals(self, spans):
+        totals = {}
+        max_peak = 'max_' + self.peak_field
+        for span in spans:
+            if span['category'] == 'image':
+                continue
+            total = totals.setdefault(span['name'], {'count': 0, 'wall_s': 0.0, self.cpu_field: 0.0,
+                                                     'allocated_bytes': 0, max_peak: 0})
+            total['count'] += 1
+            total['wall_s'] += span['wall_s']
+            total[self.cpu_field] += span[self.cpu_field]
+            total['allocated_bytes'] += span['allocated_bytes']
+            total[max_peak] = max(total[max_peak], span[self.peak_field])
+        return totals
+
+    def print_summary(self, limit=10):
+        """Prints the slowest steps, the total time per step over all images and the image memory allocated per image."""
+        with self._lock:
+            spans = [span for span in self.spans if span['category'] != 'image']
+            images = [span for span in self.spans if span['category'] == 'image']
+        if not spans:
+            return
+        megabyte = 1024 * 1024
+        print("\nSlowest steps:" + (" (steps ran concurrently: cpu ms is the calling thread's only, "
+                                    "peak MB is approximate and process-wide)" if self.concurrent else ""))
+        print(f"  {'image':<28} {'step':<28} {'wall ms':>9} {'cpu ms':>9} {'peak MB':>8} {'alloc MB':>9}")
+        for span in sorted(spans, key=lambda span: span['wall_s'], reverse=True)[:limit]:
+            print(f"  {span['image'][:28]:<28} {span['name'][:28]:<28} {span['wall_s'] * 1000:9.1f} "
+                  f"{span[self.cpu_field] * 1000:9.1f} {span[self.peak_field] / megabyte:8.1f} "
+                  f"{span['allocated_bytes'] / megabyte:9.1f}")
+        print("\nTotal per step:")
+        print(f"  {'step':<28} {'count':>6} {'wall ms':>10} {'cpu ms':>10} {'alloc MB':>9}")
+        totals = sorted(self._totals(spans).items(), key=lambda item: item[1]['wall_s'], reverse=True)
+        for name, total in totals[:limit]:
+            print(f"  {name[:28]:<28} {total['count']:6d} {total['wall_s'] * 1000:10.1f} "
+                  f"{total[self.cpu_field] * 1000:10.1f} {total['allocated_bytes'] / megabyte:9.1f}")
+        if images:
+            allocated = dict.fromkeys((span['image'] for span in images), 0)
+            for span in spans:
+                if span['image'] in allocated:
+                    allocated[span['image']] += span['allocated_bytes']
+            average = sum(allocated.values()) / len(allocated)
+            most = max(allocated, key=allocated.get)
+            print(f"\nImage memory allocated by the steps: {average / megabyte:.1f} MB per image on average, "
+                  f"most for {most} ({allocated[most] / megabyte:.1f} MB)")
@@ -1,26 +1,380 @@
+import copy
+import math
 import os
-from rembg import remove
-from PIL import Image, ImageOps, ImageChops, ImageFile
+import threading
+import time
 
+import numpy as np
+from PIL import ExifTags, Image, ImageOps, ImageChops, ImageFile
 
-def remove_background(image_input: ImageFile, opt_border_width: int = 0):
+from batching import Batcher
+
+DEFAULT_MODEL = 'u2net'
+DEFAULT_BG_BATCH = 1
+DEFAULT_BG_BATCH_WAIT = 0.01
+# The longest side of the proxy the mask is computed from with --bg-proxy. The models
+# themselves run at 320 to 1024 pixels.
+DEFAULT_PROXY_SIZE = 1024
+# The guided filter that upsamples a proxy mask (see upsample_mask): its window radius in
+# proxy pixels, and the regularization that decides which edges of the image it follows
+GUIDED_FILTER_RADIUS = 4
+GUIDED_FILTER_EPS = 1e-4
+# The size of the full-resolution tiles the mask is upsampled in
+_UPSAMPLE_TILE = 256
+
+
+# rembg loads onnxruntime, numba and pymatting, which takes about a second, so it is only
+# imported once background removal actually runs.
+def remove(*args, **kwargs):
+    """Calls rembg.remove, importing rembg on first use."""
+    from rembg import remove as rembg_remove
+    return rembg_remove(*args, **kwargs)
+
+
+def new_session(*args, **kwargs):
+    """Calls rembg.new_session, importing rembg on first use."""
+    from rembg import new_session as rembg_new_session
+    return rembg_new_session(*args, **kwargs)
+
+
+class SessionPool:
+    """
+    Process-wide store of rembg sessions.
+
+    Each model is loaded once on first use and reused for every later image, by all threads
+    (onnxruntime sessions can run on several threads at once). Runs that may overlap in one
+    process (see processing.open_run) hold the pool with acquire() and release() it when they
+    end; the last one to release it drops the sessions.
+    """
+
+    def __init__(self):
+        self._sessions = {}
+        self._users = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Registers a user of the pool, so the loaded sessions are kept until it is released."""
+        with self._lock:
+            self._users += 1
+
+    def release(self):
+        """Unregisters a user of the pool, dropping all sessions when it was the last one."""
+        with self._lock:
+            self._users = max(0, self._users - 1)
+            if not self._users:
+                self._sessions.clear()
+
+    def get(self, model_name: str = DEFAULT_MODEL):
+        """
+        Return the session for a model, loading it if it is not loaded yet.
+
+        :param model_name: The rembg model name (e.g. 'u2net', 'isnet-general-use').
+        :return: The rembg session.
+        """
+        with self._lock:
+            session = self._sessions.get(model_name)
+            if session is None:
+                session = new_session(model_name)
+                self._sessions[model_name] = session
+            return session
+
+    def warm_up(self, *model_names):
+        """
+        Load the given models ahead of time so the first image does not pay for it.
+
+        :param model_names: The rembg model names to load. Defaults to the default model.
+        """
+        for model_name in model_names or (DEFAULT_MODEL,):
+            self.get(model_name)
+
+    def close(self, model_name: str = None):
+        """
+        Drop loaded sessions so their memory can be released.
+
+        :param model_name: Only drop sessions of this model. Drops all sessions if omitted.
+        """
+        with self._lock:
+            if model_name is None:
+                self._sessions.clear()
+            else:
+                self._sessions.pop(model_name, None)
+
+    def loaded_models(self):
+        """Return the names of the models that currently have a loaded session."""
+        with self._lock:
+            return sorted(self._sessions)
+
+
+session_pool = SessionPool()
+
+
+class BatchedSessions:
+    """
+    Batches the model runs of remove_background calls made at the same time from several
+    threads (e.g. the --jobs workers).
+
+    rembg prepares every image on its own and runs the model on a batch of one. The
+    sessions handed out by get() are copies of the pooled sessions whose model runs go
+    through a shared batching.Batcher: the runs that are waiting together are concatenated
+    along the batch axis, the model runs once, and every caller gets its slice of the
+    outputs back. rembg's preparation and mask post-processing still run per image, on the
+    calling thread. Models exported with a fixed batch size of one run the waiting images
+    one after the other.
+
+    :param max_batch: The most images in one model run.
+    :param max_wait: How long a model run waits for more images, in seconds.
+    :param pool: The SessionPool the models are loaded from.
+    """
+
+    def __init__(self, max_batch, max_wait=DEFAULT_BG_BATCH_WAIT, pool=None):
+        self._pool = pool or session_pool
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._batcher = Batcher(self._run_batch, max_batch=max_batch, max_wait=max_wait)
+        # Only updated on the batcher's dispatcher thread
+        self.counts = {'images': 0, 'runs': 0, 'seconds': 0.0}
+
+    def get(self, model_name: str = DEFAULT_MODEL):
+        """
+        Return the batching session for a model, loading the model if it is not loaded yet.
+
+        :param model_name: The rembg model name.
+        :return: A rembg session to pass to rembg.remove().
+        """
+        with self._lock:
+            session = self._sessions.get(model_name)
+            if session is None:
+                session = copy.copy(self._pool.get(model_name))
+                session.inner_session = _BatchingRunner(session.inner_session, self._batcher)
+                self._sessions[model_name] = session
+            return session
+
+    def close(self):
+        """Run the model runs already waiting, then stop the dispatcher thread."""
+        self._batcher.close()
+
+    def _run_batch(self, items):
+        # Only runs with the same model, outputs and input shapes can be concatenated
+        groups = {}
+        for index, (runner, output_names, feed) in enumerate(items):
+            shapes = tuple((name, value.shape, value.dtype.str) for name, value in sorted(feed.items()))
+            groups.setdefault((id(runner), output_names, shapes), []).append(index)
+        outcomes = [None] * len(items)
+        for indexes in groups.values():
+            runner, output_names, _ = items[indexes[0]]
+            start = time.perf_counter()
+            results, runs = runner.run_batch(output_names, [items[index][2] for index in indexes])
+            for index, outcome in zip(indexes, results):
+                outcomes[index] = outcome
+            self.counts['seconds'] += time.perf_counter() - start
+            self.counts['images'] += len(indexes)
+            self.counts['runs'] += runs
+        return outcomes
+
+
+class _BatchingRunner:
+    """Stands in for the onnxruntime.InferenceSession of a rembg session; see BatchedSessions."""
+
+    def __init__(self, inference_session, batcher):
+        self._session = inference_session
+        self._batcher = batcher
+        self.batchable = all(len(node.shape) > 0 and not isinstance(node.shape[0], int)
+                             for node in inference_session.get_inputs())
+
+    def __getattr__(self, name):
+        return getattr(self._session, name)
+
+    def run(self, output_names, input_feed, run_options=None):
+        if run_options is not None or any(np.shape(value)[:1] != (1,) for value in input_feed.values()):
+            return self._session.run(output_names, input_feed, run_options)
+        output_names = tuple(output_names) if output_names else None
+        return self._batcher.submit((self, output_names, input_feed)).result()
+
+    def run_batch(self, output_names, feeds):
+        """
+        Run the model on several inputs with a batch size of one each.
+
+        :return: A tuple (outcomes, runs) with an (outputs, error) pair for every input,
+            the outputs being what run() would have returned, and the number of model runs
+            it took.
+        """
+        output_names = list(output_names) if output_names else None
+        if len(feeds) > 1 and self.batchable:
+            batch = {name: np.concatenate([feed[name] for feed in feeds]) for name in feeds[0]}
+            try:
+                outputs = self._session.run(output_names, batch)
+            except Exception:
+                # The model does not take batches after all (e.g. a fixed size inside the graph)
+                self.batchable = False
+            else:
+                if all(np.shape(output)[:1] == (len(feeds),) for output in outputs):
+                    return [([output[index:index + 1] for output in outputs], None)
+                            for index in range(len(feeds))], 1
+                self.batchable = False
+        outcomes = []
+        for feed in feeds:
+            try:
+                outcomes.append((self._session.run(output_names, feed), None))
+            except Exception as e:
+                outcomes.append((None, e))
+        return outcomes, len(feeds)
+
+
+def remove_background(image_input: ImageFile, opt_border_width: int = 0, model_name: str = DEFAULT_MODEL,
+                      session=None, mask_cache=None, proxy_size=None):
     """
     Remove the background from an image.
 
     :param image_input: The image to modify.
     :param opt_border_width: The number of pixels to be removed from the border.
+    :param model_name: The rembg model to use. Its session is taken from the shared session pool.
+    :param session: An explicit rembg session to use instead of the pooled one.
+    :param mask_cache: A cache.MaskCache. Masks found in it are reused instead of running the model.
+    :param proxy_size: If the image is larger than this on its longest side, the mask is
+        computed from a copy shrunk to this size and upsampled with upsample_mask, so rembg
+        never prepares or post-processes the full-resolution image.
     :return:
     """
 
-    # Add white border
-    image_input = ImageOps.expand(image_input, border=int(opt_border_width))
-    # Removes background
-    output = remove(image_input)
+    # Add white border. Without a border, expand() would only make a copy of the image.
+    if int(opt_border_width):
+        image_input = ImageOps.expand(image_input, border=int(opt_border_width))
+    use_proxy = proxy_size is not None and max(image_input.size) > proxy_size
+    if mask_cache is None and not use_proxy:
+        # Removes background
+        output = remove(image_input, session=session or session_pool.get(model_name))
+    else:
+        # rembg applies the EXIF orientation before predicting; do the same so the mask lines up.
+        # exif_transpose() copies the image even when there is nothing to rotate, so check first.
+        if image_input.getexif().get(ExifTags.Base.Orientation, 1) != 1:
+            image_input = ImageOps.exif_transpose(image_input)
+        # The image the model runs on; with a proxy the cache holds the proxy's small mask
+        model_input = make_proxy(image_input, proxy_size) if use_proxy else image_input
+        key = mask_cache.make_key(model_input, model_name) if mask_cache is not None else None
+        mask = mask_cache.load(key) if mask_cache is not None else None
+        if mask is None:
+            mask = remove(model_input, session=session or session_pool.get(model_name), only_mask=True)
+            if mask_cache is not None:
+                mask_cache.store(key, mask)
+        if use_proxy:
+            mask = upsample_mask(mask, model_input, image_input)
+        return trimmed_cutout(image_input, mask)
     # Removes white border that .expand() added
     output = trim(output)
     return output
 
 
+def make_proxy(image, proxy_size):
+    """
+    Shrink an image so that its longest side is proxy_size.
+
+    :param image: The full-resolution image.
+    :param proxy_size: The longest side of the proxy, in pixels.
+    :return: The proxy, in 'RGB' or 'RGBA' (or 'L' for grayscale images).
+    """
+    if image.mode not in ('L', 'RGB', 'RGBA'):
+        image = image.convert('RGBA' if image.has_transparency_data else 'RGB')
+    scale = proxy_size / max(image.size)
+    size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    # reducing_gap first shrinks by an integer factor with reduce(), which is much faster
+    return image.resize(size, Image.Resampling.BILINEAR, reducing_gap=2.0)
+
+
+def upsample_mask(mask, proxy, image, radius=GUIDED_FILTER_RADIUS, eps=GUIDED_FILTER_EPS):
+    """
+    Upsample a mask computed from a proxy to the full resolution of the image, following
+    the edges of the image (a fast guided filter, He and Sun 2015).
+
+    The guided filter models the mask in every window as a linear function a * I + b of
+    the luminance I. The coefficients are fitted at the proxy's resolution, smoothed,
+    upsampled bilinearly, and applied to the full-resolution luminance, so edges in the
+    mask snap to the edges of the image instead of being blurred by the upsampling. Only
+    the tiles along the outline of the mask are computed at full resolution: where the
+    proxy is plain background or foreground all around, the tile is filled with 0 or 255,
+    which is exactly what the filter would give there. So the time depends on the length
+    of the outline rather than on the number of pixels.
+
+    :param mask: The 'L' mask of the proxy.
+    :param proxy: The proxy the mask was computed from (see make_proxy).
+    :param image: The full-resolution image.
+    :param radius: The radius of the filter window, in proxy pixels.
+    :param eps: The regularization: below this local variance of the luminance, the mask is
+        smoothed rather than fitted to the image.
+    :return: The 'L' mask of the full-resolution image.
+    """
+    from scipy import ndimage
+
+    def box(values):
+        return ndimage.uniform_filter(values, 2 * radius + 1, mode='reflect')
+
+    guide = np.asarray(proxy.convert('L'), dtype=np.float32) / 255
+    target = np.asarray(mask.convert('L'), dtype=np.float32) / 255
+    mean_guide, mean_target = box(guide), box(target)
+    variance = box(guide * guide) - mean_guide * mean_guide
+    covariance = box(guide * target) - mean_guide * mean_target
+    a = covariance / (variance + eps)
+    b = mean_target - a * mean_guide
+    # Scaled so that the mask in 0-255 is a * luminance + b with the luminance in 0-255
+    a, b = box(a), box(b) * 255
+    # Where a * luminance stays below 0.01, b alone rounds the mask to 0 or 255
+    flat = np.abs(a) * 255 < 0.01
+    background, foreground = flat & (b < 0.01), flat & (b > 254.99)
+    a, b = Image.fromarray(a), Image.fromarray(b)
+
+    width, height = image.size
+    scale_x, scale_y = proxy.width / width, proxy.height / height
+    output = Image.new('L', image.size, 0)
+    for top in range(0, height, _UPSAMPLE_TILE):
+        bottom = min(height, top + _UPSAMPLE_TILE)
+        # The proxy pixels the bilinear upsampling of the tile reads
+        rows = slice(max(0, math.floor(top * scale_y) - 1), math.ceil(bottom * scale_y) + 1)
+        for left in range(0, width, _UPSAMPLE_TILE):
+            right = min(width, left + _UPSAMPLE_TILE)
+            columns = slice(max(0, math.floor(left * scale_x) - 1), math.ceil(right * scale_x) + 1)
+            if background[rows, columns].all():
+                continue
+            if foreground[rows, columns].all():
+                output.paste(255, (left, top, right, bottom))
+                continue
+            source = (left * scale_x, top * scale_y, right * scale_x, bottom * scale_y)
+            size = (right - left, bottom - top)
+            tile = np.array(a.resize(size, Image.Resampling.BILINEAR, box=source))
+            tile *= np.asarray(image.crop((left, top, right, bottom)).convert('L'))
+            tile += np.asarray(b.resize(size, Image.Resampling.BILINEAR, box=source))
+            tile += 0.5
+            np.clip(tile, 0, 255, out=tile)
+            output.paste(Image.fromarray(tile.astype(np.uint8)), (left, top))
+    return output
+
+
+def cutout(image, mask):
+    """
+    Cut an image out along a mask, the same way rembg does by default.
+
+    :param image: The image.
+    :param mask: The 'L' mask, the same size as the image. Zero is background.
+    :return: An RGBA image that is transparent black where the mask is zero.
+    """
+    empty = Image.new('RGBA', image.size, 0)
+    return Image.composite(image, empty, mask)
+
+
+def trimmed_cutout(image, mask):
+    """
+    trim(cutout(image, mask)), without making the full-size cutout when it can be avoided.
+
+    For an image without alpha whose mask is zero in the top left corner, the cutout's
+    corner pixel is transparent black and no channel of the cutout exceeds its alpha, which
+    is the mask. trim() then keeps exactly the box where the mask is above 100, so the image
+    and the mask are cropped to that box first.
+    """
+    if image.mode in ('L', 'RGB') and mask.getpixel((0, 0)) == 0:
+        bbox = mask.point(lambda value: 255 if value > 100 else 0).getbbox()
+        if bbox:
+            return cutout(image.crop(bbox), mask.crop(bbox))
+    return trim(cutout(image, mask))
+
+
 def trim(image):
     bg = Image.new(image.mode, image.size, image.getpixel((0, 0)))
     diff = ImageChops.difference(image, bg)
@@ -19,7 +19,46 @@ def scale_image(image_input: ImageFile, scale_factor: float = None, new_size: tu
     :param resample_filter: The resampling filter to use.
     :return: The scaled image.
     """
-    original_width, original_height = image_input.size
+    new_width, new_height = compute_scaled_size(image_input.size, scale_factor, new_size)
+    return resize_image(image_input, (new_width, new_height), resample_filter)
+
+
+def resize_image(image_input: ImageFile, size: tuple, resample_filter: str = "bilinear"):
+    """
+    Resize an image to an exact size.
+
+    :param image_input: The image to modify.
+    :param size: The new size as a tuple (width, height).
+    :param resample_filter: The resampling filter to use.
+    :return: The resized image.
+    """
+    return image_input.resize(tuple(size), resample=resample_filter_value(resample_filter))
+
+
+def resample_filter_value(resample_filter: str):
+    """
+    Look up a resampling filter by name.
+
+    :param resample_filter: One of RESAMPLE_FILTERS, in any case.
+    :return: The Pillow resampling filter.
+    """
+    resample = RESAMPLE_FILTERS.get(resample_filter.lower())
+    if resample is None:
+        raise ValueError(
+            f"Invalid resample filter: {resample_filter}. Available filters: {list(RESAMPLE_FILTERS.keys())}")
+    return resample
+
+
+def compute_scaled_size(size: tuple, scale_factor: float = None, new_size: tuple = None):
+    """
+    Compute the size scale_image produces for an image of the given size.
+
+    :param size: The current size as a tuple (width, height).
+    :param scale_factor: The factor to scale the image by.
+    :param new_size: The size as a tuple (width, height) to fit within.
+    :return: The scaled size as a tuple (width, height).
+    """
+    original_width, original_height = size
     new_width, new_height = original_width, original_height
 
     if scale_factor is not None:
@@ -30,11 +69,27 @@ def scale_image(image_input: ImageFile, scale_factor: float = None, new_size: tu
         ratio = min(target_width / original_width, target_height / original_height)
         new_width = int(original_width * ratio)
         new_height = int(original_height * ratio)
+    return new_width, new_height
 
-    resample = RESAMPLE_FILTERS.get(resample_filter.lower())
-    if resample is None:
-        raise ValueError(
-            f"Invalid resample filter: {resample_filter}. Available filters: {list(RESAMPLE_FILTERS.keys())}")
 
-    scaled_image = image_input.resize((new_width, new_height), resample=resample)
-    return scaled_image
+def parse_scale_values(values):
+    """
+    Parse the values of a --scale argument.
+
+    :param values: Either a factor such as ['1.5x'] or a size such as ['400px', '300px'].
+    :return: A tuple (scale_factor, new_size); exactly one of them is None.
+    :raises ValueError: If the values are not in one of the accepted formats.
+    """
+    if len(values) == 1 and values[0].lower().endswith('x'):
+        try:
+            return float(values[0][:-1]), None
+        except ValueError:
+            raise ValueError(f"Invalid scale factor: {values[0]}")
+    elif len(values) == 2:
+        try:
+            width = int(values[0].lower().replace('px', ''))
+            height = int(values[1].lower().replace('px', ''))
+        except ValueError:
+            raise ValueError(f"Invalid size format: {values}")
+        return None, (width, height)
+    raise ValueError("Invalid format for --scale argument. Use '1.5x' or '400px 300px'.")
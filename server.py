@@ -0,0 +1,318 @@
+"""
+Server mode: an HTTP service on top of the processing pipeline.
+
+Clients POST an image to ``/process`` with the operation chain in the ``chain`` query
+parameter, written exactly like the flags of main.py (e.g. ``--scale 0.5x --grayscale
+--format webp``), and get the processed image back. The process stays up, so the
+libraries and the rembg sessions are loaded once rather than for every image.
+
+Requests wait in a bounded queue. A dispatcher thread takes them off the queue in
+micro-batches: it waits up to ``max_wait`` seconds after the first request for more to
+arrive, up to ``max_batch`` requests, and runs the batch on ``--jobs`` worker threads.
+While a batch runs the next one fills up, so batches grow with the load. When the queue
+is full the server answers 503 with a Retry-After header instead of queueing without
+bound. ``GET /stats`` returns the request counts, the batch sizes and the latency
+percentiles; ``GET /health`` answers 'ok'.
+
+Example:
+    python main.py --serve 8750 --remove-background
+    curl --data-binary @photo.jpg "http://127.0.0.1:8750/process?chain=--scale%200.5x" -o out.png
+"""
+import contextlib
+import copy
+import io
+import itertools
+import json
+import math
+import queue
+import shlex
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from PIL import UnidentifiedImageError
+
+from batching import DEFAULT_BATCH_WAIT, DEFAULT_MAX_BATCH, Batcher
+from encoders import DEFAULT_FORMAT, content_type, encode_image
+from processing import close_run, open_run, process_image
+from watch import warm_up
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8750
+DEFAULT_MAX_QUEUE = 64
+MAX_REQUEST_BYTES = 64 * 1024 * 1024
+
+# The settings a request may choose; everything else (jobs, threads, caches, ...) is set
+# when the server starts.
+REQUEST_SETTINGS = ('resample', 'threshold', 'bg_model', 'formats', 'compression', 'quality',
+                    'optimize', 'fuse', 'draft')
+
+
+def parse_chain(chain):
+    """
+    Parses the operation chain of a request, written like the flags of main.py.
+
+    :param chain: The flags, e.g. '--scale 0.5x --grayscale --format webp'.
+    :return: A tuple (ordered_operations, settings): the operations in order (empty if the
+        chain has none) and the REQUEST_SETTINGS as a dict.
+    :raises ValueError: If the chain cannot be parsed, or sets anything but operations and
+        REQUEST_SETTINGS.
+    """
+    # Imported here: main imports this module
+    from main import build_parser
+    parser = build_parser()
+
+    def error(message):
+        raise ValueError(message)
+
+    parser.error = error
+    defaults = vars(parser.parse_args([]))
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            args = parser.parse_args(shlex.split(chain))
+    except SystemExit:
+        # --help
+        raise ValueError('--help is not available per request.')
+    not_allowed = sorted(name for name, value in vars(args).items()
+                         if name not in REQUEST_SETTINGS and name != 'ordered_operations'
+                         and value != defaults.get(name))
+    if not_allowed:
+        raise ValueError(f"Not allowed per request: {', '.join(not_allowed)}.")
+    if len(args.formats) != 1:
+        raise ValueError('A request returns one image; give a single --format.')
+    if args.quality is not None and not 1 <= args.quality <= 100:
+        raise ValueError('--quality must be between 1 and 100.')
+    settings = {name: getattr(args, name) for name in REQUEST_SETTINGS}
+    return getattr(args, 'ordered_operations', []), settings
+
+
+def percentile(sorted_values, fraction):
+    """Returns the nearest-rank percentile of a sorted list, e.g. fraction 0.99 for p99."""
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, math.ceil(fraction * len(sorted_values)) - 1)]
+
+
+class LatencyStats:
+    """The latencies of the most recent requests, in seconds, with their percentiles."""
+
+    def __init__(self, window=10000):
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def summary(self):
+        """Returns the count and the p50, p90, p99 and maximum latencies in milliseconds."""
+        with self._lock:
+            latencies = sorted(self._latencies)
+        summary = {'count': len(latencies)}
+        for name, fraction in (('p50_ms', 0.5), ('p90_ms', 0.9), ('p99_ms', 0.99), ('max_ms', 1.0)):
+            value = percentile(latencies, fraction)
+            summary[name] = None if value is None else round(value * 1000, 2)
+        return summary
+
+
+class ProcessingService:
+    """
+    The warm state of the server: the parsed server arguments, the caches, the worker
+    threads and the batcher.
+
+    :param ordered_operations: The chain for requests that do not give one. It is run
+        once on a blank image at startup, so the models it needs are loaded up front.
+    :param cli_args: The parsed command-line arguments of the server.
+    """
+
+    def __init__(self, ordered_operations, cli_args, max_queue=DEFAULT_MAX_QUEUE, max_batch=DEFAULT_MAX_BATCH,
+                 max_wait=DEFAULT_BATCH_WAIT):
+        self.default_operations = list(ordered_operations or [])
+        if self.default_operations:
+            warm_up(self.default_operations, cli_args)
+        self.cli_args, self._cache = open_run(cli_args)
+        jobs = max(1, getattr(cli_args, 'jobs', 1) or 1)
+        self._executor = ThreadPoolExecutor(max_workers=jobs)
+        self.batcher = Batcher(self._process_batch, max_queue, max_batch, max_wait)
+        self.latencies = LatencyStats()
+        self.counts = {'processed': 0, 'failed': 0, 'rejected': 0}
+        self._counts_lock = threading.Lock()
+        self._names = itertools.count(1)
+
+    def submit(self, data, chain=''):
+        """
+        Queues an image for processing.
+
+        :param data: The encoded image.
+        :param chain: The operation chain and settings, written like the flags of main.py.
+        :return: A Future with a dict holding the encoded output 'body', its 'content_type',
+            and the 'queue_s' and 'processing_s' of the request.
+        :raises ValueError: If the chain is invalid.
+        :raises queue.Full: If the queue is full.
+        """
+        operations, settings = parse_chain(chain) if chain.strip() else ([], {})
+        args = self._request_args(settings)
+        item = {'name': f'request-{next(self._names)}', 'data': data,
+                'operations': operations or self.default_operations, 'args': args, 'queued_at': time.monotonic()}
+        try:
+            return self.batcher.submit(item)
+        except queue.Full:
+            self._count('rejected')
+            raise
+
+    def _request_args(self, settings):
+        args = self.cli_args
+        if settings:
+            args = copy.copy(args)
+            for name, value in settings.items():
+                setattr(args, name, value)
+        return args
+
+    def _count(self, name):
+        with self._counts_lock:
+            self.counts[name] += 1
+
+    def _process_batch(self, batch):
+        return list(self._executor.map(self._process_one, batch))
+
+    def _process_one(self, item):
+        start = time.monotonic()
+        args = item['args']
+        try:
+            output_format = (getattr(args, 'formats', None) or [DEFAULT_FORMAT])[0]
+            output_image = process_image(item['name'], io.BytesIO(item['data']), item['operations'], args)
+            body = encode_image(output_image, output_format, getattr(args, 'compression', None) or 'default',
+                                getattr(args, 'quality', None))
+        except Exception as e:
+            self._count('failed')
+            return None, e
+        finished = time.monotonic()
+        self._count('processed')
+        self.latencies.add(finished - item['queued_at'])
+        return {'body': body, 'content_type': content_type(output_format),
+                'queue_s': start - item['queued_at'], 'processing_s': finished - start}, None
+
+    def stats(self):
+        """Returns the request counts, the queue depth, the batch sizes and the latency percentiles."""
+        batch_sizes = list(self.batcher.batch_sizes)
+        with self._counts_lock:
+            counts = dict(self.counts)
+        return dict(counts, queue_depth=self.batcher.queue_depth(), batches=len(batch_sizes),
+                    mean_batch_size=round(sum(batch_sizes) / len(batch_sizes), 2) if batch_sizes else None,
+                    max_batch_size=max(batch_sizes, default=None), latency=self.latencies.summary())
+
+    def close(self):
+        """Finishes the queued requests, then saves the caches and writes the profile."""
+        self.batcher.close()
+        self._executor.shutdown()
+        close_run(self.cli_args, self._cache)
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """Serves POST /process, GET /stats and GET /health for the server's ProcessingService."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path == '/health':
+            self._send(200, b'ok', 'text/plain')
+        elif path == '/stats':
+            self._send(200, json.dumps(self.server.service.stats()).encode(), 'application/json')
+        else:
+            self._send_error(404, 'Not found.')
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path != '/process':
+            self._send_error(404, 'Not found.')
+            return
+        length = self.headers.get('Content-Length')
+        if length is None:
+            self._send_error(411, 'Content-Length is required.')
+            return
+        if int(length) > MAX_REQUEST_BYTES:
+            self.close_connection = True
+            self._send_error(413, f'Images are limited to {MAX_REQUEST_BYTES // (1024 * 1024)} MB.')
+            return
+        data = self.rfile.read(int(length))
+        chain = parse_qs(url.query).get('chain', [''])[0]
+        try:
+            future = self.server.service.submit(data, chain)
+        except ValueError as e:
+            self._send_error(400, str(e))
+            return
+        except queue.Full:
+            self._send_error(503, 'The server is busy; try again.', {'Retry-After': '1'})
+            return
+        try:
+            result = future.result()
+        except (UnidentifiedImageError, ValueError) as e:
+            # Not an image, or e.g. JPEG output requested for an image with transparency
+            self._send_error(400, str(e))
+            return
+        except Exception as e:
+            self._send_error(500, f'Processing failed: {e}')
+            return
+        self._send(200, result['body'], result['content_type'], {
+            'X-Queue-Ms': f"{result['queue_s'] * 1000:.1f}",
+            'X-Processing-Ms': f"{result['processing_s'] * 1000:.1f}",
+        })
+
+    def _send_error(self, status, message, headers=None):
+        self._send(status, json.dumps({'error': message}).encode(), 'application/json', headers)
+
+    def _send(self, status, body, body_type, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', body_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # The latencies are in /stats; one log line per request would drown the progress messages
+        pass
+
+
+def make_server(ordered_operations, cli_args, host=DEFAULT_HOST, port=DEFAULT_PORT, max_queue=DEFAULT_MAX_QUEUE,
+                max_batch=DEFAULT_MAX_BATCH, max_wait=DEFAULT_BATCH_WAIT):
+    """
+    Creates the server without starting it; call serve_forever() to start it, and
+    shutdown(), server_close() and service.close() to stop it.
+
+    :param ordered_operations: The chain for requests that do not give one (see ProcessingService).
+    :param cli_args: The parsed command-line arguments of the server.
+    :param host: The address to listen on.
+    :param port: The port to listen on; 0 picks a free one (see server_address).
+    :return: A ThreadingHTTPServer with the ProcessingService as its ``service`` attribute.
+    """
+    server = ThreadingHTTPServer((host, port), RequestHandler)
+    server.daemon_threads = True
+    server.service = ProcessingService(ordered_operations, cli_args, max_queue, max_batch, max_wait)
+    return server
+
+
+def serve(ordered_operations, cli_args, host=DEFAULT_HOST, port=DEFAULT_PORT, max_queue=DEFAULT_MAX_QUEUE,
+          max_batch=DEFAULT_MAX_BATCH, max_wait=DEFAULT_BATCH_WAIT):
+    """Runs the server until interrupted with Ctrl+C, then prints the request statistics."""
+    server = make_server(ordered_operations, cli_args, host, port, max_queue, max_batch, max_wait)
+    print(f"Serving on http://{server.server_address[0]}:{server.server_address[1]}/process (Ctrl+C to stop)...")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nStopping; finishing the queued requests...")
+    finally:
+        server.server_close()
+        server.service.close()
+        stats = server.service.stats()
+        latency = stats['latency']
+        print(f"Served {stats['processed']} request(s), {stats['failed']} failed, {stats['rejected']} rejected "
+              f"as busy; mean batch size {stats['mean_batch_size']}.")
+        if latency['count']:
+            print(f"Latency: p50 {latency['p50_ms']} ms, p90 {latency['p90_ms']} ms, p99 {latency['p99_ms']} ms, "
+                  f"max {latency['max_ms']} ms.")
@@ -0,0 +1,140 @@
+"""
+Intra-image parallelism: one image split into row strips that are processed on a thread pool.
+
+Batch parallelism (--jobs) does not help with a single large image. For edge detection and
+scaling, the image is split into horizontal strips that are processed on ``threads``
+threads; NumPy, scikit-image, SciPy and Pillow release the GIL while they work, so the
+strips run in parallel. The output is identical to processing the image in one piece:
+
+* Edge detection reads each strip with the same rows of overlap ("halo") on either side as
+  tiled execution (see tiling), and keeps only the strip's own rows. Canny's hysteresis
+  links edges across strips, so it runs once over all strips after their thresholds are
+  computed in parallel.
+* Scaling runs Pillow's two resampling passes separately: the horizontal pass on row
+  strips, then the vertical pass on column strips of its result. Each pass computes
+  exactly what Pillow computes for the whole image, since Pillow also rounds between the
+  two passes.
+
+Images too small to give every thread a strip of at least MIN_STRIP_ROWS rows (or columns)
+use fewer threads, down to running in one piece.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from frame import Frame, as_frame
+from image_filters import EDGE_METHODS, edge_map
+from scale_image import resize_image, resample_filter_value
+from tiling import CANNY_HALO, KOVALEVSKY_HALO, SOBEL_HALO, canny_thresholds, hysteresis
+
+DEFAULT_THREADS = 1
+MIN_STRIP_ROWS = 64
+
+_HALOS = {'sobel': SOBEL_HALO, 'canny': CANNY_HALO, 'kovalevsky': KOVALEVSKY_HALO}
+# The Kovalevsky scan needs at least its 6-pixel window in both directions
+_MIN_ROWS = {'kovalevsky': 6}
+
+
+def strip_bounds(length, threads):
+    """
+    Splits a length into strips of nearly equal size, one per thread.
+
+    :param length: The number of rows (or columns).
+    :param threads: The number of threads.
+    :return: A list of (start, stop) pairs; a single pair if the length is too short to split.
+    """
+    count = max(1, min(threads, length // MIN_STRIP_ROWS))
+    bounds = [length * index // count for index in range(count + 1)]
+    return list(zip(bounds, bounds[1:]))
+
+
+def edge_map_in_strips(image, method, threshold=50, threads=DEFAULT_THREADS):
+    """
+    image_filters.edge_map, run on ``threads`` strips of the image in parallel.
+
+    :param image: The input image, or a frame.Frame.
+    :param method: The edge detection method ('sobel', 'canny', 'kovalevsky'), or 'all'.
+    :param threshold: The sensitivity threshold for the Kovalevsky method.
+    :param threads: The number of threads.
+    :return: A uint8 array of shape (height, width) with the edges; for 'all', of shape
+        (height, width, 3) with the Sobel, Canny and Kovalevsky edges in that order.
+    """
+    frame = as_frame(image)
+    if method == 'all':
+        # One frame for all three, so its grayscale array is made once
+        return np.dstack([edge_map_in_strips(frame, single, threshold, threads) for single in EDGE_METHODS])
+    strips = strip_bounds(frame.size[1], threads)
+    if len(strips) == 1 or method not in _HALOS:
+        return edge_map(frame, method, threshold)
+    if method == 'kovalevsky':
+        array = frame.array('L' if frame.mode == 'L' else 'RGB')
+    else:
+        array = frame.luminance()
+    halo, min_rows = _HALOS[method], _MIN_ROWS.get(method, 1)
+
+    def with_halo(strip):
+        top, bottom = strip
+        start, stop = max(0, top - halo), min(len(array), bottom + halo)
+        if stop - start < min_rows:
+            start = max(0, stop - min_rows)
+            stop = min(len(array), start + min_rows)
+        return start, stop, slice(top - start, bottom - start)
+
+    if method == 'canny':
+        def thresholds(strip):
+            start, stop, core = with_halo(strip)
+            weak, strong = canny_thresholds(array[start:stop])
+            return np.packbits(weak[core], axis=1), np.packbits(strong[core], axis=1)
+
+        with ThreadPoolExecutor(len(strips)) as pool:
+            weak_bands, strong_bands = zip(*pool.map(thresholds, strips))
+        edges = hysteresis(list(weak_bands), list(strong_bands), frame.size[0])
+        edges = np.concatenate([np.unpackbits(band, axis=1, count=frame.size[0]) for band in edges])
+        return edges * np.uint8(255)
+
+    def detect(strip):
+        start, stop, core = with_halo(strip)
+        return edge_map(Frame(array=array[start:stop]), method, threshold)[core]
+
+    with ThreadPoolExecutor(len(strips)) as pool:
+        return np.concatenate(list(pool.map(detect, strips)))
+
+
+def resize_in_strips(image, size, resample_filter='bilinear', threads=DEFAULT_THREADS):
+    """
+    scale_image.resize_image, run on ``threads`` strips of the image in parallel.
+
+    :param image: The image to resize.
+    :param size: The new size as a tuple (width, height).
+    :param resample_filter: The resampling filter to use.
+    :param threads: The number of threads.
+    :return: The resized image.
+    """
+    resample = resample_filter_value(resample_filter)
+    width, height = image.size
+    new_width, new_height = size = tuple(size)
+    if image.mode not in ('L', 'RGB', 'RGBA') or size == image.size or threads <= 1:
+        return resize_image(image, size, resample_filter)
+    # Pillow resizes RGBA with premultiplied alpha (except with nearest-neighbour)
+    source = image.convert('RGBa') if image.mode == 'RGBA' and resample != Image.Resampling.NEAREST else image
+
+    with ThreadPoolExecutor(threads) as pool:
+        if new_width != width:
+            rows = strip_bounds(height, threads)
+            parts = pool.map(lambda strip: source.crop((0, strip[0], width, strip[1])).resize(
+                (new_width, strip[1] - strip[0]), resample), rows)
+            source = _stitch(source.mode, (new_width, height), parts, [(0, top) for top, _ in rows])
+        if new_height != height:
+            columns = strip_bounds(new_width, threads)
+            parts = pool.map(lambda strip: source.crop((strip[0], 0, strip[1], height)).resize(
+                (strip[1] - strip[0], new_height), resample), columns)
+            source = _stitch(source.mode, size, parts, [(left, 0) for left, _ in columns])
+    return source.convert(image.mode) if source.mode != image.mode else source
+
+
+def _stitch(mode, size, parts, positions):
+    output = Image.new(mode, size)
+    for part, position in zip(parts, positions):
+        output.paste(part, position)
+    return output
@@ -0,0 +1,53 @@
+import os
+import sys
+import queue
+import threading
+import unittest
+
+# Add the project root to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from batching import Batcher
+
+
+class TestBatcher(unittest.TestCase):
+
+    def test_items_arriving_during_a_batch_form_the_next_batch(self):
+        """While a batch runs, the queued items are collected into one batch of up to max_batch."""
+        release = threading.Event()
+        batches = []
+
+        def process_batch(items):
+            batches.append(items)
+            if len(batches) == 1:
+                release.wait(5)
+            return [(item * 2, None) for item in items]
+
+        batcher = Batcher(process_batch, max_queue=10, max_batch=3, max_wait=0.0)
+        futures = [batcher.submit(0)]
+        while not batches:
+            pass
+        futures += [batcher.submit(item) for item in range(1, 5)]
+        release.set()
+        self.assertEqual([future.result(5) for future in futures], [0, 2, 4, 6, 8])
+        batcher.close()
+        self.assertEqual(batches, [[0], [1, 2, 3], [4]])
+
+    def test_full_queue_raises(self):
+        """submit() raises queue.Full instead of queueing without bound."""
+        release = threading.Event()
+        batcher = Batcher(lambda items: release.wait(5) and [(None, None)] * len(items), max_queue=1,
+                          max_batch=1)
+        first = batcher.submit(1)
+        while batcher.queue_depth():
+            pass
+        batcher.submit(2)
+        with self.assertRaises(queue.Full):
+            batcher.submit(3)
+        release.set()
+        first.result(5)
+        batcher.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from PIL import Image
+
+# Add the project root to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import processing
+from cache import ContentCache, OutputCache, hash_file
+from processing import process_images_and_save
+
+
+class TestContentCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_least_recently_used_is_evicted(self):
+        cache = ContentCache(self.cache_dir, max_bytes=250)
+        cache.put('aa01', data=b'x' * 100)
+        cache.put('bb02', data=b'y' * 100)
+        self.assertIsNotNone(cache.get('aa01'))  # aa01 is now the most recently used
+        cache.put('cc03', data=b'z' * 100)
+        self.assertIsNone(cache.get('bb02'))
+        self.assertIsNotNone(cache.get('aa01'))
+        self.assertIsNotNone(cache.get('cc03'))
+
+    def test_index_survives_reload(self):
+        cache = ContentCache(self.cache_dir, max_bytes=1000)
+        cache.put('aa01', data=b'data', note='kept')
+        cache.save()
+        reloaded = ContentCache(self.cache_dir, max_bytes=1000)
+        self.assertEqual(reloaded.metadata('aa01'), {'note': 'kept'})
+        with open(reloaded.get('aa01'), 'rb') as f:
+            self.assertEqual(f.read(), b'data')
+
+    def test_purge(self):
+        cache = ContentCache(self.cache_dir, max_bytes=1000)
+        cache.put('aa01', data=b'data')
+        cache.save()
+        cache.purge()
+        self.assertEqual(cache.stats()['entries'], 0)
+        self.assertEqual(ContentCache(self.cache_dir, max_bytes=1000).stats()['entries'], 0)
+
+
+class TestOutputCache(unittest.TestCase):
+
+    def setUp(self):
+        """Run each test in a temporary working directory so Output/ stays isolated."""
+        self.original_cwd = os.getcwd()
+        self.work_dir = tempfile.mkdtemp()
+        os.chdir(self.work_dir)
+        self.input_path = 'input.png'
+        Image.new('RGB', (16, 12), (200, 30, 60)).save(self.input_path)
+        self.operations = [{'dest': 'invert', 'values': []}]
+
+    def tearDown(self):
+        os.chdir(self.original_cwd)
+        shutil.rmtree(self.work_dir)
+
+    def run_batch(self, operations=None, **settings):
+        args = SimpleNamespace(jobs=1, cache='cache', **settings)
+        return process_images_and_save([['input.png', self.input_path]], operations or self.operations, args)
+
+    def test_second_run_is_up_to_date(self):
+        first = self.run_batch()
+        self.assertIsNone(first[0]['cached'])
+        with patch.object(processing, 'apply_operations') as apply_operations:
+            second = self.run_batch()
+        apply_operations.assert_not_called()
+        self.assertEqual(second[0]['cached'], 'up_to_date')
+
+    def test_missing_output_is_restored(self):
+        first = self.run_batch()
+        with open(first[0]['output_path'], 'rb') as f:
+            expected = f.read()
+        os.remove(first[0]['output_path'])
+        second = self.run_batch()
+        self.assertEqual(second[0]['cached'], 'restored')
+        with open(second[0]['output_path'], 'rb') as f:
+            self.assertEqual(f.read(), expected)
+
+    def test_changes_invalidate_the_entry(self):
+        self.run_batch()
+        self.assertIsNone(self.run_batch([{'dest': 'grayscale', 'values': []}])[0]['cached'])
+        self.assertIsNone(self.run_batch(resample='nearest')[0]['cached'])
+        Image.new('RGB', (16, 12), (10, 30, 60)).save(self.input_path)
+        self.assertIsNone(self.run_batch()[0]['cached'])
+
+    def test_background_proxy_setting_invalidates_the_entry(self):
+        operations = [{'dest': 'remove_background', 'values': []}]
+        with patch.object(processing, 'remove_background', side_effect=lambda image, **kwargs: image):
+            self.assertIsNone(self.run_batch(operations)[0]['cached'])
+            self.assertIsNone(self.run_batch(operations, bg_proxy=64)[0]['cached'])
+            self.assertEqual(self.run_batch(operations, bg_proxy=64)[0]['cached'], 'up_to_date')
+            # Without the proxy the full-resolution output is back, not the proxy's
+            self.assertEqual(self.run_batch(operations)[0]['cached'], 'restored')
+
+    def test_input_is_hashed_once_for_all_formats(self):
+        with patch('processing.hash_file', wraps=hash_file) as mock_hash, \
+                patch('cache.hash_file', wraps=hash_file) as mock_cache_hash:
+            self.run_batch(formats=['png', 'webp', 'jpeg'])
+            self.assertEqual(self.run_batch(formats=['png', 'webp', 'jpeg'])[0]['cached'], 'up_to_date')
+        self.assertEqual(mock_hash.call_count, 2)
+        mock_cache_hash.assert_not_called()
+
+    def test_key_ignores_value_case(self):
+        upper = OutputCache.make_key(self.input_path, [{'dest': 'flip', 'values': ['Horizontal']}], {})
+        lower = OutputCache.make_key(self.input_path, [{'dest': 'flip', 'values': ['horizontal']}], {})
+        self.assertEqual(upper, lower)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+import os
+import sys
+import unittest
+from types import SimpleNamespace
+
+import numpy as np
+from PIL import Image
+
+# Add the project root to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from chain_optimizer import describe_operation, optimize_operations
+from processing import apply_operations
+
+
+def op(dest, *values):
+    return {'dest': dest, 'values': list(values)}
+
+
+class TestOptimizeOperations(unittest.TestCase):
+
+    def setUp(self):
+        self.args = SimpleNamespace(resample='bilinear', threshold=50)
+
+    def optimize(self, operations, mode='RGB', size=(400, 300)):
+        return optimize_operations(operations, self.args, image_mode=mode, image_size=size)
+
+    def test_equal_flips_cancel(self):
+        operations, notes = self.optimize([op('flip', 'horizontal'), op('flip', 'horizontal')])
+        self.assertEqual(operations, [])
+        self.assertEqual(len(notes), 1)
+
+    def test_flips_merge_across_pointwise_operations(self):
+        operations, _ = self.optimize([op('flip', 'horizontal'), op('invert'), op('brightness', 10),
+                                       op('flip', 'vertical')])
+        self.assertEqual(operations, [op('flip', 'both'), op('invert'), op('brightness', 10)])
+
+    def test_flips_do_not_merge_across_other_operations(self):
+        chain = [op('flip', 'horizontal'), op('edge_detection', 'kovalevsky'), op('flip', 'horizontal')]
+        operations, notes = self.optimize(chain)
+        self.assertEqual(operations, chain)
+        self.assertEqual(notes, [])
+
+    def test_downscale_moves_ahead_of_swappable_operations(self):
+        chain = [op('edge_detection', 'sobel'), op('invert'), op('flip', 'vertical'), op('scale', '0.5x')]
+        operations, notes = self.optimize(chain)
+        self.assertEqual(operations, [op('edge_detection', 'sobel'), op('scale', '0.5x'), op('invert'),
+                                      op('flip', 'vertical')])
+        self.assertEqual(len(notes), 1)
+
+    def test_upscale_and_unknown_fit_stay_in_place(self):
+        chain = [op('invert'), op('scale', '2x'), op('grayscale'), op('scale', '800px', '600px')]
+        operations, _ = self.optimize(chain, size=None)
+        self.assertEqual(operations, chain)
+
+    def test_fit_to_box_downscale_uses_image_size(self):
+        chain = [op('invert'), op('scale', '100px', '100px')]
+        operations, _ = self.optimize(chain, size=(400, 300))
+        self.assertEqual(operations, [op('scale', '100px', '100px'), op('invert')])
+
+    def test_alpha_blocks_invert_and_grayscale_swap(self):
+        chain = [op('flip', 'horizontal'), op('invert'), op('scale', '0.5x')]
+        operations, _ = self.optimize(chain, mode='RGBA')
+        self.assertEqual(operations, chain)
+        # After remove_background the image has alpha whatever the input mode
+        chain = [op('remove_background'), op('grayscale'), op('scale', '0.5x')]
+        self.assertEqual(self.optimize(chain)[0], chain)
+
+    def test_only_8bit_l_and_rgb_swap_invert_and_grayscale(self):
+        chain = [op('invert'), op('scale', '0.5x')]
+        for mode in ('I;16', 'I', 'F', 'CMYK', 'P', '1', None):
+            with self.subTest(mode=mode):
+                self.assertEqual(self.optimize(chain, mode=mode)[0], chain)
+        self.assertEqual(self.optimize(chain, mode='L')[0], chain[::-1])
+        # Grayscale makes any input 8-bit 'L', so a later invert can be swapped
+        chain = [op('grayscale'), op('invert'), op('scale', '0.5x')]
+        self.assertEqual(self.optimize(chain, mode='I;16')[0], [op('grayscale'), op('scale', '0.5x'), op('invert')])
+
+    def test_16bit_input_keeps_literal_output(self):
+        """Invert clips 16-bit input to 8 bits first, so scaling before it would average different values."""
+        pixels = np.zeros((4, 6), dtype=np.uint16)
+        pixels[:, 1::2] = 1000
+        image = Image.fromarray(pixels)
+        self.assertEqual(image.mode, 'I;16')
+        chain = [op('invert'), op('scale', '0.5x')]
+        operations, _ = optimize_operations(chain, self.args, image.mode, image.size)
+        self.assertEqual(operations, chain)
+        optimized = apply_operations(image, 'test', operations, self.args)
+        self.assertEqual(optimized.tobytes(), apply_operations(image, 'test', chain, self.args).tobytes())
+        # The swapped order would change the output
+        swapped = apply_operations(image, 'test', chain[::-1], self.args)
+        self.assertNotEqual(swapped.tobytes(), optimized.tobytes())
+
+    def test_nearest_blocks_flip_swap(self):
+        self.args.resample = 'nearest'
+        chain = [op('flip', 'horizontal'), op('scale', '0.5x')]
+        self.assertEqual(self.optimize(chain)[0], chain)
+
+    def test_optimized_chain_output(self):
+        """Flip rewrites are exact; moving the scale changes pixels by rounding only."""
+        rng = np.random.default_rng(0)
+        image = Image.fromarray(rng.integers(0, 256, (60, 80, 3), dtype=np.uint8), 'RGB')
+        chain = [op('flip', 'horizontal'), op('invert'), op('flip', 'both'), op('grayscale'), op('scale', '0.5x')]
+        operations, _ = optimize_operations(chain, self.args, image.mode, image.size)
+        self.assertEqual(operations[0], op('scale', '0.5x'))
+        literal = np.asarray(apply_operations(image, 'test', chain, self.args), dtype=np.int16)
+        optimized = np.asarray(apply_operations(image, 'test', operations, self.args), dtype=np.int16)
+        self.assertEqual(literal.shape, optimized.shape)
+        self.assertLessEqual(int(np.abs(literal - optimized).max()), 2)
+
+    def test_describe_operation(self):
+        self.assertEqual(describe_operation(op('scale', '400px', '300px')), '--scale 400px 300px')
+        self.assertEqual(describe_operation(op('remove_background')), '--remove-background')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from PIL import Image
+
+# Add the project root to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from encoders import (
+    COMPRESSION_PRESETS,
+    OUTPUT_FORMATS,
+    content_type,
+    encode_image,
+    encoder_options,
+    output_extension,
+    write_image,
+)
+from image_io import map_image
+
+
+class TestEncoders(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.image = Image.linear_gradient('L').resize((64, 48)).convert('RGB')
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def test_every_format_and_preset_round_trips(self):
+        for output_format in OUTPUT_FORMATS:
+            for compression in COMPRESSION_PRESETS:
+                with self.subTest(output_format=output_format, compression=compression):
+                    path = os.path.join(self.output_dir, 'out' + output_extension(output_format))
+                    output = write_image(self.image, path, output_format, compression)
+                    self.assertEqual(output['bytes'], os.path.getsize(path))
+                    self.assertGreaterEqual(output['seconds'], 0)
+                    if output_format == 'npy':
+                        self.assertEqual(np.load(path).tobytes(), self.image.tobytes())
+                        continue
+                    with Image.open(path) as written:
+                        self.assertEqual(written.size, self.image.size)
+                        if output_format in ('png', 'webp', 'tiff'):
+                            self.assertEqual(written.convert('RGB').tobytes(), self.image.tobytes())
+        self.assertEqual([name for name in os.listdir(self.output_dir) if name.startswith('.tmp')], [])
+
+    def test_jpeg_rejects_transparency(self):
+        path = os.path.join(self.output_dir, 'out.jpg')
+        transparent = Image.new('RGBA', (8, 8), (255, 0, 0, 128))
+        with self.assertRaises(ValueError):
+            write_image(transparent, path, 'jpeg')
+        self.assertFalse(os.path.exists(path))
+        # Fully opaque alpha is simply dropped
+        write_image(Image.new('RGBA', (8, 8), (255, 0, 0, 255)), path, 'jpeg')
+        with Image.open(path) as written:
+            self.assertEqual(written.mode, 'RGB')
+
+    def test_quality_applies_to_lossy_formats(self):
+        self.assertEqual(encoder_options('jpeg', 'fast', quality=50)['quality'], 50)
+        self.assertEqual(encoder_options('webp-lossy', 'compact', quality=60), {'quality': 60, 'method': 6})
+        self.assertEqual(encoder_options('png', 'default', quality=50), {'compress_level': 6})
+        with self.assertRaises(ValueError):
+            encoder_options('gif')
+
+    def test_encode_image_matches_write_image(self):
+        for output_format in OUTPUT_FORMATS:
+            with self.subTest(output_format=output_format):
+                path = os.path.join(self.output_dir, 'out' + output_extension(output_format))
+                write_image(self.image, path, output_format, 'fast')
+                with open(path, 'rb') as f:
+                    self.assertEqual(encode_image(self.image, output_format, 'fast'), f.read())
+        self.assertEqual(content_type('jpeg'), 'image/jpeg')
+        self.assertEqual(content_type('tiff'), 'image/tiff')
+
+    def test_mapped_formats_can_be_mapped_back(self):
+        """Uncompressed TIFF and NPY outputs are memory-mappable; other modes are converted to L, RGB or RGBA."""
+        images = {'L': self.image.convert('L'), 'RGB': self.image, 'RGBA': self.image.convert('RGBA'),
+                  '1': self.image.convert('1'), 'P': self.image.convert('P')}
+        expected_modes = {'1': 'L', 'P': 'RGB'}
+        for output_format in ('tiff', 'npy'):
+            for mode, image in images.items():
+                with self.subTest(output_format=output_format, mode=mode):
+                    path = os.path.join(self.output_dir, 'out' + output_extension(output_format))
+                    write_image(image, path, output_format)
+                    frame = map_image(path)
+                    self.assertIsNotNone(frame)
+                    self.assertEqual(frame.mode, expected_modes.get(mode, mode))
+                    self.assertEqual(frame.image().tobytes(), image.convert(frame.mode).tobytes())
+                    del frame
+        # Compressed TIFFs are decoded by Pillow
+        path = os.path.join(self.output_dir, 'compact.tif')
+        write_image(self.image, path, 'tiff', 'compact')
+        self.assertIsNone(map_image(path))
+
+
+if __name__ == '__main__':
+    unittest.main()
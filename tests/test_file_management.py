@@ -1,12 +1,13 @@
 import os
 import sys
 import shutil
+import tempfile
 import unittest
 
 # Add the project root to the Python path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from file_management import move_images_to_subdirectory
+from file_management import ScanManifest, move_images_to_subdirectory, walk_images
 
 
 class TestFileManagement(unittest.TestCase):
@@ -41,6 +42,92 @@ class TestFileManagement(unittest.TestCase):
         # Check that the original file is gone
         self.assertFalse(os.path.exists("Hill Castle.png"))
 
+    def test_npy_files_are_not_moved(self):
+        """Arrays are inputs, but an .npy file next to the script is more likely unrelated data."""
+        with open("data.npy", 'wb'):
+            pass
+        try:
+            move_images_to_subdirectory(self.base_dir)
+            self.assertTrue(os.path.exists("data.npy"))
+            self.assertFalse(os.path.exists(os.path.join(self.base_dir, "data.npy")))
+        finally:
+            os.remove("data.npy")
+
+
+class TestWalkImages(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        for relative_path in ('b.png', 'a/x.JPG', 'a/deep/y.png', 'a/notes.txt', 'thumbs/t.png', 'c/z.webp'):
+            self.touch(relative_path)
+        self.manifest_path = os.path.join(tempfile.mkdtemp(), 'manifest.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        shutil.rmtree(os.path.dirname(self.manifest_path))
+
+    def touch(self, relative_path):
+        path = os.path.join(self.root, *relative_path.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb'):
+            pass
+
+    def walk(self, **kwargs):
+        return [relative_path for relative_path, _ in walk_images(self.root, **kwargs)]
+
+    def test_finds_images_recursively_in_order(self):
+        """Every image below the root is found, depth first in sorted order, with its relative path."""
+        self.assertEqual(self.walk(), ['b.png', 'a/x.JPG', 'a/deep/y.png', 'c/z.webp', 'thumbs/t.png'])
+        path = dict(walk_images(self.root))['a/deep/y.png']
+        self.assertEqual(os.path.normpath(path), os.path.join(self.root, 'a', 'deep', 'y.png'))
+
+    def test_include_exclude_and_extensions(self):
+        self.assertEqual(self.walk(exclude=['thumbs', '*.webp']), ['b.png', 'a/x.JPG', 'a/deep/y.png'])
+        self.assertEqual(self.walk(include=['a/*']), ['a/x.JPG', 'a/deep/y.png'])
+        self.assertEqual(self.walk(include=['*.png'], exclude=['a/deep']), ['b.png', 'thumbs/t.png'])
+        self.assertEqual(self.walk(extensions=['.jpg']), ['a/x.JPG'])
+        self.touch('c/scan.npy')
+        self.assertEqual(self.walk(include=['c/*']), ['c/scan.npy', 'c/z.webp'])
+
+    def test_walk_is_lazy(self):
+        """The first image is available before the rest of the tree is scanned."""
+        images = walk_images(self.root)
+        self.assertEqual(next(images)[0], 'b.png')
+        shutil.rmtree(os.path.join(self.root, 'c'))
+        self.assertEqual([relative_path for relative_path, _ in images], ['a/x.JPG', 'a/deep/y.png', 'thumbs/t.png'])
+
+    def test_symlinked_directories_are_not_followed(self):
+        try:
+            os.symlink(self.root, os.path.join(self.root, 'a', 'loop'))
+        except (OSError, NotImplementedError):
+            self.skipTest('symbolic links are not available')
+        self.assertEqual(len(self.walk()), 5)
+
+    def test_manifest_rescan_only_lists_changed_directories(self):
+        """A rescan reuses the listing of unchanged directories and still finds new files."""
+        first = ScanManifest(self.manifest_path, self.root)
+        expected = self.walk(manifest=first)
+        self.assertEqual(first.counts, {'listed': 5, 'reused': 0})
+
+        second = ScanManifest(self.manifest_path, self.root)
+        self.assertEqual(self.walk(manifest=second), expected)
+        self.assertEqual(second.counts, {'listed': 0, 'reused': 5})
+
+        self.touch('a/deep/new.png')
+        os.utime(os.path.join(self.root, 'a', 'deep'), ns=(0, 1))
+        third = ScanManifest(self.manifest_path, self.root)
+        self.assertIn('a/deep/new.png', self.walk(manifest=third))
+        self.assertEqual(third.counts, {'listed': 1, 'reused': 4})
+
+    def test_manifest_of_another_root_is_ignored(self):
+        self.walk(manifest=ScanManifest(self.manifest_path, self.root))
+        other_root = tempfile.mkdtemp()
+        try:
+            manifest = ScanManifest(self.manifest_path, other_root)
+            self.assertEqual(manifest.directories, {})
+        finally:
+            shutil.rmtree(other_root)
+
 
 if __name__ == '__main__':
     unittest.main()
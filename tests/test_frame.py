@@ -0,0 +1,87 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+from PIL import Image
+
+# Add the project root to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from frame import Frame, as_frame
+
+
+class TestFrame(unittest.TestCase):
+
+    def test_grayscale_array_shares_memory_with_image(self):
+        array = np.zeros((4, 6), dtype=np.uint8)
+        frame = Frame(array=array)
+        self.assertEqual((frame.mode, frame.size, frame.has_image), ('L', (6, 4), False))
+        image = frame.image()
+        array[1, 2] = 200
+        self.assertEqual(image.getpixel((2, 1)), 200)
+        self.assertIs(frame.array(), array)
+        self.assertIs(frame.array('L'), array)
+
+    def test_array_from_image(self):
+        image = Image.linear_gradient('L').resize((16, 8)).convert('RGB')
+        frame = as_frame(image)
+        self.assertIs(as_frame(frame), frame)
+        self.assertIs(frame.image(), image)
+        self.assertEqual(frame.array().shape, (8, 16, 3))
+        self.assertIs(frame.array(), frame.array())
+        np.testing.assert_array_equal(frame.array('L'), np.array(image.convert('L')))
+
+    def test_rgba_and_rgb_arrays(self):
+        rgba = np.arange(2 * 3 * 4, dtype=np.uint8).reshape(2, 3, 4)
+        self.assertEqual(Frame(array=rgba).image().tobytes(), rgba.tobytes())
+        self.assertEqual(Frame(array=rgba[..., :3].copy()).image().mode, 'RGB')
+
+    def test_derived_planes_are_computed_once(self):
+        image = Image.linear_gradient('L').resize((16, 8)).convert('RGBA')
+        image.putalpha(77)
+        frame = as_frame(image)
+        calls = []
+        self.assertEqual(frame.derived('x', lambda f: calls.append(f) or 42), 42)
+        self.assertEqual(frame.derived('x', lambda f: calls.append(f) or 43), 42)
+        self.assertEqual(calls, [frame])
+        self.assertIs(frame.luminance(), frame.array('L'))
+        self.assertIs(frame.alpha(), frame.alpha())
+        self.assertEqual(frame.alpha().shape, (8, 16))
+        self.assertTrue((frame.alpha() == 77).all())
+        self.assertIsNone(Frame(array=np.zeros((2, 2), dtype=np.uint8)).alpha())
+
+    def test_grey_mean(self):
+        array = np.array([[0, 1], [2, 2]], dtype=np.uint8)
+        self.assertEqual(Frame(array=array).grey_mean(), 1)
+        image = Image.linear_gradient('L').resize((31, 7)).convert('RGB')
+        histogram = np.array(image.convert('L').histogram())
+        expected = int(int((histogram * np.arange(256)).sum()) / (31 * 7) + 0.5)
+        self.assertEqual(as_frame(image).grey_mean(), expected)
+
+    def test_allocated_bytes(self):
+        frame = Frame(Image.new('RGB', (10, 10)))
+        # Pillow stores RGB pixels in four bytes
+        self.assertEqual(frame.allocated_bytes(), 400)
+        frame.array('L')
+        # The converted image and the array copied from it
+        self.assertEqual(frame.allocated_bytes(), 600)
+        frame.array('L')
+        self.assertEqual(frame.allocated_bytes(), 600)
+        # 'L' arrays become images without a copy, 'RGB' arrays with one
+        grey = Frame(array=np.zeros((10, 10), dtype=np.uint8))
+        grey.image()
+        self.assertEqual(grey.allocated_bytes(), 100)
+        colour = Frame(array=np.zeros((10, 10, 3), dtype=np.uint8))
+        colour.image()
+        self.assertEqual(colour.allocated_bytes(), 700)
+
+    def test_needs_image_or_array(self):
+        with self.assertRaises(ValueError):
+            Frame()
+        with self.assertRaises(ValueError):
+            Frame(image=Image.new('L', (2, 2)), array=np.zeros((2, 2), dtype=np.uint8))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,15 @@
 import unittest
 import os
 import random
-from PIL import Image
-from image_filters import (invert_colors, grayscale, edge_detection,
+from types import SimpleNamespace
+from unittest.mock import patch
+from PIL import Image, ImageEnhance
+from image_filters import (invert_colors, grayscale, edge_detection, edge_map,
                            adjust_brightness, adjust_contrast, adjust_saturation)
 import numpy as np
+from frame import Frame
+from processing import apply_operations
+from profiling import Profiler
 
 
 class TestImageFilters(unittest.TestCase):
@@ -126,6 +131,53 @@ class TestEdgeDetection(unittest.TestCase):
         # So we expect the rest of the image to be black.
         self.assertEqual(np.sum(edge_array == 255), height)
 
+    def test_kovalevsky_matches_reference_loop(self):
+        """The vectorized Kovalevsky scan must match the original per-pixel loop exactly."""
+        def reference(image, threshold):
+            img_array = np.array(image.convert('RGB'), dtype=np.int16)
+            height, width, _ = img_array.shape
+            if height < 6 or width < 6:
+                return np.zeros((height, width), dtype=np.uint8)
+            edge_map = np.zeros((height, width), dtype=np.uint8)
+            for y in range(height):
+                for x in range(width - 5):
+                    diffs = np.abs(img_array[y, x + 1:x + 6] - img_array[y, x:x + 5]).sum(axis=1)
+                    if diffs[2] > threshold and all(diffs[2] > diffs[i] for i in (0, 1, 3, 4)):
+                        edge_map[y, x + 3] = 255
+            for x in range(width):
+                for y in range(height - 5):
+                    diffs = np.abs(img_array[y + 1:y + 6, x] - img_array[y:y + 5, x]).sum(axis=1)
+                    if diffs[2] > threshold and all(diffs[2] > diffs[i] for i in (0, 1, 3, 4)):
+                        edge_map[y + 3, x] = 255
+            return edge_map
+
+        rng = np.random.default_rng(1)
+        for width, height in [(6, 6), (7, 13), (31, 9), (40, 40), (5, 20), (20, 5)]:
+            for threshold in (0, 50, 200):
+                with self.subTest(size=(width, height), threshold=threshold):
+                    array = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+                    img = Image.fromarray(array, 'RGB')
+                    edge_img = edge_detection(img, 'kovalevsky', threshold=threshold)
+                    self.assertEqual(edge_img.size, (width, height))
+                    np.testing.assert_array_equal(np.array(edge_img), reference(img, threshold))
+                    # Grayscale input is scanned as one channel
+                    gray = img.convert('L')
+                    np.testing.assert_array_equal(np.array(edge_detection(gray, 'kovalevsky', threshold=threshold)),
+                                                  reference(gray, threshold))
+
+    def test_all_methods_from_one_frame(self):
+        image = self.image.convert('RGBA')
+        frame = Frame(image)
+        with patch.object(Frame, 'array', autospec=True, side_effect=Frame.array) as array:
+            edges = edge_map(frame, 'all', 40)
+        # One grayscale conversion for Sobel and Canny, and the RGB array for Kovalevsky
+        self.assertEqual(sorted(call.args[1] for call in array.call_args_list if call.args[1] != 'RGBA'),
+                         ['L', 'L', 'RGB'])
+        self.assertEqual(edges.shape, (self.height, self.width, 3))
+        for band, method in enumerate(('sobel', 'canny', 'kovalevsky')):
+            np.testing.assert_array_equal(edges[..., band], edge_map(image, method, 40))
+        self.assertEqual(edge_detection(image, 'all', 40).mode, 'RGB')
+
 
 class TestImageAdjustments(unittest.TestCase):
     def setUp(self):
@@ -257,3 +309,45 @@ class TestImageAdjustments(unittest.TestCase):
         # Check that the alpha channel is preserved
         _, _, _, new_alpha = saturated_image.split()
         self.assertEqual(list(new_alpha.getdata()), list(alpha.getdata()))
+
+    def test_frame_input_matches_image_input(self):
+        # Frames use their cached luminance, alpha and mean grey level instead of deriving them again
+        rgba_image = self.test_image.convert("RGBA")
+        rgba_image.putalpha(Image.linear_gradient('L').resize(rgba_image.size))
+        for image in (self.test_image, rgba_image, self.test_image.convert('L'), self.test_image.convert('P')):
+            for function in (adjust_contrast, adjust_saturation):
+                for value in (-60, 0, 35):
+                    with self.subTest(mode=image.mode, function=function.__name__, value=value):
+                        expected = function(image, value)
+                        output = function(Frame(image), value)
+                        if isinstance(output, Frame):
+                            self.assertIs(expected, image)
+                            output = output.image()
+                        self.assertEqual(output.mode, expected.mode)
+                        self.assertEqual(output.tobytes(), expected.tobytes())
+        # The saturation of a frame matches ImageEnhance exactly
+        self.assertEqual(adjust_saturation(Frame(rgba_image), 40).tobytes(),
+                         ImageEnhance.Color(rgba_image).enhance(1.4).tobytes())
+
+    def test_rgba_adjustments_allocate_one_image(self):
+        # RGBA adjustments keep alpha without splitting and merging the bands
+        rgba_image = self.test_image.convert("RGBA")
+        rgba_image.putalpha(Image.linear_gradient('L').resize(rgba_image.size))
+        expected = {
+            adjust_brightness: ImageEnhance.Brightness(rgba_image).enhance(1.3),
+            adjust_contrast: ImageEnhance.Contrast(rgba_image).enhance(1.3),
+        }
+        profiler = Profiler()
+        try:
+            for adjust, expected_image in expected.items():
+                args = SimpleNamespace(profiler=profiler, fuse=False)
+                dest = adjust.__name__[len('adjust_'):]
+                adjusted = apply_operations(rgba_image, 'rgba', [{'dest': dest, 'values': [30]}], args)
+                self.assertEqual(adjusted.tobytes(), expected_image.tobytes())
+        finally:
+            profiler.stop()
+        # The result, plus for contrast the grayscale plane its mean grey level is measured on
+        # (converted by Pillow, then copied into an array)
+        allocated = {span['name']: span['allocated_bytes'] for span in profiler.spans}
+        self.assertEqual(allocated, {'--brightness 30': 100 * 100 * 4, '--contrast 30': 100 * 100 * 6})
+
@@ -0,0 +1,104 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import tifffile
+from PIL import Image
+
+# Add the project root to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from frame import Frame
+from image_io import decode_image, is_image_path, load_image, map_image, open_image
+
+
+class TestLoadImage(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_load_single_frame(self):
+        """A single-frame file is fully decoded and usable after loading."""
+        path = os.path.join(self.temp_dir, 'red.png')
+        Image.new('RGB', (5, 3), (255, 0, 0)).save(path)
+        image = load_image(path)
+        self.assertEqual(image.size, (5, 3))
+        self.assertEqual(image.getpixel((2, 1)), (255, 0, 0))
+
+    def test_load_multi_frame_keeps_first_frame(self):
+        """Multi-frame files return the first frame and do not keep the file open."""
+        path = os.path.join(self.temp_dir, 'anim.gif')
+        frames = [Image.new('L', (4, 4), value) for value in (10, 200)]
+        frames[0].save(path, save_all=True, append_images=frames[1:])
+        image = load_image(path)
+        self.assertEqual(image.size, (4, 4))
+        self.assertFalse(hasattr(image, 'fp') and image.fp)
+
+    def test_reduced_jpeg_decode(self):
+        """A JPEG is decoded at the smallest DCT scale that is still at least the requested size."""
+        path = os.path.join(self.temp_dir, 'large.jpg')
+        Image.new('RGB', (800, 600), (0, 128, 255)).save(path)
+        self.assertEqual(load_image(path, reduce_to=(300, 200)).size, (400, 300))
+        self.assertEqual(load_image(path, reduce_to=(100, 75)).size, (100, 75))
+        self.assertEqual(load_image(path, reduce_to=(500, 100)).size, (800, 600))
+
+    def test_reduce_is_ignored_for_other_formats(self):
+        path = os.path.join(self.temp_dir, 'large.png')
+        Image.new('RGB', (800, 600)).save(path)
+        self.assertEqual(load_image(path, reduce_to=(100, 75)).size, (800, 600))
+
+    def test_open_image_defers_decoding(self):
+        """The header is available after open_image; decode_image loads and releases the file."""
+        path = os.path.join(self.temp_dir, 'red.png')
+        Image.new('RGB', (5, 3), (255, 0, 0)).save(path)
+        image = open_image(path)
+        self.assertEqual((image.size, image.mode), ((5, 3), 'RGB'))
+        image = decode_image(image)
+        self.assertEqual(image.getpixel((0, 0)), (255, 0, 0))
+
+    def test_npy_and_uncompressed_tiff_are_memory_mapped(self):
+        """open_image returns a frame over a read-only map of .npy files and uncompressed 8-bit TIFFs."""
+        rgb = np.arange(4 * 6 * 3, dtype=np.uint8).reshape(4, 6, 3)
+        np.save(os.path.join(self.temp_dir, 'rgb.npy'), rgb)
+        tifffile.imwrite(os.path.join(self.temp_dir, 'gray.tif'), rgb[..., 0])
+        tifffile.imwrite(os.path.join(self.temp_dir, 'rgb.tif'), rgb, photometric='rgb')
+        for name, mode in (('rgb.npy', 'RGB'), ('gray.tif', 'L'), ('rgb.tif', 'RGB')):
+            with self.subTest(name=name):
+                frame = open_image(os.path.join(self.temp_dir, name))
+                self.assertIsInstance(frame, Frame)
+                self.assertEqual((frame.mode, frame.size), (mode, (6, 4)))
+                array = frame.array()
+                self.assertIsInstance(array, np.memmap)
+                self.assertFalse(array.flags.writeable)
+                np.testing.assert_array_equal(array, rgb if mode == 'RGB' else rgb[..., 0])
+                self.assertEqual(load_image(os.path.join(self.temp_dir, name)).tobytes(), array.tobytes())
+                del frame, array
+
+    def test_unmappable_files(self):
+        """Compressed and 16-bit TIFFs are left to Pillow; .npy files that are not images are rejected."""
+        compressed = os.path.join(self.temp_dir, 'compressed.tif')
+        tifffile.imwrite(compressed, np.zeros((4, 6), np.uint8), compression='zlib')
+        wide = os.path.join(self.temp_dir, 'wide.tif')
+        tifffile.imwrite(wide, np.zeros((4, 6), np.uint16))
+        for path in (compressed, wide):
+            self.assertIsNone(map_image(path))
+            self.assertNotIsInstance(open_image(path), Frame)
+        for array in (np.zeros((4, 6), np.float32), np.zeros((4, 6, 2), np.uint8)):
+            path = os.path.join(self.temp_dir, 'bad.npy')
+            np.save(path, array)
+            with self.assertRaises(ValueError):
+                map_image(path)
+
+    def test_is_image_path(self):
+        self.assertTrue(is_image_path('a.png'))
+        self.assertFalse(is_image_path(Image.new('L', (1, 1))))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,5 @@
 import os
+import subprocess
 import sys
 import unittest
 from unittest.mock import patch, MagicMock
@@ -46,8 +47,8 @@ class TestMain(unittest.TestCase):
         # Mock os.path.isfile to always return True for the dummy paths
         mock_isfile.return_value = True
 
-        # Image.open is called from within main.py, so patching it there is correct
-        with patch('main.Image.open', MagicMock(return_value=Image.new('RGB', (10, 10)))):
+        # The files are opened by image_io, so patch Image.open where it looks it up
+        with patch('image_io.Image.open', MagicMock(return_value=Image.new('RGB', (10, 10)))):
             with patch.object(sys, 'argv', ['main.py', '-bg', '*']):
                 main()
 
@@ -87,6 +88,15 @@ class TestMain(unittest.TestCase):
         if os.path.exists(output_image_path):
             os.remove(output_image_path)
 
+    def test_heavy_libraries_are_not_imported_at_startup(self):
+        """rembg and scikit-image are only imported by the operations that use them."""
+        root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+        code = ("import sys, main, processing; from image_filters import edge_detection; "
+                "from PIL import Image; edge_detection(Image.new('RGB', (8, 8)), 'kovalevsky'); "
+                "print(sorted(name for name in ('rembg', 'onnxruntime', 'skimage') if name in sys.modules))")
+        completed = subprocess.run([sys.executable, '-c', code], cwd=root, capture_output=True, text=True, check=True)
+        self.assertEqual(completed.stdout.strip(), '[]')
+
 
 if __name__ == '__main__':
     unittest.main()
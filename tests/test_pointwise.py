@@ -0,0 +1,105 @@
+import os
+import sys
+import random
+import unittest
+
+import numpy as np
+from PIL import Image
+
+# Add the project root to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from image_filters import adjust_brightness, adjust_contrast, adjust_saturation, grayscale, invert_colors
+from pointwise import FUSED_DEST, FUSION_TOLERANCE, apply_pointwise, fuse_pointwise_operations
+
+SEQUENTIAL = {
+    'invert': lambda image, values: invert_colors(image),
+    'grayscale': lambda image, values: grayscale(image),
+    'brightness': lambda image, values: adjust_brightness(image, values[0]),
+    'contrast': lambda image, values: adjust_contrast(image, values[0]),
+    'saturation': lambda image, values: adjust_saturation(image, values[0]),
+}
+
+
+def run_sequentially(image, operations):
+    for operation in operations:
+        image = SEQUENTIAL[operation['dest']](image, operation.get('values', []))
+    return image
+
+
+def op(dest, *values):
+    return {'dest': dest, 'values': list(values)}
+
+
+class TestFusePointwiseOperations(unittest.TestCase):
+
+    def test_runs_are_fused(self):
+        """Consecutive point-wise operations are grouped; others split the runs."""
+        operations = [op('invert'), op('brightness', 20), op('flip', 'vertical'), op('contrast', -10),
+                      op('scale', '0.5x'), op('saturation', 30), op('grayscale')]
+        fused = fuse_pointwise_operations(operations)
+        self.assertEqual([o['dest'] for o in fused], [FUSED_DEST, 'flip', 'contrast', 'scale', FUSED_DEST])
+        self.assertEqual(fused[0]['values'], operations[:2])
+        self.assertEqual(fused[-1]['values'], operations[-2:])
+
+    def test_no_runs(self):
+        operations = [op('flip', 'both'), op('invert')]
+        self.assertEqual(fuse_pointwise_operations(operations), operations)
+
+
+class TestApplyPointwise(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.rgba = Image.fromarray(rng.integers(0, 256, (40, 50, 4), dtype=np.uint8), 'RGBA')
+
+    def assert_matches_sequential(self, image, operations, tolerance=0):
+        fused = apply_pointwise(image, operations)
+        expected = run_sequentially(image, operations)
+        self.assertEqual(fused.mode, expected.mode)
+        self.assertEqual(fused.size, expected.size)
+        difference = np.abs(np.asarray(fused, dtype=np.int16) - np.asarray(expected, dtype=np.int16))
+        self.assertLessEqual(int(difference.max()), tolerance)
+
+    def test_exact_without_estimated_contrast(self):
+        """Chains without a contrast step after another remap match sequential output exactly."""
+        operations = [op('brightness', 20), op('saturation', 30), op('brightness', -40), op('saturation', -70)]
+        for mode in ('RGB', 'RGBA', 'L'):
+            with self.subTest(mode=mode):
+                self.assert_matches_sequential(self.rgba.convert(mode), operations)
+        self.assert_matches_sequential(self.rgba.convert('RGB'), [op('contrast', 40), op('invert')])
+        self.assert_matches_sequential(self.rgba.convert('L'), [op('invert'), op('contrast', 40), op('grayscale')])
+
+    def test_alpha_is_untouched(self):
+        """RGBA alpha survives brightness, contrast and saturation."""
+        fused = apply_pointwise(self.rgba, [op('brightness', 20), op('contrast', -10), op('saturation', 30)])
+        self.assertEqual(fused.mode, 'RGBA')
+        self.assertEqual(fused.getchannel('A').tobytes(), self.rgba.getchannel('A').tobytes())
+
+    def test_random_chains_within_tolerance(self):
+        """Random chains stay within the documented tolerance of sequential execution."""
+        rng = random.Random(0)
+        for _ in range(200):
+            mode = rng.choice(['RGB', 'RGBA', 'L'])
+            operations = []
+            for _ in range(rng.randint(2, 5)):
+                dest = rng.choice(list(SEQUENTIAL))
+                operations.append(op(dest) if dest in ('invert', 'grayscale') else op(dest, rng.randint(-100, 100)))
+            with self.subTest(mode=mode, operations=operations):
+                image = self.rgba if mode == 'RGBA' else self.rgba.convert(mode)
+                self.assert_matches_sequential(image, operations, tolerance=FUSION_TOLERANCE)
+
+    def test_other_modes_fall_back(self):
+        """Modes without a fused path (e.g. palette images) run step by step."""
+        palette = self.rgba.convert('RGB').convert('P')
+        self.assert_matches_sequential(palette, [op('brightness', 10), op('invert')])
+
+    def test_validation_matches_filters(self):
+        with self.assertRaises(ValueError):
+            apply_pointwise(self.rgba, [op('invert'), op('brightness', 101)])
+        with self.assertRaises(TypeError):
+            apply_pointwise(self.rgba, [op('invert'), op('contrast', 1.5)])
+
+
+if __name__ == '__main__':
+    unittest.main()
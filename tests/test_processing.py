@@ -0,0 +1,325 @@
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import numpy as np
+from PIL import Image, ImageChops
+
+# Add the project root to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import processing
+from image_filters import edge_detection
+from processing import process_images_and_save
+from remove_background import session_pool
+
+
+class TestProcessImagesAndSave(unittest.TestCase):
+
+    def setUp(self):
+        """Run each test in a temporary working directory so Output/ stays isolated."""
+        self.original_cwd = os.getcwd()
+        self.work_dir = tempfile.mkdtemp()
+        os.chdir(self.work_dir)
+        self.images_data = [[f'image{i}.png', Image.new('RGB', (8 + i, 8), (i * 20, 0, 0))] for i in range(6)]
+
+    def tearDown(self):
+        os.chdir(self.original_cwd)
+        shutil.rmtree(self.work_dir)
+
+    def test_parallel_results_in_input_order(self):
+        """Results come back in input order and match a sequential run."""
+        operations = [{'dest': 'invert', 'values': []}, {'dest': 'flip', 'values': ['horizontal']}]
+        results = process_images_and_save(self.images_data, operations, SimpleNamespace(jobs=4))
+        self.assertEqual([r['name'] for r in results], [name for name, _ in self.images_data])
+        parallel_outputs = [Image.open(r['output_path']).tobytes() for r in results]
+
+        sequential = process_images_and_save(self.images_data, operations, SimpleNamespace(jobs=1))
+        self.assertEqual(parallel_outputs, [Image.open(r['output_path']).tobytes() for r in sequential])
+
+    @patch('remove_background.new_session', side_effect=lambda name: object())
+    def test_overlapping_runs_share_background_sessions(self, mock_new_session):
+        """A run that ends keeps the models loaded for a run that is still open."""
+        self.addCleanup(session_pool.close)
+        first_args, first_cache = processing.open_run(SimpleNamespace())
+        second_args, second_cache = processing.open_run(SimpleNamespace())
+        session = session_pool.get('u2net')
+        processing.close_run(first_args, first_cache)
+        self.assertEqual(session_pool.loaded_models(), ['u2net'])
+        self.assertIs(session_pool.get('u2net'), session)
+        processing.close_run(second_args, second_cache)
+        self.assertEqual(session_pool.loaded_models(), [])
+        mock_new_session.assert_called_once_with('u2net')
+
+    def test_failure_does_not_cancel_other_images(self):
+        """An exception in one image is reported for that image only."""
+        original_flip = processing.operation_handlers['flip']
+
+        def flaky_flip(image, image_name, values, args):
+            if image_name == 'image2.png':
+                raise RuntimeError('boom')
+            return original_flip(image, image_name, values, args)
+
+        with patch.dict(processing.operation_handlers, {'flip': flaky_flip}):
+            results = process_images_and_save(self.images_data, [{'dest': 'flip', 'values': ['vertical']}],
+                                              SimpleNamespace(jobs=3))
+        errors = {r['name']: r['error'] for r in results}
+        self.assertIsInstance(errors.pop('image2.png'), RuntimeError)
+        self.assertTrue(all(error is None for error in errors.values()))
+        self.assertEqual(len(os.listdir('Output')), 5)
+
+    def test_fused_and_unfused_runs_agree(self):
+        """--no-fuse runs the point-wise steps one by one with the same result."""
+        operations = [{'dest': 'brightness', 'values': [20]}, {'dest': 'saturation', 'values': [30]},
+                      {'dest': 'invert', 'values': []}]
+        fused = process_images_and_save(self.images_data, operations, SimpleNamespace(jobs=1))
+        fused_outputs = [Image.open(r['output_path']).tobytes() for r in fused]
+        unfused = process_images_and_save(self.images_data, operations, SimpleNamespace(jobs=1, fuse=False))
+        self.assertEqual(fused_outputs, [Image.open(r['output_path']).tobytes() for r in unfused])
+
+    def test_several_formats_from_one_run(self):
+        """Every format is written from one processing pass; jpeg skips transparent images."""
+        images_data = [['opaque.png', Image.new('RGB', (8, 8), (200, 10, 10))],
+                       ['clear.png', Image.new('RGBA', (8, 8), (200, 10, 10, 0))]]
+        with patch.object(processing, 'apply_operations', wraps=processing.apply_operations) as apply_operations:
+            results = process_images_and_save(images_data, [{'dest': 'flip', 'values': ['horizontal']}],
+                                              SimpleNamespace(jobs=1, formats=['png', 'webp', 'jpeg']))
+        self.assertEqual(apply_operations.call_count, 2)
+        self.assertEqual([output['format'] for output in results[0]['outputs']], ['png', 'webp', 'jpeg'])
+        self.assertEqual(results[0]['output_path'], os.path.join('Output', 'opaque.png'))
+        self.assertIsNone(results[1]['error'])
+        self.assertEqual([output['format'] for output in results[1]['outputs']], ['png', 'webp'])
+        self.assertEqual([output_format for output_format, _ in results[1]['skipped']], ['jpeg'])
+        self.assertEqual(sorted(os.listdir('Output')), ['clear.png', 'clear.webp', 'opaque.jpg', 'opaque.png',
+                                                        'opaque.webp'])
+
+    def test_reduced_decode_for_leading_downscale(self):
+        """A chain that starts by shrinking a JPEG decodes it at reduced size with the same output size."""
+        path = os.path.join(self.work_dir, 'photo.jpg')
+        Image.linear_gradient('L').resize((1024, 768)).convert('RGB').save(path, quality=95)
+        for scale in (['0.2x'], ['300px', '300px']):
+            with self.subTest(scale=scale):
+                operations = [{'dest': 'invert', 'values': []}, {'dest': 'scale', 'values': scale}]
+                args = SimpleNamespace(jobs=1, resample='bilinear')
+                with patch.object(processing, 'decode_image', wraps=processing.decode_image) as decode:
+                    drafted = process_images_and_save([('photo.jpg', path)], operations, args)
+                self.assertIsNotNone(decode.call_args.kwargs['reduce_to'])
+                with Image.open(drafted[0]['output_path']) as output:
+                    drafted_output = output.convert('L')
+                args.draft = False
+                with patch.object(processing, 'decode_image', wraps=processing.decode_image) as decode:
+                    full = process_images_and_save([('photo.jpg', path)], operations, args)
+                self.assertIsNone(decode.call_args.kwargs['reduce_to'])
+                with Image.open(full[0]['output_path']) as output:
+                    full_output = output.convert('L')
+                self.assertEqual(drafted_output.size, full_output.size)
+                difference = ImageChops.difference(drafted_output, full_output)
+                self.assertLessEqual(max(difference.getextrema()), 8)
+
+    def test_array_steps_do_not_round_trip_through_pil(self):
+        """Consecutive edge detections pass the array on; the output matches running them on images."""
+        image = Image.effect_mandelbrot((64, 48), (-2, -1.5, 1, 1.5), 50).convert('RGB')
+        seen = []
+        original = processing.operation_handlers['edge_detection']
+
+        def spy(frame, image_name, values, args):
+            seen.append(frame.has_image)
+            return original(frame, image_name, values, args)
+        spy.accepts_frame = True
+
+        operations = [{'dest': 'edge_detection', 'values': ['sobel']},
+                      {'dest': 'edge_detection', 'values': ['kovalevsky']}]
+        with patch.dict(processing.operation_handlers, {'edge_detection': spy}):
+            output = processing.apply_operations(image, 'image.png', operations, SimpleNamespace(threshold=20))
+        self.assertEqual(seen, [True, False])
+        expected = edge_detection(edge_detection(image, 'sobel'), 'kovalevsky', 20)
+        self.assertEqual(output.tobytes(), expected.tobytes())
+
+    def test_missing_jobs_attribute_runs_sequentially(self):
+        """Callers that do not set jobs still work."""
+        results = process_images_and_save(self.images_data[:2], [], SimpleNamespace())
+        self.assertEqual([r['error'] for r in results], [None, None])
+
+    def _write_paths(self):
+        paths = []
+        for name, image in self.images_data:
+            path = os.path.join(self.work_dir, name)
+            image.save(path)
+            paths.append((name, path))
+        return paths
+
+    def test_streams_paths_lazily(self):
+        """Paths are loaded one at a time; the input generator is not drained up front."""
+        paths = self._write_paths()
+        events = []
+
+        def items():
+            for name, path in paths:
+                events.append(('yield', name))
+                yield name, path
+
+        original_save = processing.os.replace
+
+        def recording_replace(src, dst):
+            events.append(('saved', os.path.basename(dst)))
+            return original_save(src, dst)
+
+        with patch('processing.os.replace', recording_replace):
+            results = process_images_and_save(items(), [{'dest': 'grayscale', 'values': []}],
+                                              SimpleNamespace(jobs=1, overlap=False))
+        self.assertEqual([r['error'] for r in results], [None] * len(paths))
+        # Each image is saved before the next one is pulled from the generator.
+        self.assertEqual(events[:4], [('yield', 'image0.png'), ('saved', 'image0.png'),
+                                      ('yield', 'image1.png'), ('saved', 'image1.png')])
+        with Image.open(results[0]['output_path']) as output:
+            self.assertEqual(output.mode, 'L')
+
+    def test_overlapped_stages_read_ahead_boundedly(self):
+        """With overlap the next images are loaded while one is processed, but only a few ahead."""
+        paths = self._write_paths()
+        events = []
+        release = threading.Event()
+        original_invert = processing.operation_handlers['invert']
+
+        def items():
+            for name, path in paths:
+                events.append(('yield', name))
+                yield name, path
+
+        def slow_invert(image, image_name, values, args):
+            if image_name == 'image0.png':
+                # Hold the first image in the process stage until the loader has run ahead
+                release.wait(5)
+            events.append(('processed', image_name))
+            return original_invert(image, image_name, values, args)
+
+        def release_when_loader_blocks():
+            while len([event for event in events if event[0] == 'yield']) < 3:
+                time.sleep(0.001)
+            time.sleep(0.05)
+            release.set()
+
+        helper = threading.Thread(target=release_when_loader_blocks)
+        helper.start()
+        with patch.dict(processing.operation_handlers, {'invert': slow_invert}):
+            results = process_images_and_save(items(), [{'dest': 'invert', 'values': []}], SimpleNamespace(jobs=1))
+        helper.join()
+        # image0 is being processed, image1 waits in the queue and image2 is held by the loader
+        self.assertEqual(events.index(('processed', 'image0.png')), 3)
+        self.assertEqual([r['name'] for r in results], [name for name, _ in paths])
+        self.assertTrue(all(r['error'] is None for r in results))
+
+        sequential = process_images_and_save(list(paths), [{'dest': 'invert', 'values': []}],
+                                             SimpleNamespace(jobs=1, overlap=False))
+        self.assertEqual([r['name'] for r in sequential], [r['name'] for r in results])
+
+    def test_generator_error_is_raised_with_overlap(self):
+        """An exception from the input iterable reaches the caller, after the images before it are saved."""
+        paths = self._write_paths()
+
+        def items():
+            yield paths[0]
+            raise RuntimeError('listing failed')
+
+        with self.assertRaises(RuntimeError):
+            process_images_and_save(items(), [], SimpleNamespace(jobs=1))
+        self.assertTrue(os.path.exists(os.path.join('Output', 'image0.png')))
+
+    def test_relative_names_mirror_directories(self):
+        """Images named with a relative path are written to the same directories under Output."""
+        images_data = [('trips/2024/beach.png', Image.new('RGB', (4, 4))),
+                       ('trips/beach.png', Image.new('RGB', (4, 4)))]
+        results = process_images_and_save(images_data, [], SimpleNamespace(jobs=1))
+        self.assertEqual([r['output_path'] for r in results], [os.path.join('Output', 'trips', '2024', 'beach.png'),
+                                                               os.path.join('Output', 'trips', 'beach.png')])
+        self.assertTrue(all(os.path.exists(r['output_path']) for r in results))
+
+    def test_memory_mapped_input_is_tiled_without_decoding(self):
+        """An .npy input is never decoded in full: its tileable steps run in bands without --tiled."""
+        source = Image.linear_gradient('L').resize((40, 30)).convert('RGB')
+        path = os.path.join(self.work_dir, 'scan.npy')
+        np.save(path, np.asarray(source))
+        operations = [{'dest': 'invert', 'values': []}, {'dest': 'flip', 'values': ['vertical']},
+                      {'dest': 'contrast', 'values': [20]}]
+        args = SimpleNamespace(jobs=1, formats=['npy', 'png'])
+        with patch.object(processing, 'decode_image') as decode_image, \
+                patch.object(processing, 'run_tiled', wraps=processing.run_tiled) as run_tiled:
+            results = process_images_and_save([('scan.npy', path)], operations, args)
+        decode_image.assert_not_called()
+        self.assertEqual(run_tiled.call_args.args[3], processing.DEFAULT_TILE_ROWS)
+        self.assertIsNone(results[0]['error'])
+        expected = processing.apply_operations(source, 'scan', operations, args)
+        self.assertEqual(np.load(os.path.join('Output', 'scan.npy')).tobytes(), expected.tobytes())
+        with Image.open(os.path.join('Output', 'scan.png')) as output:
+            self.assertEqual(output.tobytes(), expected.tobytes())
+
+    def test_background_removal_batching_is_set_up_per_run(self):
+        """With bg_batch the handler gets the run's batching session, which is closed at the end."""
+        sessions = []
+        with patch.object(processing, 'BatchedSessions') as batched_sessions, \
+                patch.object(processing, 'remove_background',
+                             side_effect=lambda image, **kwargs: sessions.append(kwargs['session']) or image):
+            batched_sessions.return_value.counts = {'images': 6, 'runs': 2, 'seconds': 3.0}
+            process_images_and_save(self.images_data, [{'dest': 'remove_background', 'values': []}],
+                                    SimpleNamespace(jobs=3, bg_batch=3, bg_model='u2netp'))
+        batched_sessions.assert_called_once_with(3, processing.DEFAULT_BG_BATCH_WAIT)
+        batched_sessions.return_value.get.assert_called_with('u2netp')
+        self.assertEqual(sessions, [batched_sessions.return_value.get.return_value] * 6)
+        batched_sessions.return_value.close.assert_called_once_with()
+
+    def test_background_removal_proxy_size_is_passed_on(self):
+        calls = []
+        with patch.object(processing, 'remove_background',
+                          side_effect=lambda image, **kwargs: calls.append(kwargs) or image):
+            process_images_and_save(self.images_data[:1], [{'dest': 'remove_background', 'values': []}],
+                                    SimpleNamespace(jobs=1, bg_proxy=512))
+            process_images_and_save(self.images_data[:1], [{'dest': 'remove_background', 'values': []}],
+                                    SimpleNamespace(jobs=1))
+        self.assertEqual([call['proxy_size'] for call in calls], [512, None])
+
+    def test_unchanged_step_keeps_the_frame_and_its_planes(self):
+        frames = []
+
+        def probe(frame, image_name, values, args):
+            frames.append(frame)
+            frame.luminance()
+            return frame
+        probe.accepts_frame = True
+        operations = [{'dest': 'probe', 'values': []}, {'dest': 'brightness', 'values': [0]},
+                      {'dest': 'probe', 'values': []}, {'dest': 'invert', 'values': []},
+                      {'dest': 'probe', 'values': []}]
+        with patch.dict(processing.operation_handlers, {'probe': probe}):
+            processing.apply_operations(Image.new('RGB', (4, 4), 'red'), 'test', operations,
+                                        SimpleNamespace(fuse=False))
+        self.assertIs(frames[0], frames[1])
+        self.assertIsNot(frames[1], frames[2])
+
+    def test_all_edge_methods_in_one_step(self):
+        image = Image.linear_gradient('L').resize((40, 30)).convert('RGB')
+        output = processing.apply_operations(image, 'test', [{'dest': 'edge_detection', 'values': ['all']}],
+                                             SimpleNamespace(threshold=20))
+        self.assertEqual(output.mode, 'RGB')
+        for band, method in enumerate(('sobel', 'canny', 'kovalevsky')):
+            self.assertEqual(output.getchannel(band).tobytes(), edge_detection(image, method, 20).tobytes())
+
+    def test_unreadable_path_is_reported_per_image(self):
+        """A file that cannot be decoded fails on its own without stopping the batch."""
+        broken = os.path.join(self.work_dir, 'broken.png')
+        with open(broken, 'wb') as f:
+            f.write(b'not an image')
+        good = os.path.join(self.work_dir, 'good.png')
+        Image.new('RGB', (4, 4)).save(good)
+        results = process_images_and_save(iter([('broken.png', broken), ('good.png', good)]), [],
+                                          SimpleNamespace(jobs=2))
+        self.assertIsNotNone(results[0]['error'])
+        self.assertIsNone(results[1]['error'])
+
+
+if __name__ == '__main__':
+    unittest.main()
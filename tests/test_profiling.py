@@ -0,0 +1,134 @@
+import json
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import time
+import tracemalloc
+import unittest
+from types import SimpleNamespace
+
+from PIL import Image
+
+# Add the project root to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from processing import process_images_and_save
+from profiling import Profiler, buffer_bytes, image_bytes, trace_path
+
+
+class TestProfiler(unittest.TestCase):
+
+    def setUp(self):
+        """Run each test in a temporary working directory so Output/ stays isolated."""
+        self.original_cwd = os.getcwd()
+        self.work_dir = tempfile.mkdtemp()
+        os.chdir(self.work_dir)
+
+    def tearDown(self):
+        os.chdir(self.original_cwd)
+        shutil.rmtree(self.work_dir)
+
+    def test_profile_records_every_step(self):
+        images_data = [[f'image{i}.png', Image.new('RGB', (16, 12), (i * 40, 0, 0))] for i in range(3)]
+        operations = [{'dest': 'flip', 'values': ['horizontal']}, {'dest': 'edge_detection', 'values': ['sobel']}]
+        process_images_and_save(images_data, operations,
+                                SimpleNamespace(jobs=2, profile='run.json', formats=['png', 'webp']))
+        self.assertFalse(tracemalloc.is_tracing())
+
+        with open('run.json', encoding='utf-8') as f:
+            profile = json.load(f)
+        for name, _ in images_data:
+            steps = [span['name'] for span in profile['spans'] if span['image'] == name]
+            self.assertEqual(sorted(steps), sorted([name, '--flip horizontal', '--edge-detection sobel',
+                                                    'encode png', 'encode webp']))
+        flip = next(span for span in profile['spans'] if span['name'] == '--flip horizontal')
+        self.assertEqual(flip['output_bytes'], 16 * 12 * 3)
+        # Pillow stores RGB pixels in four bytes
+        self.assertEqual(flip['allocated_bytes'], 16 * 12 * 4)
+        self.assertEqual(profile['totals']['encode webp']['count'], 3)
+
+        with open(trace_path('run.json'), encoding='utf-8') as f:
+            events = json.load(f)['traceEvents']
+        self.assertEqual(len([event for event in events if event['ph'] == 'X']), len(profile['spans']))
+
+    def test_nested_span_keeps_enclosing_peak(self):
+        profiler = Profiler()
+        try:
+            with profiler.span('a.png', 'a.png', 'image'):
+                block = bytearray(4 * 1024 * 1024)
+                del block
+                with profiler.span('a.png', 'small step', 'operation'):
+                    pass
+        finally:
+            profiler.stop()
+        inner, outer = profiler.spans
+        self.assertLess(inner['peak_traced_bytes'], 1024 * 1024)
+        self.assertGreaterEqual(outer['peak_traced_bytes'], 4 * 1024 * 1024)
+
+    def test_sequential_run_records_span_peaks(self):
+        images_data = [[f'image{i}.png', Image.new('RGB', (16, 12))] for i in range(2)]
+        for settings, scope in (({'jobs': 1, 'overlap': False}, 'span'), ({'jobs': 1}, 'process'),
+                                ({'jobs': 2}, 'process')):
+            with self.subTest(settings=settings):
+                process_images_and_save(images_data, [{'dest': 'invert', 'values': []}],
+                                        SimpleNamespace(profile='run.json', **settings))
+                with open('run.json', encoding='utf-8') as f:
+                    profile = json.load(f)
+                self.assertEqual(profile['peak_scope'], scope)
+                self.assertEqual(profile['cpu_scope'], 'process' if scope == 'span' else 'thread')
+                field = 'peak_traced_bytes' if scope == 'span' else 'approx_process_peak_traced_bytes'
+                cpu_field = 'cpu_s' if scope == 'span' else 'thread_cpu_s'
+                self.assertTrue(all(field in span and cpu_field in span for span in profile['spans']))
+
+    def test_sequential_span_counts_cpu_of_other_threads(self):
+        def spin():
+            end = time.process_time() + 0.2
+            while time.process_time() < end:
+                pass
+
+        profiler = Profiler()
+        try:
+            with profiler.span('a.png', 'threaded step', 'operation'):
+                thread = threading.Thread(target=spin)
+                thread.start()
+                thread.join()
+        finally:
+            profiler.stop()
+        self.assertGreaterEqual(profiler.spans[0]['cpu_s'], 0.2)
+
+    def test_concurrent_spans_do_not_reset_each_others_peak(self):
+        profiler = Profiler(concurrent=True)
+        started, release = threading.Event(), threading.Event()
+
+        def other_thread():
+            with profiler.span('b.png', 'other step', 'operation'):
+                started.set()
+                release.wait()
+
+        thread = threading.Thread(target=other_thread)
+        try:
+            with profiler.span('a.png', 'big step', 'operation'):
+                block = bytearray(4 * 1024 * 1024)
+                del block
+                thread.start()
+                started.wait()
+            release.set()
+            thread.join()
+        finally:
+            profiler.stop()
+        big = next(span for span in profiler.spans if span['name'] == 'big step')
+        self.assertGreaterEqual(big['approx_process_peak_traced_bytes'], 4 * 1024 * 1024)
+        self.assertNotIn('peak_traced_bytes', big)
+
+    def test_helpers(self):
+        self.assertEqual(trace_path(os.path.join('out', 'profile.json')), os.path.join('out', 'profile.trace.json'))
+        self.assertEqual(image_bytes(Image.new('RGBA', (10, 10))), 400)
+        self.assertEqual(image_bytes(Image.new('1', (16, 2))), 4)
+        self.assertEqual(buffer_bytes('RGB', (10, 10)), 400)
+        self.assertEqual(buffer_bytes('I;16', (10, 10)), 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
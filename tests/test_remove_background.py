@@ -1,13 +1,21 @@
 import os
 import sys
+import shutil
+import tempfile
+import threading
 import unittest
-from unittest.mock import patch
+from types import SimpleNamespace
+from unittest.mock import patch, MagicMock
+
+import numpy as np
 from PIL import Image, ImageChops
 
 # Add the project root to the Python path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from remove_background import remove_background, trim
+from cache import MaskCache
+from remove_background import (BatchedSessions, SessionPool, cutout, make_proxy, remove, remove_background, trim,
+                               trimmed_cutout, upsample_mask)
 
 
 class TestRemoveBackground(unittest.TestCase):
@@ -34,8 +42,9 @@ class TestRemoveBackground(unittest.TestCase):
         diff = ImageChops.difference(trimmed_img, img)
         self.assertFalse(diff.getbbox())
 
+    @patch('remove_background.new_session')
     @patch('remove_background.remove')
-    def test_remove_background_with_mock(self, mock_remove):
+    def test_remove_background_with_mock(self, mock_remove, mock_new_session):
         """Test the remove_background function with a mocked rembg.remove."""
         # Open a test image
         img = Image.open(self.test_image_path)
@@ -59,6 +68,39 @@ class TestRemoveBackground(unittest.TestCase):
         # A better test would be to also mock trim, but for now this is ok.
         self.assertIsNotNone(output_img)
 
+    @patch('remove_background.remove')
+    def test_remove_background_uses_given_session(self, mock_remove):
+        """An explicit session is passed straight through to rembg."""
+        mock_remove.return_value = Image.new('RGBA', (10, 10), color=(255, 0, 0, 255))
+        session = MagicMock()
+        remove_background(Image.new('RGB', (10, 10)), session=session)
+        self.assertIs(mock_remove.call_args.kwargs['session'], session)
+
+    @patch('remove_background.remove')
+    def test_mask_cache_skips_the_model(self, mock_remove):
+        """A cached mask is reused, and the cutout matches rembg's own."""
+        from rembg.bg import naive_cutout
+        mask = Image.new('L', (30, 20), 0)
+        mask.paste(255, (5, 5, 25, 15))
+        mock_remove.return_value = mask
+        image = Image.new('RGB', (30, 20), (10, 200, 30))
+        cache_dir = tempfile.mkdtemp()
+        try:
+            mask_cache = MaskCache(cache_dir, 1024 * 1024)
+            first = remove_background(image, session=MagicMock(), mask_cache=mask_cache)
+            second = remove_background(image, session=MagicMock(), mask_cache=mask_cache)
+            mock_remove.assert_called_once()
+            self.assertTrue(mock_remove.call_args.kwargs['only_mask'])
+            self.assertEqual(mask_cache.counts, {'hits': 1, 'misses': 1})
+            expected = trim(naive_cutout(image, mask))
+            self.assertEqual(first.tobytes(), expected.tobytes())
+            self.assertEqual(second.tobytes(), expected.tobytes())
+            # A different model is a different entry
+            remove_background(image, model_name='u2netp', session=MagicMock(), mask_cache=mask_cache)
+            self.assertEqual(mock_remove.call_count, 2)
+        finally:
+            shutil.rmtree(cache_dir)
+
     def test_remove_background_integration(self):
         """Integration test for the remove_background function."""
         # Load the test image
@@ -74,5 +116,201 @@ class TestRemoveBackground(unittest.TestCase):
         self.assertTrue(any(pixel[3] == 0 for pixel in output_img.getdata()))
 
 
+class TestProxyMask(unittest.TestCase):
+
+    def test_make_proxy(self):
+        """The proxy's longest side is the proxy size, and odd modes are converted."""
+        self.assertEqual(make_proxy(Image.new('RGB', (600, 400)), 150).size, (150, 100))
+        self.assertEqual(make_proxy(Image.new('L', (400, 600)), 150).size, (100, 150))
+        self.assertEqual(make_proxy(Image.new('P', (600, 400)), 150).mode, 'RGB')
+
+    def test_constant_masks_stay_constant(self):
+        image = Image.effect_noise((600, 400), 40).convert('RGB')
+        proxy = make_proxy(image, 150)
+        for value in (0, 255):
+            mask = upsample_mask(Image.new('L', proxy.size, value), proxy, image)
+            self.assertEqual(mask.size, image.size)
+            self.assertEqual(mask.getextrema(), (value, value))
+
+    def test_upsampled_mask_follows_the_image_edge(self):
+        """An edge between proxy pixels comes out sharp, where plain upsampling blurs it."""
+        pixels = np.full((400, 600), 40, dtype=np.uint8)
+        pixels[:, 303:] = 220
+        image = Image.fromarray(pixels).convert('RGB')
+        proxy = make_proxy(image, 150)
+        mask = Image.fromarray(np.where(np.asarray(proxy.convert('L')) > 130, 255, 0).astype(np.uint8))
+        truth = np.where(pixels > 130, 255, 0)
+        upsampled = np.asarray(upsample_mask(mask, proxy, image)).astype(int)
+        resized = np.asarray(mask.resize(image.size, Image.Resampling.BILINEAR)).astype(int)
+        self.assertLess(np.abs(upsampled - truth).max(), 32)
+        self.assertGreater(np.abs(resized - truth).max(), 128)
+
+    def test_trimmed_cutout_matches_trim_of_cutout(self):
+        rng = np.random.default_rng(0)
+        for mode in ('RGB', 'L', 'RGBA'):
+            image = Image.fromarray(rng.integers(0, 256, (40, 50, 3), dtype=np.uint8)).convert(mode)
+            for corner in (0, 200):
+                pixels = np.zeros((40, 50), dtype=np.uint8)
+                pixels[10:30, 5:20] = rng.integers(0, 256, (20, 15))
+                pixels[0, 0] = corner
+                mask = Image.fromarray(pixels)
+                self.assertEqual(trimmed_cutout(image, mask).tobytes(), trim(cutout(image, mask)).tobytes())
+        # Nothing above the threshold: like trim(), the whole cutout is kept
+        image = Image.new('RGB', (20, 10), 'red')
+        self.assertEqual(trimmed_cutout(image, Image.new('L', (20, 10), 50)).size, (20, 10))
+
+    @patch('remove_background.remove')
+    def test_model_runs_on_the_proxy(self, mock_remove):
+        """The model sees the proxy, the cache keeps the proxy's mask, the cutout is full size."""
+        mock_remove.side_effect = lambda image, **kwargs: Image.new('L', image.size, 255)
+        image = Image.new('RGB', (800, 600), (10, 200, 30))
+        cache_dir = tempfile.mkdtemp()
+        try:
+            mask_cache = MaskCache(cache_dir, 1024 * 1024)
+            output = remove_background(image, session=MagicMock(), mask_cache=mask_cache, proxy_size=200,
+                                       opt_border_width=0)
+            self.assertEqual(mock_remove.call_args[0][0].size, (200, 150))
+            self.assertEqual(output.size, (800, 600))
+            self.assertEqual(output.getpixel((400, 300)), (10, 200, 30, 255))
+            key = mask_cache.make_key(make_proxy(image, 200), 'u2net')
+            self.assertEqual(mask_cache.load(key).size, (200, 150))
+            # Images no larger than the proxy size go to the model as they are
+            remove_background(Image.new('RGB', (100, 80)), session=MagicMock(), proxy_size=200)
+            self.assertEqual(mock_remove.call_args[0][0].size, (100, 80))
+        finally:
+            shutil.rmtree(cache_dir)
+
+
+class TestSessionPool(unittest.TestCase):
+
+    @patch('remove_background.new_session')
+    def test_model_is_loaded_once(self, mock_new_session):
+        """Repeated requests for the same model reuse the loaded session."""
+        pool = SessionPool()
+        first = pool.get('u2net')
+        second = pool.get('u2net')
+        self.assertIs(first, second)
+        mock_new_session.assert_called_once_with('u2net')
+
+    @patch('remove_background.new_session', side_effect=lambda name: MagicMock(name=name))
+    def test_one_session_per_model(self, mock_new_session):
+        """Different models get different sessions."""
+        pool = SessionPool()
+        pool.warm_up('u2net', 'isnet-general-use')
+        self.assertEqual(mock_new_session.call_count, 2)
+        self.assertEqual(pool.loaded_models(), ['isnet-general-use', 'u2net'])
+        self.assertIsNot(pool.get('u2net'), pool.get('isnet-general-use'))
+
+    @patch('remove_background.new_session', side_effect=lambda name: MagicMock(name=name))
+    def test_threads_share_a_session(self, mock_new_session):
+        """Threads share one session per model."""
+        pool = SessionPool()
+        sessions = []
+        thread = threading.Thread(target=lambda: sessions.append(pool.get('u2net')))
+        thread.start()
+        thread.join()
+        self.assertIs(pool.get('u2net'), sessions[0])
+        mock_new_session.assert_called_once_with('u2net')
+
+    @patch('remove_background.new_session', side_effect=lambda name: MagicMock(name=name))
+    def test_close(self, mock_new_session):
+        """Closing drops sessions so the next request loads the model again."""
+        pool = SessionPool()
+        pool.warm_up('u2net', 'u2netp')
+        pool.close('u2netp')
+        self.assertEqual(pool.loaded_models(), ['u2net'])
+        pool.close()
+        self.assertEqual(pool.loaded_models(), [])
+        pool.get('u2net')
+        self.assertEqual(mock_new_session.call_count, 3)
+
+    @patch('remove_background.new_session', side_effect=lambda name: MagicMock(name=name))
+    def test_last_release_drops_sessions(self, mock_new_session):
+        """Sessions stay loaded until every user of the pool has released it."""
+        pool = SessionPool()
+        pool.acquire()
+        pool.acquire()
+        pool.warm_up('u2net')
+        pool.release()
+        self.assertEqual(pool.loaded_models(), ['u2net'])
+        pool.release()
+        self.assertEqual(pool.loaded_models(), [])
+
+
+class FakeInferenceSession:
+    """A deterministic stand-in for the onnxruntime session of a rembg U2netSession."""
+
+    def __init__(self, batch_dimension='batch_size'):
+        self.batch_dimension = batch_dimension
+        self.batch_sizes = []
+
+    def get_inputs(self):
+        return [SimpleNamespace(name='input.1', shape=[self.batch_dimension, 3, 320, 320])]
+
+    def run(self, output_names, input_feed, run_options=None):
+        x = input_feed['input.1']
+        if self.batch_dimension == 1 and x.shape[0] != 1:
+            raise ValueError('fixed batch size')
+        self.batch_sizes.append(x.shape[0])
+        return [np.tanh(x[:, :1] * 0.7 - x[:, 1:2] * 0.3 + x[:, 2:3] ** 2)]
+
+
+def fake_u2net_session(inference_session):
+    from rembg.sessions.u2net import U2netSession
+    session = U2netSession.__new__(U2netSession)
+    session.model_name = 'u2net'
+    session.inner_session = inference_session
+    return session
+
+
+class TestBatchedSessions(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(3)
+        self.images = [Image.fromarray((rng.random((40 + i, 50, 3)) * 255).astype(np.uint8)) for i in range(6)]
+
+    def masks(self, batch_dimension, max_batch):
+        """Computes the masks of all images from concurrent threads, through BatchedSessions."""
+        inference_session = FakeInferenceSession(batch_dimension)
+        pool = SessionPool()
+        with patch('remove_background.new_session', return_value=fake_u2net_session(inference_session)):
+            sessions = BatchedSessions(max_batch, max_wait=0.5, pool=pool)
+            barrier = threading.Barrier(len(self.images))
+            masks = [None] * len(self.images)
+
+            def run(index):
+                session = sessions.get('u2net')
+                barrier.wait()
+                masks[index] = remove(self.images[index], session=session, only_mask=True)
+
+            threads = [threading.Thread(target=run, args=(index,)) for index in range(len(self.images))]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            sessions.close()
+        return masks, sessions.counts, inference_session.batch_sizes
+
+    def test_batched_masks_match_unbatched(self):
+        """Model runs of concurrent calls are batched, and every image gets the mask it gets alone."""
+        expected = [remove(image, session=fake_u2net_session(FakeInferenceSession()), only_mask=True)
+                    for image in self.images]
+        masks, counts, batch_sizes = self.masks('batch_size', max_batch=4)
+        self.assertEqual([mask.tobytes() for mask in masks], [mask.tobytes() for mask in expected])
+        self.assertEqual(sum(batch_sizes), 6)
+        self.assertGreater(max(batch_sizes), 1)
+        self.assertLessEqual(max(batch_sizes), 4)
+        self.assertEqual((counts['images'], counts['runs']), (6, len(batch_sizes)))
+
+    def test_fixed_batch_size_runs_one_at_a_time(self):
+        """A model exported with a batch size of one runs the waiting images one after the other."""
+        expected = [remove(image, session=fake_u2net_session(FakeInferenceSession()), only_mask=True)
+                    for image in self.images]
+        masks, counts, batch_sizes = self.masks(1, max_batch=4)
+        self.assertEqual([mask.tobytes() for mask in masks], [mask.tobytes() for mask in expected])
+        self.assertEqual(batch_sizes, [1] * 6)
+        self.assertEqual((counts['images'], counts['runs']), (6, 6))
+
+
 if __name__ == '__main__':
     unittest.main()
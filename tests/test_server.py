@@ -0,0 +1,136 @@
+import contextlib
+import io
+import json
+import os
+import sys
+import queue
+import threading
+import unittest
+import urllib.error
+import urllib.request
+from types import SimpleNamespace
+from unittest.mock import patch
+from urllib.parse import quote
+
+from PIL import Image, ImageOps
+
+# Add the project root to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from server import make_server, parse_chain, percentile
+
+
+def png_bytes(image):
+    buffer = io.BytesIO()
+    image.save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+class TestParseChain(unittest.TestCase):
+
+    def test_operations_and_settings(self):
+        """A chain is parsed like the flags of main.py, keeping the operation order."""
+        operations, settings = parse_chain('--scale 0.5x --grayscale --format webp --quality 70')
+        self.assertEqual(operations, [{'dest': 'scale', 'values': ['0.5x']}, {'dest': 'grayscale', 'values': []}])
+        self.assertEqual(settings['formats'], ['webp'])
+        self.assertEqual(settings['quality'], 70)
+
+    def test_invalid_chains(self):
+        """Unknown flags, server settings, several formats and --help are rejected."""
+        for chain in ('--sharpen 3', '--jobs 4', '--cache', '--format png webp', '--quality 0', '--help', 'a.png'):
+            with self.subTest(chain=chain), contextlib.redirect_stderr(io.StringIO()):
+                with self.assertRaises(ValueError):
+                    parse_chain(chain)
+
+
+class TestPercentile(unittest.TestCase):
+
+    def test_nearest_rank(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 0.5), 50)
+        self.assertEqual(percentile(values, 0.99), 99)
+        self.assertEqual(percentile(values, 1.0), 100)
+        self.assertEqual(percentile([7], 0.9), 7)
+        self.assertIsNone(percentile([], 0.5))
+
+
+class TestServer(unittest.TestCase):
+
+    def setUp(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.server = make_server([{'dest': 'invert', 'values': []}], SimpleNamespace(jobs=2), port=0)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.image = Image.new('RGB', (12, 8), (200, 100, 50))
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.server.service.close()
+        self.thread.join()
+
+    def post(self, data, chain=None):
+        url = f'{self.url}/process' + (f'?chain={quote(chain)}' if chain is not None else '')
+        with contextlib.redirect_stdout(io.StringIO()):
+            with urllib.request.urlopen(urllib.request.Request(url, data=data, method='POST'), timeout=10) as response:
+                return response.status, response.headers, response.read()
+
+    def get_json(self, path):
+        with urllib.request.urlopen(self.url + path, timeout=10) as response:
+            return json.loads(response.read())
+
+    def test_default_chain(self):
+        """Without a chain the operations given at startup are applied."""
+        status, headers, body = self.post(png_bytes(self.image))
+        self.assertEqual(status, 200)
+        self.assertEqual(headers['Content-Type'], 'image/png')
+        self.assertIn('X-Processing-Ms', headers)
+        self.assertEqual(Image.open(io.BytesIO(body)).tobytes(), ImageOps.invert(self.image).tobytes())
+
+    def test_request_chain_and_format(self):
+        """The request's chain replaces the default one, and its format is returned."""
+        status, headers, body = self.post(png_bytes(self.image), '--flip horizontal --scale 0.5x --format webp')
+        self.assertEqual(headers['Content-Type'], 'image/webp')
+        output = Image.open(io.BytesIO(body))
+        self.assertEqual((output.format, output.size), ('WEBP', (6, 4)))
+
+    def test_bad_requests(self):
+        """Invalid chains and data that is not an image are answered with 400."""
+        for data, chain in ((png_bytes(self.image), '--bogus'), (b'not an image', None)):
+            with self.subTest(chain=chain), self.assertRaises(urllib.error.HTTPError) as raised:
+                self.post(data, chain)
+            self.assertEqual(raised.exception.code, 400)
+            self.assertIn('error', json.loads(raised.exception.read()))
+
+    def test_busy_server_answers_503(self):
+        """When the queue is full the request is rejected with 503 and Retry-After."""
+        with patch.object(self.server.service.batcher, 'submit', side_effect=queue.Full), \
+                self.assertRaises(urllib.error.HTTPError) as raised:
+            self.post(png_bytes(self.image))
+        self.assertEqual(raised.exception.code, 503)
+        self.assertEqual(raised.exception.headers['Retry-After'], '1')
+        self.assertEqual(self.get_json('/stats')['rejected'], 1)
+
+    def test_concurrent_requests_and_stats(self):
+        """Concurrent requests all succeed, and /stats counts them with their latency percentiles."""
+        statuses = []
+
+        def client():
+            statuses.append(self.post(png_bytes(self.image))[0])
+
+        clients = [threading.Thread(target=client) for _ in range(6)]
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+        self.assertEqual(statuses, [200] * 6)
+        stats = self.get_json('/stats')
+        self.assertEqual((stats['processed'], stats['failed'], stats['rejected']), (6, 0, 0))
+        self.assertEqual(stats['latency']['count'], 6)
+        self.assertLessEqual(stats['latency']['p50_ms'], stats['latency']['max_ms'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import io
+import os
+import sys
+import unittest
+from contextlib import redirect_stdout
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import numpy as np
+from PIL import Image, ImageFilter
+
+# Add the project root to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from image_filters import edge_map
+from processing import apply_operations
+from scale_image import RESAMPLE_FILTERS, resize_image
+from strips import edge_map_in_strips, resize_in_strips, strip_bounds
+
+
+class TestStrips(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(2)
+        noise = (rng.random((97, 131, 4)) * 255).astype(np.uint8)
+        self.image = Image.fromarray(noise).filter(ImageFilter.GaussianBlur(1.5))
+        # Small strips, so that the test images are split into many of them
+        patcher = patch('strips.MIN_STRIP_ROWS', 4)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_strip_bounds(self):
+        self.assertEqual(strip_bounds(13, 3), [(0, 4), (4, 8), (8, 13)])
+        self.assertEqual(strip_bounds(10, 1), [(0, 10)])
+        # No strip is shorter than MIN_STRIP_ROWS
+        self.assertEqual(strip_bounds(9, 8), [(0, 4), (4, 9)])
+        self.assertEqual(strip_bounds(3, 8), [(0, 3)])
+
+    def test_edge_detection_matches_one_piece(self):
+        for mode in ('L', 'RGB', 'RGBA'):
+            image = self.image.convert(mode)
+            for method in ('sobel', 'canny', 'kovalevsky', 'all'):
+                expected = edge_map(image, method, 20)
+                for threads in (2, 3, 8, 24):
+                    with self.subTest(mode=mode, method=method, threads=threads):
+                        np.testing.assert_array_equal(edge_map_in_strips(image, method, 20, threads), expected)
+
+    def test_resize_matches_one_piece(self):
+        for mode in ('L', 'RGB', 'RGBA', 'P'):
+            image = self.image.convert(mode)
+            for size in ((65, 48), (40, 31), (262, 194), (131, 30), (50, 97), (197, 150)):
+                for resample_filter in RESAMPLE_FILTERS:
+                    expected = resize_image(image, size, resample_filter)
+                    for threads in (2, 5):
+                        with self.subTest(mode=mode, size=size, resample_filter=resample_filter, threads=threads):
+                            output = resize_in_strips(image, size, resample_filter, threads)
+                            self.assertEqual(output.mode, expected.mode)
+                            self.assertEqual(output.tobytes(), expected.tobytes())
+
+    def test_invalid_filter(self):
+        with self.assertRaises(ValueError):
+            resize_in_strips(self.image, (10, 10), 'cubic', 4)
+
+    def test_threads_setting_in_pipeline(self):
+        operations = [{'dest': 'scale', 'values': ['0.7x']}, {'dest': 'edge_detection', 'values': ['canny']}]
+        outputs = []
+        for threads in (None, 4):
+            args = SimpleNamespace(threshold=50, resample='lanczos', threads=threads)
+            with redirect_stdout(io.StringIO()):
+                outputs.append(apply_operations(self.image, 'test', operations, args).tobytes())
+        self.assertEqual(outputs[0], outputs[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
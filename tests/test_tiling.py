@@ -0,0 +1,110 @@
+import io
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import numpy as np
+import tifffile
+from PIL import Image, ImageFilter
+
+# Add the project root to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import tiling
+from image_io import open_image
+from processing import apply_operations
+from tiling import run_tiled, tileable_prefix
+
+
+def _op(dest, *values):
+    return {'dest': dest, 'values': list(values)}
+
+
+class TestTiling(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(1)
+        noise = (rng.random((90, 120, 3)) * 255).astype(np.uint8)
+        self.image = Image.fromarray(noise).filter(ImageFilter.GaussianBlur(1.5))
+        self.args = SimpleNamespace(threshold=50, resample='bilinear')
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def untiled(self, operations):
+        with redirect_stdout(io.StringIO()):
+            return apply_operations(self.image, 'test', operations, self.args)
+
+    def test_tiled_output_matches_untiled(self):
+        """Band by band processing gives exactly the untiled result, also with tiny bands."""
+        chains = [
+            [_op('edge_detection', 'sobel')],
+            [_op('edge_detection', 'kovalevsky')],
+            [_op('edge_detection', 'canny')],
+            [_op('invert'), _op('flip', 'vertical'), _op('edge_detection', 'kovalevsky'), _op('flip', 'both')],
+            [_op('flip', 'vertical'), _op('edge_detection', 'canny'), _op('brightness', 20)],
+            [_op('pointwise', _op('brightness', 30), _op('saturation', -40)), _op('edge_detection', 'sobel')],
+        ]
+        for operations in chains:
+            expected = self.untiled(operations).tobytes()
+            for tile_rows in (1, 7, 16, 200):
+                with self.subTest(operations=operations, tile_rows=tile_rows):
+                    output, remaining = run_tiled(self.image, operations, self.args, tile_rows)
+                    self.assertEqual(remaining, [])
+                    self.assertEqual(output.tobytes(), expected)
+
+    def test_whole_image_operations_end_the_tiled_part(self):
+        operations = [_op('invert'), _op('contrast', 20), _op('grayscale')]
+        self.assertEqual(tileable_prefix(operations), 1)
+        self.assertEqual(tileable_prefix([_op('pointwise', _op('invert'), _op('contrast', 5))]), 0)
+        self.assertEqual(tileable_prefix([_op('scale', '0.5x'), _op('invert')]), 0)
+        # The three edge maps of 'all' are made from the whole image
+        self.assertEqual(tileable_prefix([_op('edge_detection', 'canny'), _op('edge_detection', 'all')]), 1)
+        output, remaining = run_tiled(self.image, operations, self.args, 16)
+        self.assertEqual(remaining, operations[1:])
+        self.assertEqual(output.tobytes(), self.untiled(operations[:1]).tobytes())
+
+    def test_tiff_is_read_band_by_band(self):
+        """Strip and tile TIFFs are read from their strips/tiles without decoding the whole file."""
+        rgba = np.dstack([np.asarray(self.image), np.full((90, 120), 200, np.uint8)])
+        files = {
+            'strips.tif': dict(data=rgba, rowsperstrip=8, compression='zlib', extrasamples=['unassalpha']),
+            'tiles.tif': dict(data=np.asarray(self.image), tile=(32, 48), compression='zlib'),
+            'gray.tif': dict(data=np.asarray(self.image.convert('L')), rowsperstrip=5),
+        }
+        operations = [_op('flip', 'vertical'), _op('edge_detection', 'sobel')]
+        for name, options in files.items():
+            with self.subTest(name=name):
+                path = os.path.join(self.temp_dir, name)
+                tifffile.imwrite(path, options.pop('data'), photometric=None, **options)
+                with Image.open(path) as full:
+                    full.load()
+                    with redirect_stdout(io.StringIO()):
+                        expected = apply_operations(full, name, operations, self.args).tobytes()
+                with patch.object(tiling, 'decode_image') as decode_image:
+                    output, _ = run_tiled(Image.open(path), operations, self.args, 16)
+                decode_image.assert_not_called()
+                self.assertEqual(output.tobytes(), expected)
+
+    def test_memory_mapped_frame_is_read_band_by_band(self):
+        """A frame over a memory map (image_io.map_image) is processed from the rows of each band."""
+        path = os.path.join(self.temp_dir, 'scan.npy')
+        np.save(path, np.asarray(self.image))
+        operations = [_op('invert'), _op('flip', 'vertical'), _op('edge_detection', 'sobel')]
+        output, _ = run_tiled(open_image(path), operations, self.args, 16)
+        self.assertEqual(output.tobytes(), self.untiled(operations).tobytes())
+
+    def test_unsupported_tiff_falls_back_to_full_decode(self):
+        path = os.path.join(self.temp_dir, 'wide.tif')
+        tifffile.imwrite(path, np.zeros((20, 30, 3), np.uint16), photometric='rgb')
+        self.assertIsNone(tiling._TiffSource.open(path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+import contextlib
+import io
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from PIL import Image
+
+# Add the project root to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import processing
+from watch import FolderWatcher, watch_folder
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestFolderWatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.clock = FakeClock()
+        self.watcher = FolderWatcher(self.directory, settle_seconds=1.0, clock=self.clock)
+        self.path = os.path.join(self.directory, 'photo.png')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def poll_at(self, now):
+        self.clock.now = now
+        return [path for path, _ in self.watcher.poll()]
+
+    def test_file_is_returned_once_it_settles(self):
+        """A new file is returned after it has stayed unchanged for the settle time, and only once."""
+        Image.new('RGB', (4, 4)).save(self.path)
+        self.assertEqual(self.poll_at(0.0), [])
+        self.assertEqual(self.poll_at(0.5), [])
+        self.assertEqual(self.poll_at(1.0), [self.path])
+        self.assertEqual(self.poll_at(5.0), [])
+
+    def test_growing_file_is_not_returned(self):
+        """A file that is still being written restarts the settle time every time it changes."""
+        with open(self.path, 'wb') as f:
+            f.write(b'\x89PNG')
+            f.flush()
+            self.assertEqual(self.poll_at(0.0), [])
+            f.write(b'\x00' * 100)
+            f.flush()
+            self.assertEqual(self.poll_at(1.0), [])
+            self.assertEqual(self.poll_at(1.5), [])
+        self.assertEqual(self.poll_at(2.0), [self.path])
+
+    def test_empty_and_non_image_files_are_ignored(self):
+        """Empty files (just created) and files that are not images are never returned."""
+        open(self.path, 'wb').close()
+        with open(os.path.join(self.directory, 'notes.txt'), 'w') as f:
+            f.write('not an image')
+        os.makedirs(os.path.join(self.directory, 'folder.png'))
+        for now in (0.0, 1.0, 2.0):
+            self.assertEqual(self.poll_at(now), [])
+
+    def test_replaced_file_is_returned_again(self):
+        """A file replaced by a new version after it was returned is returned again once it settles."""
+        Image.new('RGB', (4, 4)).save(self.path)
+        self.poll_at(0.0)
+        self.assertEqual(self.poll_at(1.0), [self.path])
+        Image.new('RGB', (8, 8)).save(self.path)
+        self.assertEqual(self.poll_at(2.0), [])
+        self.assertEqual(self.poll_at(3.0), [self.path])
+
+
+class TestWatchFolder(unittest.TestCase):
+
+    def setUp(self):
+        """Run each test in a temporary working directory so Output/ stays isolated."""
+        self.original_cwd = os.getcwd()
+        self.work_dir = tempfile.mkdtemp()
+        os.chdir(self.work_dir)
+        os.makedirs('Inbox')
+
+    def tearDown(self):
+        os.chdir(self.original_cwd)
+        shutil.rmtree(self.work_dir)
+
+    def watch(self, operations, expected_outputs, args=None):
+        """Runs watch_folder in a thread until the expected outputs exist, and returns its results."""
+        stop = threading.Event()
+        returned = []
+        args = args or SimpleNamespace(jobs=1)
+
+        def run():
+            with contextlib.redirect_stdout(io.StringIO()):
+                returned.extend(watch_folder('Inbox', operations, args, poll_interval=0.01,
+                                             settle_seconds=0.0, stop=stop))
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        try:
+            deadline = time.monotonic() + 10
+            while not all(os.path.exists(path) for path in expected_outputs) and time.monotonic() < deadline:
+                time.sleep(0.01)
+        finally:
+            stop.set()
+            thread.join()
+        return returned
+
+    def test_processes_dropped_files_and_moves_them(self):
+        """Dropped images are processed through the chain and moved out of the watched folder."""
+        Image.new('RGB', (6, 4), (255, 0, 0)).save(os.path.join('Inbox', 'a.png'))
+        Image.new('RGB', (6, 4), (0, 255, 0)).save(os.path.join('Inbox', 'b.png'))
+        results = self.watch([{'dest': 'invert', 'values': []}], ['Output/a.png', 'Output/b.png'])
+
+        self.assertEqual(sorted(result['name'] for result in results), ['a.png', 'b.png'])
+        self.assertTrue(all(result['error'] is None and result['latency'] >= result['seconds'] >= 0
+                            for result in results))
+        self.assertEqual(Image.open('Output/a.png').getpixel((0, 0)), (0, 255, 255))
+        self.assertEqual(sorted(os.listdir(os.path.join('Inbox', 'Base Images'))), ['a.png', 'b.png'])
+        self.assertEqual([name for name in os.listdir('Inbox') if name.endswith('.png')], [])
+
+    def test_chain_is_warmed_up_before_the_first_file(self):
+        """The chain runs once on a blank image before watching starts, so models load up front."""
+        calls = []
+        original_invert = processing.operation_handlers['invert']
+
+        def recording_invert(image, image_name, values, args):
+            calls.append(image_name)
+            return original_invert(image, image_name, values, args)
+
+        Image.new('RGB', (6, 4)).save(os.path.join('Inbox', 'a.png'))
+        with patch.dict(processing.operation_handlers, {'invert': recording_invert}):
+            self.watch([{'dest': 'invert', 'values': []}], ['Output/a.png'])
+        self.assertEqual(calls, ['warm-up', 'a.png'])
+
+
+if __name__ == '__main__':
+    unittest.main()
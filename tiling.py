@@ -0,0 +1,373 @@
+"""
+Tiled execution for images too large to process in one piece.
+
+The leading operations of a chain that only look at a pixel's neighbourhood are run on
+horizontal bands of the image, one band at a time, and the results are stitched into the
+output image. Each band is read with enough rows of overlap ("halo") on either side for
+the neighbourhood operations: 2 rows for Sobel, 3 for the 6-pixel Kovalevsky window and 8
+for Canny's Gaussian smoothing, gradient and non-maximum suppression. Canny's hysteresis
+step links edges across the whole image, so it is done over all bands (see hysteresis)
+before Canny's bands are handed on. The output is the same as processing the image in one
+piece.
+
+Operations that need the whole image (contrast, which uses the mean grey level, scale and
+background removal) end the tiled part of the chain; they and everything after them run on
+the stitched image as usual.
+
+Uncompressed or compressed 8-bit L, RGB and RGBA TIFFs are read strip by strip (or tile
+row by tile row), so neither the input nor the intermediate results are ever held in
+full; peak memory is the output image plus a few bands. Other formats are decoded in full
+first and then processed in bands, which still avoids the full-size temporaries of every
+step.
+"""
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+from flip_image import flip_image
+from image_filters import adjust_brightness, adjust_saturation, edge_detection, grayscale, invert_colors
+from frame import Frame
+from image_io import decode_image, tiff_page_mode
+from pointwise import FUSED_DEST, apply_pointwise
+
+DEFAULT_TILE_ROWS = 512
+MIN_TILE_ROWS = 16
+
+# Rows of context each neighbourhood operation needs on either side of a band
+SOBEL_HALO = 2
+KOVALEVSKY_HALO = 3
+CANNY_HALO = 8
+# skimage's default Canny thresholds, as fractions of the intensity range
+CANNY_LOW_THRESHOLD = 0.1
+CANNY_HIGH_THRESHOLD = 0.2
+
+_BAND_FUNCTIONS = {
+    'invert': lambda image, values: invert_colors(image),
+    'grayscale': lambda image, values: grayscale(image),
+    'brightness': lambda image, values: adjust_brightness(image, values[0]),
+    'saturation': lambda image, values: adjust_saturation(image, values[0]),
+    FUSED_DEST: apply_pointwise,
+}
+
+
+def tileable_prefix(operations):
+    """
+    Counts the leading operations that can run band by band.
+
+    :param operations: The planned operations.
+    :return: The number of operations at the start of the chain that can be tiled.
+    """
+    count = 0
+    for operation in operations:
+        dest = operation['dest']
+        if dest == FUSED_DEST:
+            tileable = all(step['dest'] != 'contrast' for step in operation['values'])
+        else:
+            tileable = dest in _BAND_FUNCTIONS or dest == 'flip' or (
+                dest == 'edge_detection' and operation['values'][0] != 'all')
+        if not tileable:
+            break
+        count += 1
+    return count
+
+
+def run_tiled(image, operations, cli_args, tile_rows=DEFAULT_TILE_ROWS):
+    """
+    Runs the tileable start of a chain band by band.
+
+    :param image: A decoded image, or an image opened with image_io.open_image that has not
+        been decoded yet (TIFF files are then read band by band).
+    :param operations: The planned operations.
+    :param cli_args: The parsed command-line arguments (threshold).
+    :param tile_rows: The height of a band.
+    :return: A tuple (image, operations) with the stitched result and the operations that
+        are left to run on it.
+    """
+    count = tileable_prefix(operations)
+    source = _open_source(image)
+    try:
+        stage = source
+        for operation in operations[:count]:
+            stage = _make_stage(stage, operation, cli_args, tile_rows)
+        output = None
+        for top in range(0, stage.height, tile_rows):
+            band = stage.rows(top, min(stage.height, top + tile_rows))
+            if output is None:
+                output = Image.new(band.mode, (stage.width, stage.height))
+            output.paste(band, (0, top))
+    finally:
+        source.close()
+    return output, list(operations[count:])
+
+
+# --- Band sources ---
+
+def _open_source(image):
+    if isinstance(image, Frame):
+        # E.g. a memory-mapped file (see image_io.map_image)
+        return _ArraySource(image.array())
+    if image.format == 'TIFF' and image.filename and image.tile:
+        source = _TiffSource.open(image.filename)
+        if source is not None:
+            image.close()
+            return source
+    return _ImageSource(decode_image(image))
+
+
+class _ImageSource:
+    """Bands of an image that is already in memory."""
+
+    def __init__(self, image):
+        self.image = image
+        self.width, self.height = image.size
+
+    def rows(self, top, bottom):
+        return self.image.crop((0, top, self.width, bottom))
+
+    def close(self):
+        pass
+
+
+class _ArraySource:
+    """Bands of an array, e.g. a memory map, of which only the rows of a band are read."""
+
+    def __init__(self, array):
+        self.array = array
+        self.height, self.width = array.shape[:2]
+
+    def rows(self, top, bottom):
+        return Image.fromarray(np.ascontiguousarray(self.array[top:bottom]))
+
+    def close(self):
+        pass
+
+
+class _TiffSource:
+    """
+    Bands of a TIFF file, decoding only the strips or tiles a band covers. The last few
+    decoded rows of strips/tiles are kept, so the overlap between bands is decoded once.
+    """
+
+    _CACHED_CHUNK_ROWS = 4
+
+    @classmethod
+    def open(cls, path):
+        """Returns a source for the first page of a TIFF file, or None if its layout is not supported."""
+        try:
+            import tifffile
+        except ImportError:
+            return None
+        try:
+            tiff = tifffile.TiffFile(path)
+        except Exception:
+            return None
+        page = tiff.pages[0]
+        mode = tiff_page_mode(page)
+        if mode is None:
+            tiff.close()
+            return None
+        return cls(tiff, page, mode)
+
+    def __init__(self, tiff, page, mode):
+        self._tiff = tiff
+        self._page = page
+        self.mode = mode
+        self.height, self.width = page.imagelength, page.imagewidth
+        self._samples = page.samplesperpixel
+        if page.is_tiled:
+            self._chunk_height, self._chunk_width = page.tilelength, page.tilewidth
+        else:
+            self._chunk_height, self._chunk_width = min(page.rowsperstrip or self.height, self.height), self.width
+        self._chunk_columns = -(-self.width // self._chunk_width)
+        self._cache = OrderedDict()
+
+    def rows(self, top, bottom):
+        first, last = top // self._chunk_height, (bottom - 1) // self._chunk_height
+        parts = []
+        for chunk_row in range(first, last + 1):
+            chunk_top = chunk_row * self._chunk_height
+            data = self._chunk_row(chunk_row)
+            parts.append(data[max(top, chunk_top) - chunk_top:bottom - chunk_top])
+        array = parts[0] if len(parts) == 1 else np.concatenate(parts)
+        return Image.fromarray(array[..., 0] if self._samples == 1 else array)
+
+    def _chunk_row(self, chunk_row):
+        data = self._cache.get(chunk_row)
+        if data is not None:
+            self._cache.move_to_end(chunk_row)
+            return data
+        page = self._page
+        chunk_top = chunk_row * self._chunk_height
+        height = min(self._chunk_height, self.height - chunk_top)
+        data = np.zeros((height, self.width, self._samples), dtype=np.uint8)
+        filehandle = self._tiff.filehandle
+        for column in range(self._chunk_columns):
+            index = chunk_row * self._chunk_columns + column
+            offset, byte_count = page.dataoffsets[index], page.databytecounts[index]
+            if not byte_count:
+                # Empty strip or tile
+                continue
+            filehandle.seek(offset)
+            segment = page.decode(filehandle.read(byte_count), index, jpegtables=page.jpegtables)[0]
+            left = column * self._chunk_width
+            width = min(self._chunk_width, self.width - left)
+            data[:, left:left + width] = segment[0, :height, :width]
+        self._cache[chunk_row] = data
+        if len(self._cache) > self._CACHED_CHUNK_ROWS:
+            self._cache.popitem(last=False)
+        return data
+
+    def close(self):
+        self._tiff.close()
+
+
+# --- Stages ---
+
+def _make_stage(upstream, operation, cli_args, tile_rows):
+    dest = operation['dest']
+    values = operation.get('values', [])
+    if dest == 'flip':
+        return _FlipStage(upstream, values[0])
+    if dest == 'edge_detection':
+        method = values[0]
+        if method == 'canny':
+            return _CannyStage(upstream, tile_rows)
+        if method == 'kovalevsky':
+            threshold = getattr(cli_args, 'threshold', 50)
+            # The Kovalevsky scan needs at least its 6-pixel window in both directions
+            return _FilterStage(upstream, lambda band: edge_detection(band, 'kovalevsky', threshold),
+                                KOVALEVSKY_HALO, min_rows=6)
+        return _FilterStage(upstream, lambda band: edge_detection(band, method), SOBEL_HALO)
+    function = _BAND_FUNCTIONS[dest]
+    return _FilterStage(upstream, lambda band: function(band, values), 0)
+
+
+class _FilterStage:
+    """An operation that needs ``halo`` rows of context on either side of a band."""
+
+    def __init__(self, upstream, function, halo, min_rows=1):
+        self.upstream = upstream
+        self.function = function
+        self.halo = halo
+        self.min_rows = min_rows
+        self.width, self.height = upstream.width, upstream.height
+
+    def rows(self, top, bottom):
+        start, stop = max(0, top - self.halo), min(self.height, bottom + self.halo)
+        if stop - start < self.min_rows:
+            start = max(0, stop - self.min_rows)
+            stop = min(self.height, start + self.min_rows)
+        band = self.function(self.upstream.rows(start, stop))
+        if (start, stop) == (top, bottom):
+            return band
+        return band.crop((0, top - start, band.width, bottom - start))
+
+
+class _FlipStage:
+    """A flip. Flipping vertically reads the mirrored rows of the upstream stage."""
+
+    def __init__(self, upstream, direction):
+        self.upstream = upstream
+        self.direction = direction
+        self.width, self.height = upstream.width, upstream.height
+
+    def rows(self, top, bottom):
+        if self.direction in ('vertical', 'both'):
+            top, bottom = self.height - bottom, self.height - top
+        return flip_image(self.upstream.rows(top, bottom), self.direction)
+
+
+class _CannyStage:
+    """
+    Canny edge detection. The thresholded non-maximum-suppressed edges of every band are
+    computed up front and kept as bit masks; hysteresis then runs over all bands, and
+    ``rows`` serves the final edges from the masks.
+    """
+
+    def __init__(self, upstream, tile_rows):
+        self.width, self.height = upstream.width, upstream.height
+        self._tile_rows = tile_rows
+        weak_bands, strong_bands = [], []
+        for top in range(0, self.height, tile_rows):
+            bottom = min(self.height, top + tile_rows)
+            start, stop = max(0, top - CANNY_HALO), min(self.height, bottom + CANNY_HALO)
+            gray = np.asarray(upstream.rows(start, stop).convert('L'))
+            weak, strong = canny_thresholds(gray)
+            core = slice(top - start, bottom - start)
+            weak_bands.append(np.packbits(weak[core], axis=1))
+            strong_bands.append(np.packbits(strong[core], axis=1))
+        self._edges = hysteresis(weak_bands, strong_bands, self.width)
+
+    def rows(self, top, bottom):
+        parts = []
+        for index in range(top // self._tile_rows, (bottom - 1) // self._tile_rows + 1):
+            band_top = index * self._tile_rows
+            edges = _unpack(self._edges[index], self.width)
+            parts.append(edges[max(top, band_top) - band_top:bottom - band_top])
+        edges = parts[0] if len(parts) == 1 else np.concatenate(parts)
+        return Image.fromarray(edges.astype(np.uint8) * 255)
+
+
+def canny_thresholds(gray):
+    """
+    Runs Canny up to, but not including, hysteresis.
+
+    :param gray: A 2D uint8 array.
+    :return: A tuple (weak, strong) of boolean arrays: the edge pixels after non-maximum
+        suppression that pass the low threshold, and those that pass the high threshold.
+    """
+    from skimage import feature
+
+    low = CANNY_LOW_THRESHOLD * 255
+    high = CANNY_HIGH_THRESHOLD * 255
+    # With equal thresholds, hysteresis keeps every pixel that passes them
+    weak = feature.canny(gray, low_threshold=low, high_threshold=low)
+    strong = feature.canny(gray, low_threshold=high, high_threshold=high)
+    return weak, strong
+
+
+def _unpack(packed, width):
+    return np.unpackbits(packed, axis=1, count=width).astype(bool)
+
+
+def hysteresis(weak_bands, strong_bands, width):
+    """
+    Hysteresis over a stack of bands: keeps the weak edge pixels that are 8-connected to a
+    strong one anywhere in the image, with only one band unpacked at a time.
+
+    Each band is labelled together with the already kept pixels in the adjacent rows of its
+    neighbours, and passes run down and up the stack until nothing changes, so edges
+    wandering across several bands are followed to the end.
+
+    :param weak_bands: Per band, the packed mask of pixels that pass the low threshold.
+    :param strong_bands: Per band, the packed mask of pixels that pass the high threshold.
+    :param width: The width of the image.
+    :return: Per band, the packed mask of edge pixels.
+    """
+    from scipy import ndimage
+
+    structure = np.ones((3, 3), dtype=bool)
+    kept = [np.zeros_like(band) for band in weak_bands]
+    order = list(range(len(weak_bands)))
+    order += order[-2:0:-1]
+    changed = True
+    while changed:
+        changed = False
+        for index in order:
+            weak = _unpack(weak_bands[index], width)
+            seeds = _unpack(strong_bands[index], width) | _unpack(kept[index], width)
+            above = _unpack(kept[index - 1][-1:], width) if index > 0 else np.zeros((0, width), bool)
+            below = (_unpack(kept[index + 1][:1], width) if index + 1 < len(kept)
+                     else np.zeros((0, width), bool))
+            labels, count = ndimage.label(np.concatenate([above, weak, below]), structure)
+            if count == 0:
+                continue
+            good = np.zeros(count + 1, dtype=bool)
+            good[labels[np.concatenate([above, seeds, below])]] = True
+            good[0] = False
+            edges = np.packbits(good[labels[len(above):len(above) + len(weak)]], axis=1)
+            if not np.array_equal(edges, kept[index]):
+                kept[index] = edges
+                changed = True
+    return kept
@@ -0,0 +1,175 @@
+"""
+Watch mode: a long-running process that processes images as they are dropped into a folder.
+
+The folder is polled with ``os.scandir``. A file is processed once its size and
+modification time have not changed for ``settle_seconds``, so files that are still being
+written or copied are left alone until they are complete. Processed files are moved into
+a subdirectory of the watched folder (``Base Images``, as in batch mode), which empties
+the drop folder and keeps them from being processed twice.
+
+Because the process stays up, the libraries and the rembg sessions are loaded once: the
+chain is run on a small blank image before watching starts, so even the first file does
+not pay for them. For every file the processing time and the latency (from the moment the
+file was first seen to the moment its output was saved) are logged.
+"""
+import contextlib
+import io
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from file_management import INPUT_EXTENSIONS
+from processing import apply_operations, close_run, open_run, process_and_save_image, report_result
+
+DEFAULT_POLL_INTERVAL = 1.0
+DEFAULT_SETTLE_SECONDS = 1.0
+PROCESSED_SUBDIRECTORY = 'Base Images'
+
+
+class FolderWatcher:
+    """
+    Finds the image files in a folder that have finished arriving.
+
+    Call poll() regularly; it returns each file once, when its size and modification time
+    have been stable for settle_seconds. A file that changes after it was returned (e.g. it
+    is replaced by a new version with the same name) is returned again once it settles.
+    """
+
+    def __init__(self, directory, settle_seconds=DEFAULT_SETTLE_SECONDS, clock=time.monotonic):
+        self.directory = directory
+        self.settle_seconds = settle_seconds
+        self._clock = clock
+        # path -> (signature, first seen, last change) of the files that have not settled yet
+        self._arriving = {}
+        # path -> signature of the files already returned
+        self._returned = {}
+
+    def poll(self):
+        """
+        Scans the folder once.
+
+        :return: A list of (path, first_seen) pairs for the files that have settled since the
+            last poll, oldest first. first_seen is a time of the watcher's clock.
+        """
+        now = self._clock()
+        present = set()
+        ready = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.name.lower().endswith(INPUT_EXTENSIONS) or entry.name.startswith('.'):
+                    continue
+                try:
+                    if not entry.is_file():
+                        continue
+                    stat = entry.stat()
+                except OSError:
+                    # Removed between the scan and the stat
+                    continue
+                present.add(entry.path)
+                signature = (stat.st_size, stat.st_mtime_ns)
+                if self._returned.get(entry.path) == signature:
+                    continue
+                previous = self._arriving.get(entry.path)
+                if previous is None:
+                    self._arriving[entry.path] = (signature, now, now)
+                elif previous[0] != signature:
+                    self._arriving[entry.path] = (signature, previous[1], now)
+                elif signature[0] > 0 and now - previous[2] >= self.settle_seconds:
+                    del self._arriving[entry.path]
+                    self._returned[entry.path] = signature
+                    ready.append((entry.path, previous[1]))
+        for path in set(self._arriving) - present:
+            del self._arriving[path]
+        for path in set(self._returned) - present:
+            del self._returned[path]
+        return sorted(ready, key=lambda item: item[1])
+
+
+def warm_up(ordered_operations, cli_args):
+    """
+    Loads what the chain needs (libraries imported on first use, rembg sessions) by running
+    it once on a small blank image.
+
+    :param ordered_operations: The operations to apply, in order.
+    :param cli_args: The parsed command-line arguments.
+    :return: The time the warm-up took in seconds.
+    """
+    start = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            apply_operations(Image.new('RGB', (64, 64), (128, 128, 128)), 'warm-up', ordered_operations, cli_args)
+    except Exception as e:
+        # The first real image reports the problem, if it persists
+        print(f"Warm-up failed: {e}")
+    return time.perf_counter() - start
+
+
+def watch_folder(directory, ordered_operations, cli_args, poll_interval=DEFAULT_POLL_INTERVAL,
+                 settle_seconds=DEFAULT_SETTLE_SECONDS, stop=None):
+    """
+    Processes the images dropped into a folder until stopped.
+
+    Files already in the folder when watching starts are processed too. With
+    ``cli_args.jobs`` greater than 1 several files are processed at the same time. The
+    caches are saved and the profile is written when watching stops.
+
+    :param directory: The folder to watch.
+    :param ordered_operations: The operations to apply to every image, in order.
+    :param cli_args: The parsed command-line arguments.
+    :param poll_interval: The time between two scans of the folder, in seconds.
+    :param settle_seconds: How long a file's size and modification time must stay the same
+        before it is processed.
+    :param stop: A threading.Event that ends watching when set. Without one, watching
+        continues until interrupted with Ctrl+C.
+    :return: One result dict per processed file (see processing.process_and_save_image),
+        with the added keys 'seconds' (processing time) and 'latency'.
+    """
+    stop = stop or threading.Event()
+    os.makedirs(directory, exist_ok=True)
+    processed_directory = os.path.join(directory, PROCESSED_SUBDIRECTORY)
+    watcher = FolderWatcher(directory, settle_seconds)
+    print(f"Loaded the operations in {warm_up(ordered_operations, cli_args) * 1000:.0f} ms.")
+    print(f'Watching "{directory}" for images (Ctrl+C to stop)...')
+
+    jobs = max(1, getattr(cli_args, 'jobs', 1) or 1)
+    cli_args, cache = open_run(cli_args, concurrent=jobs > 1)
+    results = []
+    results_lock = threading.Lock()
+
+    def process(path, first_seen):
+        start = time.monotonic()
+        result = process_and_save_image(os.path.basename(path), path, ordered_operations, cli_args, cache)
+        finished = time.monotonic()
+        result['seconds'] = finished - start
+        result['latency'] = finished - first_seen
+        try:
+            os.makedirs(processed_directory, exist_ok=True)
+            shutil.move(path, os.path.join(processed_directory, os.path.basename(path)))
+        except OSError as e:
+            print(f"Could not move {path} out of the watched folder: {e}")
+        with results_lock:
+            report_result(result)
+            print(f"{result['name']}: processed in {result['seconds'] * 1000:.0f} ms, "
+                  f"{result['latency'] * 1000:.0f} ms after it arrived")
+            results.append(result)
+
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            try:
+                while not stop.is_set():
+                    for path, first_seen in watcher.poll():
+                        executor.submit(process, path, first_seen)
+                    stop.wait(poll_interval)
+            except KeyboardInterrupt:
+                print("\nStopping; finishing the images in progress...")
+    finally:
+        if results:
+            latencies = sorted(result['latency'] for result in results)
+            print(f"Processed {len(results)} image(s); median latency "
+                  f"{latencies[len(latencies) // 2] * 1000:.0f} ms, worst {latencies[-1] * 1000:.0f} ms.")
+        close_run(cli_args, cache)
+    return results